@@ -50,6 +50,48 @@ class Settings:
         """The local path for where message attachments are stored"""
         return self.getAttr("CHATLLM_ATTACHMENT_URL", "./chat_data/messageAttachment")
 
+    @property
+    def applicationChatLLMMessageAttachmentStore(self) -> t.Literal["local", "s3"]:
+        """Where message attachments are stored, local uses the attachment path"""
+        store = self.getAttr("CHATLLM_ATTACHMENT_STORE", "local").lower()
+        if store not in ["local", "s3"]:
+            logger.warning(f"Unknown attachment store {store}, using local")
+            return "local"
+        return store  # type: ignore
+
+    @property
+    def applicationChatLLMMessageAttachmentS3Bucket(self) -> str:
+        """The S3 bucket message attachments are stored in"""
+        return self.getAttr("CHATLLM_ATTACHMENT_S3_BUCKET")
+
+    @property
+    def applicationChatLLMMessageAttachmentS3Prefix(self) -> str:
+        """The S3 key prefix message attachments are stored under"""
+        return self.getAttr("CHATLLM_ATTACHMENT_S3_PREFIX", "messageAttachment")
+
+    @property
+    def applicationChatLLMMessageAttachmentS3EndpointUrl(self) -> t.Optional[str]:
+        """The S3 compatible server url, e.g. a local MinIO, AWS is used if not set"""
+        return self.getAttr("CHATLLM_ATTACHMENT_S3_ENDPOINT_URL") or None
+
+    @property
+    def imageIngestWorkers(self) -> int:
+        """How many processes convert uploaded images, 0 converts them on the request thread"""
+        default = 2
+        try:
+            return max(0, int(self.getAttr("IMAGE_INGEST_WORKERS", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def imageIngestMaxDimension(self) -> int:
+        """The maximum width and height uploaded images are resized to"""
+        default = 2048
+        try:
+            return max(64, int(self.getAttr("IMAGE_INGEST_MAX_DIMENSION", str(default))))
+        except ValueError:
+            return default
+
     @property
     def azureOpenAIAPIKey(self) -> t.Optional[str]:
         """The Azure OpenAI API Key"""
@@ -79,6 +121,209 @@ class Settings:
         except ValueError:
             return default
 
+    @property
+    def applicationThreadPoolSize(self) -> int:
+        """How many blocking requests can be processed at the same time"""
+        default = 40
+        try:
+            return max(1, int(self.getAttr("APPLICATION_THREADPOOL_SIZE", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def outboundRequestTimeoutSeconds(self) -> float:
+        """How long to wait for an external service before giving up"""
+        default = 10.0
+        try:
+            return float(self.getAttr("OUTBOUND_REQUEST_TIMEOUT_SECONDS", str(default)))
+        except ValueError:
+            return default
+
+    @property
+    def chatLLMContextTokenBudget(self) -> int:
+        """How many estimated tokens of chat messages are sent to the llm"""
+        default = 16000
+        try:
+            return max(1000, int(self.getAttr("CHATLLM_CONTEXT_TOKEN_BUDGET", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def chatLLMContextKeepMessages(self) -> int:
+        """How many latest chat messages are sent to the llm verbatim, earlier ones are summorized"""
+        default = 8
+        try:
+            return max(1, int(self.getAttr("CHATLLM_CONTEXT_KEEP_MESSAGES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def chatLLMContextSummoryBatchMessages(self) -> int:
+        """How many earlier chat messages are summorized together, in the background, once they leave the verbatim messages"""
+        default = 4
+        try:
+            return max(1, int(self.getAttr("CHATLLM_SUMMORY_BATCH_MESSAGES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def chatLLMAttachmentCacheBytes(self) -> int:
+        """How many bytes of attachment data are kept in memory"""
+        default = 64 * 1024 * 1024
+        try:
+            return max(0, int(self.getAttr("CHATLLM_ATTACHMENT_CACHE_BYTES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def toolCachePath(self) -> t.Optional[str]:
+        """The sqlite file llm tool results are cached in for all workers, empty to cache in process only"""
+        return self.getAttr("TOOL_CACHE_PATH", "./chat_data/tool_cache.db") or None
+
+    @property
+    def toolCacheMemoryEntries(self) -> int:
+        """How many llm tool results each worker keeps in memory"""
+        default = 1024
+        try:
+            return max(0, int(self.getAttr("TOOL_CACHE_MEMORY_ENTRIES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def toolHttpConnectTimeoutSeconds(self) -> float:
+        """How long llm tools wait to connect to an external api"""
+        default = 5.0
+        try:
+            return float(self.getAttr("TOOL_HTTP_CONNECT_TIMEOUT_SECONDS", str(default)))
+        except ValueError:
+            return default
+
+    @property
+    def toolHttpReadTimeoutSeconds(self) -> float:
+        """How long llm tools wait for data from an external api"""
+        default = 20.0
+        try:
+            return float(self.getAttr("TOOL_HTTP_READ_TIMEOUT_SECONDS", str(default)))
+        except ValueError:
+            return default
+
+    @property
+    def toolHttpRetries(self) -> int:
+        """How many times llm tools retry a failed idempotent request"""
+        default = 2
+        try:
+            return max(0, int(self.getAttr("TOOL_HTTP_RETRIES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def toolHttpPoolSize(self) -> int:
+        """How many keep alive connections llm tools keep per external host"""
+        default = 8
+        try:
+            return max(1, int(self.getAttr("TOOL_HTTP_POOL_SIZE", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def openriceSearchCacheTTL(self) -> int:
+        """How many seconds Openrice restaurant search results are kept in memory, 0 to disable"""
+        default = 900
+        try:
+            return max(0, int(self.getAttr("OPENRICE_SEARCH_CACHE_TTL", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def openriceSearchCacheEntries(self) -> int:
+        """How many Openrice restaurant searches each worker keeps in memory"""
+        default = 256
+        try:
+            return max(0, int(self.getAttr("OPENRICE_SEARCH_CACHE_ENTRIES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def ttsAudioEncoding(self) -> t.Literal["LINEAR16", "OGG_OPUS", "MP3"]:
+        """The tts audio encoding used when a request does not choose one"""
+        encoding = self.getAttr("TTS_AUDIO_ENCODING", "LINEAR16").upper()
+        if encoding not in ["LINEAR16", "OGG_OPUS", "MP3"]:
+            return "LINEAR16"
+        return encoding  # type: ignore
+
+    @property
+    def ttsSynthesisWorkers(self) -> int:
+        """How many sentence chunks of a tts reply are synthesized at the same time"""
+        default = 4
+        try:
+            return max(1, int(self.getAttr("TTS_SYNTHESIS_WORKERS", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def ttsChunkChars(self) -> int:
+        """The maximum characters of a sentence chunk of a tts reply"""
+        default = 300
+        try:
+            return max(50, int(self.getAttr("TTS_CHUNK_CHARS", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def ttsPlaylistPrefetchChunks(self) -> int:
+        """How many leading chunks of a tts playlist are synthesized before they are requested"""
+        default = 2
+        try:
+            return max(0, int(self.getAttr("TTS_PLAYLIST_PREFETCH", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def ttsCachePath(self) -> t.Optional[str]:
+        """The directory synthesized speech is cached in, empty to cache in memory only"""
+        return self.getAttr("TTS_CACHE_PATH", "./chat_data/tts_cache") or None
+
+    @property
+    def ttsCacheBytes(self) -> int:
+        """How many bytes of synthesized speech are kept on disk"""
+        default = 256 * 1024 * 1024
+        try:
+            return max(0, int(self.getAttr("TTS_CACHE_BYTES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def ttsCacheMemoryBytes(self) -> int:
+        """How many bytes of synthesized speech each worker keeps in memory"""
+        default = 16 * 1024 * 1024
+        try:
+            return max(0, int(self.getAttr("TTS_CACHE_MEMORY_BYTES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def ttsCachePrewarmFile(self) -> t.Optional[str]:
+        """A text file of phrases, one per line, synthesized into the tts cache on start up in addition to the canned replies"""
+        return self.getAttr("TTS_CACHE_PREWARM_FILE") or None
+
+    @property
+    def sttUploadMaxBytes(self) -> int:
+        """The maximum bytes of an uploaded audio file for speech to text"""
+        default = 20 * 1024 * 1024
+        try:
+            return max(0, int(self.getAttr("STT_UPLOAD_MAX_BYTES", str(default))))
+        except ValueError:
+            return default
+
+    @property
+    def sttChunkSeconds(self) -> float:
+        """The maximum seconds of an audio chunk recognized in one request, the recognizer accepts up to 60"""
+        default = 50.0
+        try:
+            return min(55.0, max(5.0, float(self.getAttr("STT_CHUNK_SECONDS", str(default)))))
+        except ValueError:
+            return default
+
     @property
     def cognitoConfig(self) -> t.Optional[CognitoConfigMap]:
         region = self.getAttr("AWS_REGION")
@@ -1,4 +1,5 @@
 import os
+import threading
 import typing as t
 
 from fastapi import Depends
@@ -8,10 +9,18 @@ import sqlalchemy as sa
 import sqlalchemy.orm as so
 
 from ChatLLM.Tools import LLMTools
+from ChatLLM.Tools import Cache as ToolCache
+from ChatLLM.Tools import ExternalIo
+from ChatLLM.Tools.Openrice import cache as OpenriceCache
 from ChatLLMv2.ChatModel import v1ChainMigrate
+from ChatLLMv2.ChatModel.v1ChainMigrate import v1LLMChainModel
 from ChatLLMv2.ChatModel.Property import AdditionalModelProperty, AzureChatAIProperty
 from ChatLLMv2 import ChatController
 from ChatLLMv2 import DataHandler
+from ChatLLMv2 import ContextBuilder
+from ChatLLMv2 import Cache
+from ChatLLMv2 import BlobStore
+from ChatLLMv2 import ImageIngest
 
 from .modules.ApplicationModel import User
 
@@ -25,8 +34,13 @@ from .modules.Services.PermissionAndQuota.Permission import PermissionService
 from .modules.Services.Totp import TotpService
 from .modules.ChatLLMService import ChatLLMService
 from .modules.GoogleServices import GoogleServices
+from .modules.GoogleServices import GoogleClients
+from .modules.GoogleServices import CANNED_PHRASES
+from .modules.GoogleServices import prewarmTextToSpeech
+from .modules.TtsCache import TtsAudioCache
 from .modules.CognitoService import CognitoService
 from .modules.ServiceConfig import ServiceConfig
+from .modules.AttachmentStore import createBlobStore
 
 
 from .logger import logger
@@ -35,6 +49,19 @@ from .config import settings
 # ExternalIo.setLogger(logger)
 ChatController.setLogger(logger)
 DataHandler.setLogger(logger)
+ContextBuilder.setLogger(logger)
+Cache.setLogger(logger)
+BlobStore.setLogger(logger)
+ImageIngest.setLogger(logger)
+DataHandler.setAttachmentCache(Cache.ByteBudgetLRUCache(settings.chatLLMAttachmentCacheBytes))
+
+
+DataHandler.setBlobStore(createBlobStore())
+
+imageIngestPool = ImageIngest.ImageIngestPool(
+    workers=settings.imageIngestWorkers,
+    maxDimension=settings.imageIngestMaxDimension,
+)
 v1ChainMigrate.setLogger(logger)
 
 
@@ -45,6 +72,52 @@ else:
     credentials = Credentials.from_service_account_file(settings.gcpServiceAccountFilePath)  # type: ignore
 
 
+# grpc channels and the maps session are set up once per process, not per request
+googleClients = GoogleClients(
+    credentials=credentials,
+    apiKey=settings.googleApiKey,
+    synthesisWorkers=settings.ttsSynthesisWorkers,
+    synthesisChunkChars=settings.ttsChunkChars,
+    playlistPrefetchChunks=settings.ttsPlaylistPrefetchChunks,
+    recognitionChunkSeconds=settings.sttChunkSeconds,
+)
+
+ttsCache = TtsAudioCache(
+    path=settings.ttsCachePath,
+    maxBytes=settings.ttsCacheBytes,
+    memoryBytes=settings.ttsCacheMemoryBytes,
+)
+
+
+def prewarmTtsCache() -> None:
+    """Synthesize the canned replies, and the phrases of the prewarm file if set, into the tts cache."""
+    phrases = list(CANNED_PHRASES)
+    if settings.ttsCachePrewarmFile is not None:
+        try:
+            with open(settings.ttsCachePrewarmFile, encoding="utf-8") as f:
+                phrases += [line.strip() for line in f if line.strip()]
+        except OSError as e:
+            logger.warning(f"Cannot read tts prewarm file {settings.ttsCachePrewarmFile}: {e}")
+    prewarmTextToSpeech(googleClients, ttsCache, phrases, encoding=settings.ttsAudioEncoding)
+
+
+ToolCache.setToolResultCache(ToolCache.ToolResultCache(
+    path=settings.toolCachePath,
+    maxMemoryEntries=settings.toolCacheMemoryEntries,
+))
+ExternalIo.setHttpClient(
+    ExternalIo.HttpClient(
+        connectTimeout=settings.toolHttpConnectTimeoutSeconds,
+        readTimeout=settings.toolHttpReadTimeoutSeconds,
+        retries=settings.toolHttpRetries,
+        poolMaxSize=settings.toolHttpPoolSize,
+    ),
+)
+OpenriceCache.set_search_result_cache(OpenriceCache.SearchResultCache(
+    ttl_seconds=settings.openriceSearchCacheTTL,
+    max_entries=settings.openriceSearchCacheEntries,
+))
+
 llmModelProperty = AdditionalModelProperty(
     llmTools=LLMTools(
         credentials=credentials,
@@ -57,19 +130,76 @@ llmModelProperty = AdditionalModelProperty(
     ),
 )
 
-cognitoMetadata = CognitoService.CognitoMetadata()
-
 connectArgs: dict[str, t.Any] = dict()
 if not settings.applicationDatabaseURI.startswith("postgresql"):
     connectArgs["check_same_thread"] = False
 dbEngine = sa.create_engine(url=settings.applicationDatabaseURI, connect_args=connectArgs, logging_name=logger.name)
 
 
+def createDbSession() -> so.Session:
+    """
+    Create a database session outside of request dependencies, for work that outlives the request like response streams.
+
+    :return: The session, close it when done.
+    """
+    return so.Session(dbEngine)
+
+
 def getSession():
-    with so.Session(dbEngine) as session:
+    with createDbSession() as session:
         yield session
 
 
+def summorizeChatMessages(messages: list[DataHandler.ChatMessage], previousSummory: t.Optional[str]) -> str:
+    """
+    Summorize chat messages that no longer fit in the llm context.
+
+    :param messages: The messages to summorize.
+    :param previousSummory: The summory of the messages before them, if any.
+    :return: The summory of the messages.
+    """
+    # LlmHelper depends on this module, import on use
+    from .modules import LlmHelper
+    return LlmHelper.createChatSummory(messages, previousSummory, includeMedia=False)
+
+
+chatLLMContextBuilder = ContextBuilder.ContextBuilder(
+    summorizer=summorizeChatMessages,
+    tokenBudget=settings.chatLLMContextTokenBudget,
+    keepLastMessages=settings.chatLLMContextKeepMessages,
+    summorizeBatchMessages=settings.chatLLMContextSummoryBatchMessages,
+    sessionFactory=createDbSession,
+)
+
+chatLLMModel: t.Optional[v1LLMChainModel] = None
+chatLLMModelLock = threading.Lock()
+
+
+def getChatLLMModel() -> v1LLMChainModel:
+    """
+    Get the process wide chat llm model, created on first use.
+
+    The model holds the llm client with its http connection pool and the agent executor,
+    sharing it lets requests reuse warm keep-alive connections.
+    """
+    global chatLLMModel
+    if chatLLMModel is not None:
+        return chatLLMModel
+    with chatLLMModelLock:
+        if chatLLMModel is None:
+            logger.info("Creating shared chat llm model")
+            chatLLMModel = v1LLMChainModel(
+                credentials,
+                llmModelProperty,
+                chatLLMContextBuilder,
+                # one agent per blocking request thread streaming it
+                streamWorkers=settings.applicationThreadPoolSize,
+            )
+    return chatLLMModel
+
+
+cognitoMetadata = CognitoService.CognitoMetadata()
+
 getGoogleServicesType = t.Callable[[so.Session, t.Optional[User]], GoogleServices]
 getCognitoServiceType = t.Callable[[], CognitoService]
 getTotpServiceType = t.Callable[[], TotpService]
@@ -86,8 +216,8 @@ def getGoogleService() -> getGoogleServicesType:
         return GoogleServices(
             user=user,
             dbSession=dbSession,
-            credentials=credentials,
-            apiKey=settings.googleApiKey,
+            clients=googleClients,
+            ttsCache=ttsCache,
             quotaService=QuotaService(dbSession),
             permissionService=PermissionService(dbSession),
         )
@@ -139,8 +269,7 @@ def getChatLLMService() -> getChatLLMServiceType:
         return ChatLLMService(
             user=user,
             dbSession=dbSession,
-            credentials=credentials,
-            llmModelProperty=llmModelProperty,
+            llmModel=getChatLLMModel(),
             userChatRecordService=UserChatRecordService(dbSession),
             quotaService=QuotaService(dbSession),
             permissionService=PermissionService(dbSession),
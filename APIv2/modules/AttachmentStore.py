@@ -0,0 +1,19 @@
+from ChatLLMv2 import BlobStore
+
+from ..config import settings
+
+
+def createBlobStore() -> BlobStore.BlobStore:
+    """
+    Create the message attachment blob store from settings.
+
+    :return: The blob store.
+    """
+    if settings.applicationChatLLMMessageAttachmentStore == "s3":
+        return BlobStore.S3BlobStore(
+            bucket=settings.applicationChatLLMMessageAttachmentS3Bucket,
+            prefix=settings.applicationChatLLMMessageAttachmentS3Prefix,
+            endpointUrl=settings.applicationChatLLMMessageAttachmentS3EndpointUrl,
+            region=settings.getAttr("AWS_REGION") or None,
+        )
+    return BlobStore.LocalBlobStore(settings.applicationChatLLMMessageAttachmentPath)
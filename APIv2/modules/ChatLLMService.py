@@ -2,8 +2,6 @@ import typing as t
 
 import sqlalchemy.orm as so
 
-from google.oauth2.service_account import Credentials
-
 from .Services.User.User import UserChatRecordService
 
 from .ApplicationModel import User
@@ -21,11 +19,11 @@ from .Services.ServiceDefination import CHATLLM_INVOKE as INVOKE
 from .Services.ServiceDefination import CHATLLM_CREATE as CREATE
 from .Services.ServiceDefination import CHATLLM_RECALL as RECALL
 
-from ChatLLMv2.ChatModel.Property import AdditionalModelProperty
 from ChatLLMv2.ChatModel.Property import InvokeContextValues
+from ChatLLMv2.ChatModel.Property import ChatStreamEvent
 from ChatLLMv2.DataHandler import ChatMessage
 from ChatLLMv2.ChatController import ChatController
-from ChatLLMv2.ChatModel.v1ChainMigrate import v1LLMChainModel
+from ChatLLMv2.ChatModel.Base import BaseModel
 
 from .exception import NotAuthorizedError
 from .exception import ChatLLMServiceError
@@ -38,13 +36,12 @@ class ChatLLMService(ServiceWithAAA):
                  quotaService: QuotaService,
                  permissionService: PermissionService,
                  userChatRecordService: UserChatRecordService,
-                 credentials: t.Optional[Credentials],
-                 llmModelProperty: AdditionalModelProperty,
+                 llmModel: BaseModel,
                  ) -> None:
         super().__init__(dbSession, CHATLLM_SERIVCE_NAME, quotaService, permissionService, user)
         self.user = user
         self.userChatRecordService = userChatRecordService
-        self.llmModel = v1LLMChainModel(credentials, llmModelProperty)
+        self.llmModel = llmModel
 
     def checkUserChatIdAssociation(self, chatId: str) -> bool:
         """
@@ -90,6 +87,46 @@ class ChatLLMService(ServiceWithAAA):
             self.loggerError(f"Error invoking chat model for user {self.user.id} with chatId {chatId}: {e}")
             raise ChatLLMServiceError("Failed to invoke chat model.")
 
+    @permissionRequired(INVOKE)
+    @quotaRequired(INVOKE)
+    @checksEnabled(INVOKE)
+    def streamChatModel(self, chatId: str, message: ChatMessage, contextValues: InvokeContextValues,
+                        bypassChatAssociationCheck: bool = False,
+                        bypassPermssionCheck: bool = False,  # for decorator
+                        bypassQuotaCheck: bool = False,  # for decorator
+                        bypassServiceEnable: bool = False,  # for decorator
+                        ) -> t.Callable[[so.Session], t.Iterator[ChatStreamEvent]]:
+        """
+        Invoke the chat service with a user and a message, streaming the response.
+
+        Permission, quota and chat association are checked when this is called,
+        the response is streamed when the returned function is called.
+        A response stream usually outlives the session of the request, so it is given its own session.
+
+        :param message: The message to send in the chat.
+        :param contextValues: Additional context values for the chat invocation.
+        :param bypassChatAssociationCheck: Whether to bypass the chat ID association check.
+        :return: A function streaming the response with a database session, an iterator of stream events ending with a `message` event.
+        """
+        if not self.checkUserChatIdAssociation(chatId) and not bypassChatAssociationCheck:
+            raise NotAuthorizedError("The user is not associated with the specified chatId.", INVOKE)
+
+        userId = self.user.id
+        self.loggerInfo(f"Streaming chat model for user {userId} with chatId {chatId}")
+
+        def stream(dbSession: so.Session) -> t.Iterator[ChatStreamEvent]:
+            controller = ChatController(
+                dbSession=dbSession,
+                llmModel=self.llmModel,
+                chatId=chatId,
+            )
+            try:
+                yield from controller.streamLLM(message, contextValues)
+            except Exception as e:
+                self.loggerError(f"Error streaming chat model for user {userId} with chatId {chatId}: {e}")
+                raise ChatLLMServiceError("Failed to invoke chat model.")
+        return stream
+
     @permissionRequired(CREATE)
     @quotaRequired(CREATE)
     @checksEnabled(CREATE)
@@ -120,6 +157,9 @@ class ChatLLMService(ServiceWithAAA):
     @quotaRequired(RECALL)
     @checksEnabled(RECALL)
     def recall(self, chatId: str,
+               limit: t.Optional[int] = None,
+               beforeId: t.Optional[int] = None,
+               roles: t.Optional[t.Sequence[str]] = None,
                bypassChatAssociationCheck: bool = False,
                bypassPermissionCheck: bool = False,  # for decorator
                bypassQuotaCheck: bool = False,  # for decorator
@@ -128,15 +168,42 @@ class ChatLLMService(ServiceWithAAA):
         """
         Recall the chat session and return the messages.
 
+        :param limit: The maximum number of messages, all messages if None.
+        :param beforeId: Only return messages older than the message with this id.
+        :param roles: Only return messages of these roles, all roles if None.
+        :param bypassPermissionCheck: Whether to bypass the permission check.
+        :return: A list of messages in the chat session, oldest first.
+        """
+        if not self.checkUserChatIdAssociation(chatId) and not bypassChatAssociationCheck:
+            raise NotAuthorizedError("The user is not associated with the specified chatId.", RECALL)
+
+        self.loggerInfo(f"Recalling chat session with chatId: {chatId} for user {self.user.id}, {limit=}, {beforeId=}")
+        return ChatController(
+            dbSession=self.dbSession,
+            llmModel=self.llmModel,
+            chatId=chatId,
+        ).recallMessages(limit, beforeId, roles)
+
+    @permissionRequired(RECALL)
+    @checksEnabled(RECALL)
+    def recallLastMessageId(self, chatId: str,
+                            roles: t.Optional[t.Sequence[str]] = None,
+                            bypassChatAssociationCheck: bool = False,
+                            bypassPermissionCheck: bool = False,  # for decorator
+                            bypassServiceEnable: bool = False,  # for decorator
+                            ) -> t.Optional[int]:
+        """
+        Get the id of the latest message of the chat session, without using recall quota.
+
+        :param roles: Only consider messages of these roles, all roles if None.
         :param bypassPermissionCheck: Whether to bypass the permission check.
-        :return: A list of messages in the chat session.
+        :return: The id of the latest message or None if there is none.
         """
         if not self.checkUserChatIdAssociation(chatId) and not bypassChatAssociationCheck:
             raise NotAuthorizedError("The user is not associated with the specified chatId.", RECALL)
 
-        self.loggerInfo(f"Recalling chat session with chatId: {chatId} for user {self.user.id}")
         return ChatController(
             dbSession=self.dbSession,
             llmModel=self.llmModel,
             chatId=chatId,
-        ).currentChatRecords.messages
+        ).lastMessageId(roles)
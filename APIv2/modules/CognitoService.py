@@ -43,7 +43,8 @@ class CognitoService(ServiceWithLogging):
             logger.debug(f"Fetching Metadata @{settings.cognitoConfig.serverMetadataUrl}")
             data = requests.get(
                 settings.cognitoConfig.serverMetadataUrl,
-                headers={"Accept": "application/json"}
+                headers={"Accept": "application/json"},
+                timeout=settings.outboundRequestTimeoutSeconds,
             ).json()
             self.metadata = self.Metadata.model_validate(data)
 
@@ -80,7 +81,7 @@ class CognitoService(ServiceWithLogging):
             raise CognitoServiceError.InvalidTokenError("Access token is empty or None.")
         if self.metadata is None or settings.cognitoConfig is None:
             raise CognitoServiceError.NotAvalableError()
-        client = jwt.PyJWKClient(self.metadata.jwks_uri)
+        client = jwt.PyJWKClient(self.metadata.jwks_uri, timeout=int(settings.outboundRequestTimeoutSeconds))
         publicKey = client.get_signing_key_from_jwt(token).key
         try:
             decoded = jwt.decode(  # type: ignore
@@ -116,7 +117,7 @@ class CognitoService(ServiceWithLogging):
             raise CognitoServiceError.NotAvalableError()
         return requests.get(self.metadata.userinfo_endpoint, headers={
             "Authorization": f"Bearer {token}"
-        }).json()
+        }, timeout=settings.outboundRequestTimeoutSeconds).json()
 
     def getUserFromAccessToken(self, token: str) -> CognitoUserInfo:
         """
@@ -5,6 +5,7 @@ import facebook  # type: ignore
 from dataclasses import dataclass
 
 from ..logger import logger
+from ..config import settings
 
 
 @dataclass
@@ -24,7 +25,7 @@ class FacebookClient:
         logger.debug(f"getting username and Id with {accessToken[:10]=}")
 
         logger.debug("Initializing Grpah API")
-        graphApi = facebook.GraphAPI(access_token=accessToken, version="2.12")
+        graphApi = facebook.GraphAPI(access_token=accessToken, version="2.12", timeout=settings.outboundRequestTimeoutSeconds)
 
         logger.debug("Gathering id and username")
         facebookProfile = graphApi.get_object(id="me", fields="id,name")  # type: ignore
@@ -56,7 +57,7 @@ class FacebookClient:
                     keys_to_remove.append(key)
                 elif key == "full_picture":
                     image_url = value
-                    image_data = requests.get(image_url).content
+                    image_data = requests.get(image_url, timeout=settings.outboundRequestTimeoutSeconds).content
                     image_data_url = "data:image/{};base64,{}".format(
                         str(value).split("?")[0].split(".")[-1],
                         base64.b64encode(image_data).decode()
@@ -72,7 +73,7 @@ class FacebookClient:
                 del d[key]
 
         logger.debug("Initializing Grpah API")
-        graphApi = facebook.GraphAPI(access_token=accessToken, version="2.12")
+        graphApi = facebook.GraphAPI(access_token=accessToken, version="2.12", timeout=settings.outboundRequestTimeoutSeconds)
 
         logger.debug("getting user details")
         profileDetails = graphApi.get_object(  # type: ignore
@@ -1,7 +1,11 @@
+import re
+import json
 import base64
+import threading
 import googlemaps  # type: ignore
 import typing as t
 import sqlalchemy.orm as so
+from concurrent.futures import ThreadPoolExecutor
 
 from google.cloud.texttospeech import TextToSpeechClient
 from google.cloud.texttospeech import VoiceSelectionParams
@@ -11,9 +15,13 @@ from google.cloud.texttospeech import AudioEncoding
 from google.cloud.speech_v2 import SpeechClient
 from google.cloud.speech_v2.types.cloud_speech import RecognitionConfig
 from google.cloud.speech_v2.types.cloud_speech import AutoDetectDecodingConfig
+from google.cloud.speech_v2.types.cloud_speech import ExplicitDecodingConfig
 from google.cloud.speech_v2.types.cloud_speech import RecognitionFeatures
 from google.cloud.speech_v2.types.cloud_speech import RecognizeRequest
 from google.oauth2.service_account import Credentials
+from google.api_core.exceptions import DeadlineExceeded
+from google.api_core.exceptions import ServiceUnavailable
+from google.api_core.exceptions import TooManyRequests
 
 from ..logger import logger
 from .Services.PermissionAndQuota.Quota import QuotaService
@@ -21,10 +29,169 @@ from .Services.PermissionAndQuota.Permission import PermissionService
 from .Services.PermissionAndQuota.ServiceBase import ServiceWithAAA
 from .ApplicationModel import User
 from .exception import ConfigurationError
+from .TtsCache import TtsAudioCache
+from .SpeechText import stripMarkdown
+from .SpeechText import splitSentences
+from .SpeechText import stitchAudio
+from .SpeechAudio import TARGET_SAMPLE_RATE
+from .SpeechAudio import prepareAudio
+from .SpeechAudio import splitPcm
 
 MAX_AUDIO_LENGTH_SECS = 8 * 60 * 60
 
 
+VOICES = {
+    "zh": VoiceSelectionParams(
+        language_code="yue-HK",
+        name="yue-HK-Standard-A",
+    ),
+    "en": VoiceSelectionParams(
+        language_code="en-US",
+        name="en-US-Journey-F",
+    )
+}
+
+# replies that are not generated by the llm, synthesized ahead when tts cache prewarming is enabled
+CANNED_PHRASES = [
+    "Please provide a message.",
+    "There is an error processing your request",
+]
+
+
+TtsEncoding = t.Literal["LINEAR16", "OGG_OPUS", "MP3"]
+
+# file extension and mime type of each tts audio encoding
+AUDIO_FORMATS: dict[str, tuple[str, str]] = {
+    "LINEAR16": ("wav", "audio/wav"),
+    "OGG_OPUS": ("ogg", "audio/ogg"),
+    "MP3": ("mp3", "audio/mpeg"),
+}
+
+AUDIO_ID_PATTERN = re.compile(r"^([0-9a-f]{64})\.(wav|ogg|mp3)$")
+
+
+class SpeechSynthesisError(RuntimeError):
+    """Raised when speech cannot be synthesized, `unavailable` when the tts service is unavailable and a retry may succeed"""
+
+    def __init__(self, message: str, unavailable: bool = False) -> None:
+        super().__init__(message)
+        self.unavailable = unavailable
+
+
+def synthesisRequest(text: str, lang: t.Literal["en", "zh"], encoding: TtsEncoding = "LINEAR16") -> dict[str, t.Any]:
+    """
+    Build the synthesis request of a text.
+
+    :param text: The text to convert to speech.
+    :param lang: The language of the text.
+    :param encoding: The audio encoding, LINEAR16 is WAV.
+    :return: The synthesize speech request.
+    """
+    return {
+        "input": SynthesisInput(text=text),
+        "voice": VOICES[lang],
+        "audio_config": AudioConfig(
+            audio_encoding=AudioEncoding[encoding],
+            speaking_rate=1,
+        ),
+    }
+
+
+def synthesisCacheKey(request: dict[str, t.Any]) -> str:
+    """
+    Get the tts cache key of a synthesis request.
+
+    :param request: The synthesize speech request.
+    :return: The cache key.
+    """
+    voice: VoiceSelectionParams = request["voice"]
+    audioConfig: AudioConfig = request["audio_config"]
+    return TtsAudioCache.keyOf(
+        request["input"].text,
+        voice.language_code,
+        voice.name,
+        AudioEncoding(audioConfig.audio_encoding).name,
+        audioConfig.speaking_rate,
+    )
+
+
+class GoogleClients:
+    """
+    Process wide Google Cloud clients, each created on first use and shared by every request.
+    """
+
+    def __init__(self,
+                 credentials: t.Optional[Credentials] = None,
+                 apiKey: str | None = "",
+                 synthesisWorkers: int = 4,
+                 synthesisChunkChars: int = 300,
+                 playlistPrefetchChunks: int = 2,
+                 recognitionWorkers: int = 4,
+                 recognitionChunkSeconds: float = 50,
+                 ) -> None:
+        """
+        Initialize a GoogleClients instance.
+
+        :param credentials: The Google Cloud credentials.
+        :param apiKey: The API key for Google Maps.
+        :param synthesisWorkers: The number of sentence chunks synthesized at the same time.
+        :param synthesisChunkChars: The maximum characters of a sentence chunk.
+        :param playlistPrefetchChunks: The number of leading chunks of a playlist synthesized ahead of a request.
+        :param recognitionWorkers: The number of audio chunks recognized at the same time.
+        :param recognitionChunkSeconds: The maximum seconds of an audio chunk.
+        """
+        self.credentials = credentials
+        self.apiKey = apiKey
+        self.synthesisWorkers = max(1, synthesisWorkers)
+        self.synthesisChunkChars = synthesisChunkChars
+        self.playlistPrefetchChunks = max(0, playlistPrefetchChunks)
+        self.recognitionWorkers = max(1, recognitionWorkers)
+        self.recognitionChunkSeconds = recognitionChunkSeconds
+        self._clients: dict[str, t.Any] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, factory: t.Callable[[], t.Any]) -> t.Any:
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    logger.info(f"Creating Google {name} client")
+                    client = self._clients[name] = factory()
+        return client
+
+    @property
+    def ttsClient(self) -> TextToSpeechClient:
+        return self._get("tts", lambda: TextToSpeechClient(credentials=self.credentials))
+
+    def speechChunks(self, text: str) -> list[str]:
+        """
+        Get the sentence chunks of a text as they are spoken, without markdown.
+
+        :param text: The text to convert to speech.
+        :return: The chunks in order.
+        """
+        return splitSentences(stripMarkdown(text), self.synthesisChunkChars)
+
+    @property
+    def sttClient(self) -> SpeechClient:
+        return self._get("stt", lambda: SpeechClient(credentials=self.credentials))
+
+    @property
+    def synthesisPool(self) -> ThreadPoolExecutor:
+        return self._get("synthesis pool", lambda: ThreadPoolExecutor(max_workers=self.synthesisWorkers, thread_name_prefix="tts"))
+
+    @property
+    def recognitionPool(self) -> ThreadPoolExecutor:
+        return self._get("recognition pool", lambda: ThreadPoolExecutor(max_workers=self.recognitionWorkers, thread_name_prefix="stt"))
+
+    @property
+    def mapsClient(self) -> googlemaps.Client:
+        if not self.apiKey:
+            raise ConfigurationError("Cannot create Google Maps client without API Key")
+        return self._get("maps", lambda: googlemaps.Client(key=self.apiKey))
+
+
 class GoogleServices(ServiceWithAAA):
     """Service class for interacting with Google Cloud's Text-to-Speech and Speech-to-Text APIs."""
 
@@ -35,58 +202,197 @@ class GoogleServices(ServiceWithAAA):
                  user: t.Optional[User] = None,
                  credentials: t.Optional[Credentials] = None,
                  apiKey: str | None = "",
+                 clients: t.Optional[GoogleClients] = None,
+                 ttsCache: t.Optional[TtsAudioCache] = None,
                  ) -> None:
         """
         Initialize a GoogleServices instance.
 
-        :param credentials: The Google Cloud credentials.
-        :param apiKey: The API key for Google Cloud services.
+        :param credentials: The Google Cloud credentials, used when no clients are given.
+        :param apiKey: The API key for Google Cloud services, used when no clients are given.
+        :param clients: The shared Google Cloud clients.
+        :param ttsCache: The cache of synthesized speech, speech is always synthesized if None.
         """
         super().__init__(dbSession, "Google Service", quotaService=quotaService, permissionService=permissionService, user=user)
-        self.apiKey = apiKey
-        if not credentials:
+        self.clients = clients or GoogleClients(credentials=credentials, apiKey=apiKey)
+        self.ttsCache = ttsCache
+        self.apiKey = self.clients.apiKey
+        if not self.clients.credentials:
             logger.warning(f'Google Service Credentials not present, may lead to errors if client is not set up')
-        self.ttsClient = TextToSpeechClient(credentials=credentials)
-        self.sttClient = SpeechClient(credentials=credentials)
-        self.projectID = str(credentials.project_id if credentials is not None else "")  # type: ignore
+        self.projectID = str(self.clients.credentials.project_id if self.clients.credentials is not None else "")  # type: ignore
 
-    def textToSpeech(self, text: str, lang: t.Literal["en", "zh"] = "zh") -> str:
+    @property
+    def ttsClient(self) -> TextToSpeechClient:
+        return self.clients.ttsClient
+
+    @property
+    def sttClient(self) -> SpeechClient:
+        return self.clients.sttClient
+
+    def _recognizeRequest(self, audioContent: bytes, pcm: bool = False) -> RecognizeRequest:
+        """
+        Build the recognize request of audio data.
+
+        :param audioContent: The raw audio data.
+        :param pcm: If the audio is 16 bit mono PCM from `prepareAudio`, otherwise the format is detected.
+        :return: The recognize request.
+        """
+        decoding: dict[str, t.Any] = {"auto_decoding_config": AutoDetectDecodingConfig()}
+        if pcm:
+            decoding = {"explicit_decoding_config": ExplicitDecodingConfig(
+                encoding=ExplicitDecodingConfig.AudioEncoding.LINEAR16,
+                sample_rate_hertz=TARGET_SAMPLE_RATE,
+                audio_channel_count=1,
+            )}
+        config = RecognitionConfig(
+            **decoding,
+            features=RecognitionFeatures(
+                enable_word_confidence=False,
+                enable_word_time_offsets=False,
+            ),
+            model="long",
+            language_codes=["yue-Hant-HK"],
+        )
+        return RecognizeRequest(
+            recognizer=f"projects/{self.projectID}/locations/global/recognizers/_",
+            config=config,
+            content=audioContent,
+        )
+
+    def _synthesizeChunk(self, chunk: str, lang: t.Literal["en", "zh"], encoding: TtsEncoding) -> bytes:
+        request = synthesisRequest(chunk, lang, encoding)
+        if self.ttsCache is None:
+            return self.ttsClient.synthesize_speech(request).audio_content  # type: ignore
+        return self.ttsCache.getOrSynthesize(
+            synthesisCacheKey(request),
+            lambda: self.ttsClient.synthesize_speech(request).audio_content,  # type: ignore
+        )
+
+    def speechChunks(self, text: str) -> list[str]:
+        """
+        Get the sentence chunks of a text as they are spoken, without markdown.
+
+        :param text: The text to convert to speech.
+        :return: The chunks in order.
+        """
+        return self.clients.speechChunks(text)
+
+    def synthesizeSpeech(self, text: str, lang: t.Literal["en", "zh"] = "zh", encoding: TtsEncoding = "LINEAR16") -> bytes:
+        """
+        Convert text to speech, from the tts cache if it was synthesized before.
+
+        Markdown is stripped, and the sentence chunks of the text are synthesized concurrently and joined in order.
+
+        :param text: The text to convert to speech.
+        :param lang: The language of the text ("en" for English, "zh" for Chinese).
+        :param encoding: The audio encoding.
+        :return: The audio data.
+        """
+        chunks = self.speechChunks(text)
+        if len(chunks) <= 1:
+            # cached by the chunk key, a single chunk can have the key of the whole text
+            return self._synthesizeChunk(chunks[0], lang, encoding) if chunks else b""
+
+        def synthesize() -> bytes:
+            logger.debug(f"Synthesizing {len(chunks)} chunks of {text[:10]=}")
+            audio = list(self.clients.synthesisPool.map(lambda chunk: self._synthesizeChunk(chunk, lang, encoding), chunks))
+            return stitchAudio(audio, encoding)
+
+        if self.ttsCache is None:
+            return synthesize()
+        return self.ttsCache.getOrSynthesize(synthesisCacheKey(synthesisRequest(text, lang, encoding)), synthesize)
+
+    def textToSpeech(self, text: str, lang: t.Literal["en", "zh"] = "zh", encoding: TtsEncoding = "LINEAR16") -> str:
         """
         Convert text to speech and return the base64 encoded audio representation.
 
         :param text: The text to convert to speech.
         :param lang: The language of the text ("en" for English, "zh" for Chinese).
+        :param encoding: The audio encoding.
         :return: The base64 encoded audio representation of the text.
         """
         logger.debug(f"Synthesis starting for {text[10:]=}")
         try:
-            voiceLangMapping = {
-                "zh": VoiceSelectionParams(
-                    language_code="yue-HK",
-                    name="yue-HK-Standard-A",
-                ),
-                "en": VoiceSelectionParams(
-                    language_code="en-US",
-                    name="en-US-Journey-F",
-                )
-            }
-            synthesisText = SynthesisInput(text=text)
-            audioConfig = AudioConfig(
-                audio_encoding=AudioEncoding.LINEAR16,
-                speaking_rate=1,
-            )
-            response = self.ttsClient.synthesize_speech({  # type: ignore
-                "input": synthesisText,
-                "voice": voiceLangMapping[lang],
-                "audio_config": audioConfig,
-            })
-            base64AudioString = base64.b64encode(response.audio_content).decode("ascii")
+            base64AudioString = base64.b64encode(self.synthesizeSpeech(text, lang, encoding)).decode("ascii")
             logger.debug(f'Speach to text response preview {base64AudioString[:20]=}')
             return base64AudioString
         except Exception as e:
             logger.error(f'Cannot synthesise text {e}, returning empty string.')
             return ""
 
+    def createSpeechHandle(self, text: str, lang: t.Literal["en", "zh"] = "zh", encoding: TtsEncoding = "OGG_OPUS") -> str:
+        """
+        Register text for synthesis and return the id its audio is fetched by.
+
+        The audio is synthesized when it is first fetched with `speechAudio`, so the text reply is not held up.
+
+        :param text: The text to convert to speech.
+        :param lang: The language of the text ("en" for English, "zh" for Chinese).
+        :param encoding: The audio encoding.
+        :raises ConfigurationError: If there is no tts cache to keep the text in.
+        :return: The audio id.
+        """
+        if self.ttsCache is None:
+            raise ConfigurationError("Cannot create speech handle without tts cache")
+        key = synthesisCacheKey(synthesisRequest(text, lang, encoding))
+        if self.ttsCache.getHandle(key) is None:
+            self.ttsCache.putHandle(key, json.dumps({"text": text, "lang": lang, "encoding": encoding}).encode())
+        return f"{key}.{AUDIO_FORMATS[encoding][0]}"
+
+    def createSpeechPlaylist(self, text: str, lang: t.Literal["en", "zh"] = "zh", encoding: TtsEncoding = "OGG_OPUS") -> list[str]:
+        """
+        Register each sentence chunk of a text for synthesis and return their audio ids in order.
+
+        The first few chunks start synthesizing in the background, so a player can start on the first
+        chunk at once, the rest are synthesized when they are requested.
+
+        :param text: The text to convert to speech.
+        :param lang: The language of the text ("en" for English, "zh" for Chinese).
+        :param encoding: The audio encoding.
+        :raises ConfigurationError: If there is no tts cache to keep the chunks in.
+        :return: The audio id of each chunk.
+        """
+        chunks = self.speechChunks(text)
+        audioIds = [self.createSpeechHandle(chunk, lang, encoding) for chunk in chunks]
+        for chunk in chunks[:self.clients.playlistPrefetchChunks]:
+            self.clients.synthesisPool.submit(self._prefetchChunk, chunk, lang, encoding)
+        return audioIds
+
+    def _prefetchChunk(self, chunk: str, lang: t.Literal["en", "zh"], encoding: TtsEncoding) -> None:
+        try:
+            self._synthesizeChunk(chunk, lang, encoding)
+        except Exception as e:
+            logger.error(f"Cannot synthesise chunk {chunk[:10]=}: {e}")
+
+    def speechAudio(self, audioId: str) -> t.Optional[tuple[bytes, str]]:
+        """
+        Get the audio of an id from `createSpeechHandle`, synthesizing it on first use.
+
+        :param audioId: The audio id.
+        :raises SpeechSynthesisError: If the audio cannot be synthesized.
+        :return: The audio data and mime type, None if the id is unknown.
+        """
+        match = AUDIO_ID_PATTERN.match(audioId)
+        if match is None or self.ttsCache is None:
+            return None
+        key, extension = match.groups()
+        mimeType = next(mime for ext, mime in AUDIO_FORMATS.values() if ext == extension)
+        audioContent = self.ttsCache.get(key)
+        if audioContent is not None:
+            return audioContent, mimeType
+        pending = self.ttsCache.getHandle(key)
+        if pending is None:
+            logger.debug(f"No pending synthesis of {audioId=}")
+            return None
+        handle = json.loads(pending)
+        logger.debug(f"Synthesizing {audioId=} on first fetch")
+        try:
+            return self.synthesizeSpeech(handle["text"], handle["lang"], handle["encoding"]), mimeType
+        except Exception as e:
+            logger.error(f"Cannot synthesise {audioId=}: {e}")
+            unavailable = isinstance(e, (ServiceUnavailable, DeadlineExceeded, TooManyRequests))
+            raise SpeechSynthesisError(f"Cannot synthesise {audioId}", unavailable=unavailable) from e
+
     def geoLocationLookup(self, longitude: float, latitude: float, lang: str = "zh-HK") -> str:
         """
         Perform location lookup for given longitude and latitude value.
@@ -101,8 +407,7 @@ class GoogleServices(ServiceWithAAA):
             raise ConfigurationError("Cannot Perform Reverse Geocode Search without API Key")
         try:
             # This works, it not our fault that this works but not show up on editors
-            maps = googlemaps.Client(key=self.apiKey)
-            resault = maps.reverse_geocode(latlng=(latitude, longitude), language=lang)  # type: ignore
+            resault = self.clients.mapsClient.reverse_geocode(latlng=(latitude, longitude), language=lang)  # type: ignore
             location = str(resault[1]['formatted_address'])  # type: ignore
             logger.debug(f"Got location of {location} from ({longitude},{latitude})")
             return location
@@ -110,43 +415,88 @@ class GoogleServices(ServiceWithAAA):
             logger.error(f"Cannot Perform Reverse Geocode Search: {e}")
             raise Exception("Cannot Perform Reverse Geocode Search due to errors")
 
-    def speechToText(self, audioData: str) -> str:
+    def _recognizeChunk(self, audioContent: bytes, pcm: bool) -> str:
+        operation = self.sttClient.recognize(request=self._recognizeRequest(audioContent, pcm))  # type: ignore
+        return "".join(r.alternatives[0].transcript for r in operation.results if r.alternatives)
+
+    def transcribeAudio(self, audioContent: bytes) -> str:
         """
-        Convert speech to text
+        Convert speech of an audio file to text
 
-        :param audioData: The base64 encoded audio data to convert to text.
-        :param lang: The language of the audio data ("zh-HK" for Cantonese, "en-US" for English).
+        The audio is downmixed and resampled to 16 kHz mono PCM, and long audio is split
+        at pauses into chunks recognized at the same time.
+        Audio that cannot be decoded here is sent as is for the recognizer to detect the format.
+
+        :param audioContent: The audio file data.
         :return: The text representation of the audio data.
         """
         if not self.projectID:
-            self.loggerError(f'Cannot process {audioData[:20]=} for STT, Empty Project ID')
+            self.loggerError(f'Cannot process {len(audioContent)} bytes of audio for STT, Empty Project ID')
             raise ConfigurationError()
         try:
-            audioContent = base64.b64decode(audioData)
-            logger.debug(f'Starting text regization for audioData {audioData[:20]=}')
-            config = RecognitionConfig(
-                auto_decoding_config=AutoDetectDecodingConfig(),
-                features=RecognitionFeatures(
-                    enable_word_confidence=False,
-                    enable_word_time_offsets=False,
-                ),
-                model="long",
-                language_codes=["yue-Hant-HK"],
-            )
-            request = RecognizeRequest(
-                recognizer=f"projects/{self.projectID}/locations/global/recognizers/_",
-                config=config,
-                content=audioContent,
-            )
-            operation = self.sttClient.recognize(request=request)  # type: ignore
-            resault = operation.results
-            if len(resault) < 1:
-                logger.debug(f"No resault from {audioData[:20]=} got {resault=}")
+            pcm = prepareAudio(audioContent)
+            if pcm is None:
+                logger.debug(f"Cannot decode {len(audioContent)} bytes of audio, recognizing with detected format")
+                return self._recognizeChunk(audioContent, pcm=False)
+            seconds = len(pcm) / 2 / TARGET_SAMPLE_RATE
+            if seconds > MAX_AUDIO_LENGTH_SECS:
+                self.loggerError(f"Audio of {seconds:.0f}s is longer than {MAX_AUDIO_LENGTH_SECS}s")
                 return ""
-            response = resault[-1].alternatives[-1].transcript
-            # leanth = resault[-1].result_end_offset.seconds # Useful for accounting and qoutering
-            logger.debug(f"Finish Recognition for {audioData[:20]=} got {resault=}")
-            return response
+            chunks = splitPcm(pcm, chunkSeconds=self.clients.recognitionChunkSeconds)
+            logger.debug(f"Starting recognition of {seconds:.1f}s audio in {len(chunks)} chunks")
+            transcripts = self.clients.recognitionPool.map(lambda chunk: self._recognizeChunk(chunk, pcm=True), chunks)
+            return "".join(transcripts)
         except Exception as e:
             self.loggerError(f"Error processing Recognition {e}")
             return ""
+
+    def speechToText(self, audioData: str) -> str:
+        """
+        Convert speech to text
+
+        :param audioData: The base64 encoded audio data to convert to text.
+        :return: The text representation of the audio data.
+        """
+        try:
+            audioContent = base64.b64decode(audioData)
+        except ValueError as e:
+            self.loggerError(f"Error decoding audio {audioData[:20]=} {e}")
+            return ""
+        return self.transcribeAudio(audioContent)
+
+
+def prewarmTextToSpeech(clients: GoogleClients,
+                        ttsCache: TtsAudioCache,
+                        phrases: t.Iterable[str],
+                        lang: t.Literal["en", "zh"] = "zh",
+                        encoding: TtsEncoding = "LINEAR16",
+                        ) -> None:
+    """
+    Synthesize phrases that are not in the tts cache yet.
+
+    Phrases are split into the chunks `GoogleServices.synthesizeSpeech` synthesizes, so they warm the keys live requests use.
+
+    :param clients: The shared Google Cloud clients.
+    :param ttsCache: The cache of synthesized speech.
+    :param phrases: The phrases to synthesize.
+    :param lang: The language the phrases are synthesized in.
+    :param encoding: The audio encoding the phrases are synthesized in.
+    """
+    synthesized = 0
+    for phrase in phrases:
+        chunks = clients.speechChunks(phrase)
+        phraseKey = synthesisCacheKey(synthesisRequest(phrase, lang, encoding))
+        if not chunks or (len(chunks) > 1 and ttsCache.get(phraseKey) is not None):
+            continue
+        try:
+            audio: list[bytes] = []
+            for chunk in chunks:
+                request = synthesisRequest(chunk, lang, encoding)
+                audio.append(ttsCache.getOrSynthesize(synthesisCacheKey(request), lambda: clients.ttsClient.synthesize_speech(request).audio_content))  # type: ignore
+            if len(chunks) > 1:
+                # the joined audio of a phrase of several chunks is cached by the phrase
+                ttsCache.put(phraseKey, stitchAudio(audio, encoding))
+            synthesized += 1
+        except Exception as e:
+            logger.error(f"Cannot prewarm tts of {phrase[:20]=}: {e}")
+    logger.info(f"Prewarmed tts cache, {synthesized} phrases ready")
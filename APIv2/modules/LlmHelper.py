@@ -1,5 +1,6 @@
 from langchain_google_vertexai import ChatVertexAI
 from langchain_core.messages import HumanMessage
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.prompts import MessagesPlaceholder
 
@@ -90,24 +91,30 @@ def generateUserProfileSummory(profileDetails: str) -> str:
     return responseContent
 
 
-def createChatSummory(messages: list[ChatMessage]) -> str:
+def createChatSummory(messages: list[ChatMessage], previousSummory: str | None = None, includeMedia: bool = True) -> str:
     """Create mini chat summory text for list of messages
 
     :param messages: List of Messages
+    :param previousSummory: The summory of the messages before the given messages, if any
+    :param includeMedia: Whether to include the attachment data of the messages
 
     :return: The summory of the given langchain messages
     """
     logger.debug(f"creating prompt for chat summory")
-    prompt = ChatPromptTemplate([
-        ("system", ("The following is a conversation of 2 person.")),
-        ("user", "Summorise it to the best of you ability. Highlight key points and make it short and concise"),
-        ("system", (
-            "<conversation>"
-            f'{"\n".join(list(map(lambda x: f"  <messages role=\"{x.role}\">\n    <text>{x.text}<text>{"\n" + "\n".join(
-                list(map(lambda y: f"    <media type=\"{y.mimeType}\">{y.base64Data}</media>", x.attachments)))}</messages>", messages)))}'
-            "</conversation>"
-        ))
-    ]).invoke({})  # type: ignore
+    # the conversation is sent as message content, not as template text, so braces in messages are kept as is
+    conversation = "\n".join(
+        f"  <messages role=\"{message.role}\">\n    <text>{message.text}<text>" + "".join(
+            f"\n    <media type=\"{attachment.mimeType}\">{attachment.base64Data if includeMedia else 'omitted'}</media>"
+            for attachment in message.attachments
+        ) + "</messages>"
+        for message in messages
+    )
+    previousSummoryText = f"<previousSummory>{previousSummory}</previousSummory>\n" if previousSummory else ""
+    prompt = [
+        SystemMessage(content="The following is a conversation of 2 person."),
+        HumanMessage(content="Summorise it to the best of you ability. Highlight key points and make it short and concise"),
+        SystemMessage(content=f"{previousSummoryText}<conversation>{conversation}</conversation>"),
+    ]
     logger.debug(f"Invkoing LLM for summory")
     llm.temperature = 0.1
     responseContent = llm.invoke(prompt).content  # type: ignore
@@ -0,0 +1,172 @@
+import io
+import math
+import wave
+import shutil
+import subprocess
+import typing as t
+
+import numpy as np
+
+from ..logger import logger
+
+
+# the recognizer works on 16 kHz mono, more is not used for speech
+TARGET_SAMPLE_RATE = 16000
+
+
+def decodeWav(data: bytes) -> t.Optional[tuple[np.ndarray, int]]:
+    """
+    Decode PCM WAV audio.
+
+    :param data: The WAV file data.
+    :return: The float samples of shape (frames, channels) and the sample rate, None if it is not PCM WAV.
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as f:
+            channels, sampleWidth, sampleRate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+            frames = f.readframes(f.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    if sampleWidth == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sampleWidth == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif sampleWidth == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        return None
+    return samples.reshape(-1, channels), sampleRate
+
+
+def resample(samples: np.ndarray, sampleRate: int, targetRate: int, halfTaps: int = 16, blockFrames: int = 65536) -> np.ndarray:
+    """
+    Resample mono float samples with a polyphase windowed-sinc filter.
+
+    The filter is a Kaiser windowed sinc low pass at the lower of the two Nyquist frequencies,
+    so frequencies above the target Nyquist are removed instead of aliasing into speech.
+
+    :param samples: The mono float samples.
+    :param sampleRate: The sample rate of the samples.
+    :param targetRate: The sample rate of the output.
+    :param halfTaps: The zero crossings of the sinc on each side of its center.
+    :param blockFrames: The output frames computed at a time, bounding the memory used.
+    :return: The resampled float samples.
+    """
+    divisor = math.gcd(sampleRate, targetRate)
+    up, down = targetRate // divisor, sampleRate // divisor
+    factor = max(up, down)
+    taps = 2 * halfTaps * factor + 1
+    offsets = np.arange(taps) - (taps - 1) / 2
+    # gain of `up` makes up for the zeros inserted when upsampling
+    kernel = np.sinc(offsets / factor) * np.kaiser(taps, 5.0) * up / factor
+
+    # phase p of the polyphase filter holds the taps p, p + up, p + 2 up, ...
+    phaseTaps = math.ceil(taps / up)
+    polyphase = np.zeros(phaseTaps * up, dtype=np.float32)
+    polyphase[:taps] = kernel
+    polyphase = polyphase.reshape(phaseTaps, up).T
+
+    padded = np.concatenate([np.zeros(phaseTaps, dtype=np.float32), samples.astype(np.float32), np.zeros(phaseTaps, dtype=np.float32)])
+    outputFrames = len(samples) * up // down
+    output = np.empty(outputFrames, dtype=np.float32)
+    delay = (taps - 1) // 2
+    for start in range(0, outputFrames, blockFrames):
+        # position of each output frame on the upsampled time line, centered on the filter
+        position = np.arange(start, min(start + blockFrames, outputFrames), dtype=np.int64) * down + delay
+        inputs = padded[(position // up + phaseTaps)[:, None] - np.arange(phaseTaps)[None, :]]
+        output[start:start + len(position)] = (polyphase[position % up] * inputs).sum(axis=1)
+    return output
+
+
+def toMonoPcm(samples: np.ndarray, sampleRate: int, targetRate: int = TARGET_SAMPLE_RATE) -> bytes:
+    """
+    Downmix float samples to mono and resample them to 16 bit PCM.
+
+    :param samples: The float samples of shape (frames, channels).
+    :param sampleRate: The sample rate of the samples.
+    :param targetRate: The sample rate of the output.
+    :return: The little endian 16 bit mono PCM.
+    """
+    mono = samples.mean(axis=1) if samples.ndim == 2 else samples
+    if sampleRate != targetRate and len(mono):
+        mono = resample(mono, sampleRate, targetRate)
+    return (np.clip(mono, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def decodeWithFfmpeg(data: bytes, targetRate: int = TARGET_SAMPLE_RATE, timeout: float = 120) -> t.Optional[bytes]:
+    """
+    Decode any audio ffmpeg supports, like the webm or ogg of browser recorders, to 16 bit mono PCM.
+
+    :param data: The audio file data.
+    :param targetRate: The sample rate of the output.
+    :param timeout: Seconds to wait for ffmpeg.
+    :return: The little endian 16 bit mono PCM, None if ffmpeg is not installed or failed.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, "-nostdin", "-loglevel", "error", "-i", "pipe:0", "-ac", "1", "-ar", str(targetRate), "-f", "s16le", "pipe:1"],
+            input=data,
+            capture_output=True,
+            timeout=timeout,
+            check=True,
+        )
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning(f"ffmpeg cannot decode audio: {e}")
+        return None
+    return result.stdout
+
+
+def prepareAudio(data: bytes, targetRate: int = TARGET_SAMPLE_RATE) -> t.Optional[bytes]:
+    """
+    Convert audio to the 16 bit mono PCM the recognizer needs.
+
+    PCM WAV is converted in process, other formats with ffmpeg when it is installed.
+
+    :param data: The audio file data.
+    :param targetRate: The sample rate of the output.
+    :return: The little endian 16 bit mono PCM, None if the audio cannot be decoded here.
+    """
+    decoded = decodeWav(data)
+    if decoded is not None:
+        return toMonoPcm(*decoded, targetRate=targetRate)
+    return decodeWithFfmpeg(data, targetRate)
+
+
+def splitPcm(pcm: bytes,
+             sampleRate: int = TARGET_SAMPLE_RATE,
+             chunkSeconds: float = 50,
+             searchSeconds: float = 5,
+             windowSeconds: float = 0.1,
+             ) -> list[bytes]:
+    """
+    Split 16 bit mono PCM into chunks, cutting at the quietest moment near each chunk end so words are not cut.
+
+    :param pcm: The little endian 16 bit mono PCM.
+    :param sampleRate: The sample rate of the PCM.
+    :param chunkSeconds: The maximum seconds of a chunk.
+    :param searchSeconds: How many seconds before the chunk end are searched for a pause.
+    :param windowSeconds: The seconds of a loudness window.
+    :return: The PCM chunks in order.
+    """
+    samples = np.frombuffer(pcm, dtype="<i2")
+    chunkFrames = int(chunkSeconds * sampleRate)
+    searchFrames = int(min(searchSeconds, chunkSeconds / 2) * sampleRate)
+    window = max(1, int(windowSeconds * sampleRate))
+    chunks: list[bytes] = []
+    start = 0
+    while len(samples) - start > chunkFrames:
+        searchStart = start + chunkFrames - searchFrames
+        region = samples[searchStart:start + chunkFrames].astype(np.float32) ** 2
+        windows = len(region) // window
+        if windows:
+            energy = region[:windows * window].reshape(windows, window).mean(axis=1)
+            cut = searchStart + int(np.argmin(energy)) * window + window // 2
+        else:
+            cut = start + chunkFrames
+        chunks.append(samples[start:cut].tobytes())
+        start = cut
+    chunks.append(samples[start:].tobytes())
+    return chunks
@@ -0,0 +1,228 @@
+import io
+import re
+import wave
+import struct
+import typing as t
+
+
+MARKDOWN_RULES: list[tuple[re.Pattern[str], str]] = [
+    # fenced code blocks are not read out
+    (re.compile(r"```.*?```", re.DOTALL), " "),
+    # images, then links keep their text
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"https?://\S+"), " "),
+    # table separator rows, then cell borders
+    (re.compile(r"^[ \t]*\|?[ \t]*:?-{3,}:?[ \t]*(\|[ \t]*:?-{3,}:?[ \t]*)*\|?[ \t]*$", re.MULTILINE), ""),
+    (re.compile(r"^[ \t]*\|(.*)\|[ \t]*$", re.MULTILINE), lambda m: ", ".join(cell.strip() for cell in m.group(1).split("|")) + "."),  # type: ignore
+    # headings, quotes, list markers and rules
+    (re.compile(r"^[ \t]{0,3}#{1,6}[ \t]*(.*?)[ \t]*#*[ \t]*$", re.MULTILINE), r"\1."),
+    (re.compile(r"^[ \t]*>[ \t]?", re.MULTILINE), ""),
+    (re.compile(r"^[ \t]*(?:[-*+]|\d+[.)])[ \t]+", re.MULTILINE), ""),
+    (re.compile(r"^[ \t]*(?:[-*_][ \t]*){3,}$", re.MULTILINE), ""),
+    # emphasis and inline code
+    (re.compile(r"(\*{1,3}|_{1,3}|~~|`)(.+?)\1"), r"\2"),
+    (re.compile(r"[*_`#]"), ""),
+]
+
+# a sentence ends at western punctuation followed by a space, or at Chinese punctuation
+SENTENCE_PATTERN = re.compile(r".+?(?:[.!?]+(?=\s|$)|[。！？；;]+|$)")
+
+
+def stripMarkdown(text: str) -> str:
+    """
+    Convert markdown to plain text for speech.
+
+    Formatting characters, urls and code blocks are removed, link texts are kept,
+    and headings and table rows are read as sentences.
+
+    :param text: The markdown text.
+    :return: The plain text.
+    """
+    for pattern, replacement in MARKDOWN_RULES:
+        text = pattern.sub(replacement, text)  # type: ignore
+    text = re.sub(r"\.(\s*\.)+", ".", text)
+    return re.sub(r"[ \t]+", " ", text).strip()
+
+
+def splitSentences(text: str, maxChars: int = 300) -> list[str]:
+    """
+    Split text into chunks of whole sentences.
+
+    Short sentences are joined up to `maxChars`, a sentence longer than `maxChars` is split at spaces or commas.
+
+    :param text: The plain text.
+    :param maxChars: The maximum characters of a chunk.
+    :return: The chunks in order.
+    """
+    sentences: list[str] = []
+    for line in text.splitlines():
+        for match in SENTENCE_PATTERN.finditer(line.strip()):
+            sentence = match.group().strip()
+            while len(sentence) > maxChars:
+                cut = max(sentence.rfind(separator, 0, maxChars) for separator in (" ", ",", "，", "、"))
+                cut = cut + 1 if cut > 0 else maxChars
+                sentences.append(sentence[:cut].strip())
+                sentence = sentence[cut:].strip()
+            if sentence:
+                sentences.append(sentence)
+
+    chunks: list[str] = []
+    for sentence in sentences:
+        if chunks and len(chunks[-1]) + 1 + len(sentence) <= maxChars:
+            chunks[-1] = f"{chunks[-1]} {sentence}"
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+def oggCrcTable() -> list[int]:
+    """Build the lookup table of the Ogg CRC-32, polynomial 0x04c11db7 without reflection."""
+    table: list[int] = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+        table.append(crc)
+    return table
+
+
+OGG_CRC_TABLE = oggCrcTable()
+
+
+def oggCrc(data: bytes) -> int:
+    """
+    Get the checksum of an Ogg page.
+
+    :param data: The page with its checksum field zeroed.
+    :return: The checksum.
+    """
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+OGG_PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+# samples at 48 kHz of an Opus frame by the configuration in its TOC byte, RFC 6716 section 3.1
+OPUS_FRAME_SAMPLES = [480, 960, 1920, 2880] * 3 + [480, 960] * 2 + [120, 240, 480, 960] * 4
+
+
+def readOggPages(data: bytes) -> t.Iterator[tuple[int, int, int, bytes, bytes]]:
+    """
+    Read the pages of an Ogg stream.
+
+    :param data: The Ogg stream.
+    :raises ValueError: If the data is not a complete Ogg stream.
+    :return: The header type, granule position, serial number, lacing values and body of each page.
+    """
+    offset = 0
+    while offset < len(data):
+        capture, version, headerType, granule, serial, _, _, segments = OGG_PAGE_HEADER.unpack_from(data, offset)
+        if capture != b"OggS" or version != 0:
+            raise ValueError("Not an Ogg page")
+        offset += OGG_PAGE_HEADER.size
+        lacing = data[offset:offset + segments]
+        offset += segments
+        body = data[offset:offset + sum(lacing)]
+        offset += len(body)
+        if len(lacing) != segments or len(body) != sum(lacing):
+            raise ValueError("Truncated Ogg page")
+        yield headerType, granule, serial, lacing, body
+
+
+def opusPacketSamples(packet: bytes) -> int:
+    """
+    Get the samples at 48 kHz an Opus packet decodes to.
+
+    :param packet: The Opus packet.
+    :return: The number of samples.
+    """
+    if not packet:
+        return 0
+    frames = packet[0] & 0x03
+    count = 1 if frames == 0 else 2 if frames < 3 else (packet[1] & 0x3F if len(packet) > 1 else 0)
+    return OPUS_FRAME_SAMPLES[packet[0] >> 3] * count
+
+
+def joinOggOpus(chunks: t.Sequence[bytes]) -> bytes:
+    """
+    Join Ogg Opus streams into one logical stream.
+
+    The header packets of the later streams are dropped and their pages are renumbered into the first stream,
+    with granule positions continuing from the samples before them.
+    The decoder priming samples at the start of each later stream, a few milliseconds, are played.
+
+    :param chunks: The Ogg Opus streams in order, from the same encoder settings.
+    :raises ValueError: If a chunk is not a complete Ogg stream.
+    :return: The joined stream.
+    """
+    output = bytearray()
+    serial: t.Optional[int] = None
+    sequence = 0
+    base = 0
+    for index, chunk in enumerate(chunks):
+        pages = list(readOggPages(chunk))
+        headerPackets = 0
+        samples = 0
+        packet = bytearray()
+        for pageIndex, (headerType, granule, pageSerial, lacing, body) in enumerate(pages):
+            if serial is None:
+                serial = pageSerial
+            # OpusHead and OpusTags each end their page, count them to find the first audio page
+            inHeader = headerPackets < 2
+            position = 0
+            for size in lacing:
+                packet += body[position:position + size]
+                position += size
+                if size < 255:
+                    if headerPackets < 2:
+                        headerPackets += 1
+                    else:
+                        samples += opusPacketSamples(bytes(packet))
+                    packet.clear()
+            if inHeader and index > 0:
+                continue
+            headerType &= 0x01
+            if index == 0 and pageIndex == 0:
+                headerType |= 0x02
+            lastPage = pageIndex == len(pages) - 1
+            if lastPage and index == len(chunks) - 1:
+                headerType |= 0x04
+            if granule != -1:
+                # the end trimming granule of an inner stream would rewind the timeline
+                granule = base + (samples if lastPage and index < len(chunks) - 1 else granule)
+            page = bytearray(OGG_PAGE_HEADER.pack(b"OggS", 0, headerType, granule, serial, sequence, 0, len(lacing)))
+            page += lacing + body
+            struct.pack_into("<I", page, 22, oggCrc(page))
+            output += page
+            sequence += 1
+        base += samples
+    return bytes(output)
+
+
+def stitchAudio(chunks: t.Sequence[bytes], encoding: str) -> bytes:
+    """
+    Join audio chunks of the same encoding into one audio.
+
+    WAV chunks are joined into one WAV of all frames, Ogg Opus streams are re-muxed into one stream,
+    as many players only play the first stream of chained Ogg, and MP3 frames are concatenated.
+
+    :param chunks: The audio chunks in order.
+    :param encoding: The tts audio encoding of the chunks.
+    :return: The joined audio.
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    if encoding == "OGG_OPUS":
+        return joinOggOpus(chunks)
+    if encoding != "LINEAR16":
+        return b"".join(chunks)
+    output = io.BytesIO()
+    with wave.open(output, "wb") as joined:
+        for i, chunk in enumerate(chunks):
+            with wave.open(io.BytesIO(chunk), "rb") as part:
+                if i == 0:
+                    joined.setparams(part.getparams())
+                joined.writeframes(part.readframes(part.getnframes()))
+    return output.getvalue()
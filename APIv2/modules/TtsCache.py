@@ -0,0 +1,320 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import contextlib
+import typing as t
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from ChatLLMv2.Cache import ByteBudgetLRUCache
+
+from ..logger import logger
+
+
+# speech handles are kept in their own directory, outside of the audio size budget
+HANDLE_DIRECTORY = "handles"
+
+
+class TtsAudioCache:
+    """
+    Cache of synthesized speech, keyed by the text and the synthesis settings.
+
+    Audio is kept in files under a directory bounded by total size with least recently used eviction,
+    and the most recently used audio is also kept in memory.
+    Each worker process keeps its own index of the directory, a file evicted by another worker is treated as a miss.
+
+    Speech handles, the text of audio that is synthesized when it is first fetched, are stored apart from the audio
+    and expire by age, so they are never evicted by audio.
+    """
+
+    # the modification time of a file is refreshed at most once per interval when it is used
+    touchIntervalSeconds = 60
+
+    def __init__(self,
+                 path: t.Optional[str] = None,
+                 maxBytes: int = 256 * 1024 * 1024,
+                 memoryBytes: int = 16 * 1024 * 1024,
+                 handleSeconds: float = 24 * 60 * 60,
+                 ) -> None:
+        """
+        Initialize a TtsAudioCache instance.
+
+        :param path: The directory audio files are stored in, in memory only if None.
+        :param maxBytes: The maximum total size of the audio files.
+        :param memoryBytes: The maximum total size of audio kept in memory.
+        :param handleSeconds: How long a speech handle can be fetched after it is stored.
+        """
+        self.path = path
+        self.handleSeconds = handleSeconds
+        self.maxBytes = max(0, maxBytes)
+        self.memory: ByteBudgetLRUCache[str, bytes] = ByteBudgetLRUCache(memoryBytes)
+        self.currentBytes = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.evictions = 0
+        # size and last modification time of each file, least recently used first
+        self._index: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        # speech handles and when they expire, oldest first
+        self._handles: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._handleWrites = 0
+        # syntheses in progress, so concurrent misses of a key synthesize it once
+        self._pending: dict[str, Future[bytes]] = {}
+        self._lock = threading.Lock()
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self._loadIndex()
+            self._purgeHandleFiles()
+
+    @staticmethod
+    def keyOf(text: str, languageCode: str, voiceName: str, encoding: str, speakingRate: float) -> str:
+        """
+        Get the cache key of a synthesis.
+
+        :param text: The synthesized text.
+        :param languageCode: The language code of the voice.
+        :param voiceName: The name of the voice.
+        :param encoding: The name of the audio encoding.
+        :param speakingRate: The speaking rate.
+        :return: The hex sha256 of the synthesis settings.
+        """
+        payload = json.dumps([text, languageCode, voiceName, encoding, float(speakingRate)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _filePath(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)  # type: ignore
+
+    def _handlePath(self, key: str) -> str:
+        return os.path.join(self.path, HANDLE_DIRECTORY, key)  # type: ignore
+
+    @staticmethod
+    def _writeFile(filePath: str, data: bytes) -> bool:
+        """Write a file atomically, return False if it cannot be written."""
+        directory = os.path.dirname(filePath)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # write to a temporary file first so readers never see partial data
+            fd, tempPath = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tempPath, filePath)
+        except OSError as e:
+            logger.warning(f"Failed to write tts cache file {filePath}: {e}")
+            return False
+        return True
+
+    def _loadIndex(self) -> None:
+        """Index the existing audio files, least recently used first."""
+        files: list[tuple[float, str, int]] = []
+        for directory, directories, names in os.walk(self.path):  # type: ignore
+            if directory == self.path and HANDLE_DIRECTORY in directories:
+                directories.remove(HANDLE_DIRECTORY)
+            for name in names:
+                if name.startswith(".tmp-"):
+                    continue
+                with contextlib.suppress(OSError):
+                    stat = os.stat(os.path.join(directory, name))
+                    files.append((stat.st_mtime, name, stat.st_size))
+        files.sort()
+        for mtime, key, size in files:
+            self._index[key] = (size, mtime)
+            self.currentBytes += size
+        logger.info(f"Loaded tts cache index of {len(self._index)} files, {self.currentBytes} bytes")
+        self._evict()
+
+    def _evict(self) -> None:
+        """Remove the least recently used files until the cache is within its size, called with the lock held."""
+        while self._index and self.currentBytes > self.maxBytes:
+            key, (size, _) = self._index.popitem(last=False)
+            self.currentBytes -= size
+            self.evictions += 1
+            with contextlib.suppress(OSError):
+                os.remove(self._filePath(key))
+
+    def _touch(self, key: str) -> None:
+        """Mark a file as recently used, its modification time orders the index when it is loaded again."""
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return
+            self._index.move_to_end(key)
+            if now - entry[1] < self.touchIntervalSeconds:
+                return
+            self._index[key] = (entry[0], now)
+        with contextlib.suppress(OSError):
+            os.utime(self._filePath(key), (now, now))
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        """
+        Get cached audio and mark it as recently used.
+
+        :param key: The cache key.
+        :return: The audio or None if it is not cached.
+        """
+        data = self.memory.get(key)
+        if data is not None:
+            # a memory hit is a use of the file too, or it ages out of the directory while hot
+            self._touch(key)
+            return data
+        if self.path is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            known = key in self._index
+        if known:
+            filePath = self._filePath(key)
+            try:
+                with open(filePath, "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                if key in self._index:
+                    self.currentBytes -= self._index.pop(key)[0]
+                return None
+            self.diskHits += 1
+        self._touch(key)
+        self.memory.put(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Cache audio.
+
+        :param key: The cache key.
+        :param data: The audio.
+        """
+        if not data:
+            return
+        self.memory.put(key, data)
+        if self.path is None or len(data) > self.maxBytes:
+            return
+        if not self._writeFile(self._filePath(key), data):
+            return
+        with self._lock:
+            if key in self._index:
+                self.currentBytes -= self._index.pop(key)[0]
+            self._index[key] = (len(data), time.time())
+            self.currentBytes += len(data)
+            self._evict()
+
+    def _purgeHandleFiles(self) -> None:
+        """Remove the expired speech handle files."""
+        expired = time.time() - self.handleSeconds
+        with contextlib.suppress(OSError), os.scandir(os.path.join(self.path, HANDLE_DIRECTORY)) as entries:  # type: ignore
+            for entry in entries:
+                with contextlib.suppress(OSError):
+                    if entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+
+    def getHandle(self, key: str) -> t.Optional[bytes]:
+        """
+        Get a speech handle.
+
+        :param key: The cache key of the audio.
+        :return: The handle or None if it is not stored or expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._handles.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        if self.path is None:
+            return None
+        handlePath = self._handlePath(key)
+        try:
+            expires = os.stat(handlePath).st_mtime + self.handleSeconds
+            with open(handlePath, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if expires <= now:
+            with contextlib.suppress(OSError):
+                os.remove(handlePath)
+            return None
+        with self._lock:
+            self._handles[key] = (data, expires)
+        return data
+
+    def putHandle(self, key: str, data: bytes) -> None:
+        """
+        Store a speech handle, kept for `handleSeconds` whatever the audio cache evicts.
+
+        :param key: The cache key of the audio.
+        :param data: The handle.
+        """
+        now = time.time()
+        with self._lock:
+            self._handles[key] = (data, now + self.handleSeconds)
+            self._handles.move_to_end(key)
+            while self._handles and next(iter(self._handles.values()))[1] <= now:
+                self._handles.popitem(last=False)
+            self._handleWrites += 1
+            purge = self._handleWrites % 256 == 0
+        if self.path is None:
+            return
+        self._writeFile(self._handlePath(key), data)
+        if purge:
+            self._purgeHandleFiles()
+
+    def getOrSynthesize(self, key: str, synthesize: t.Callable[[], bytes]) -> bytes:
+        """
+        Get cached audio, synthesizing and caching it on a miss.
+
+        Callers missing the same key at the same time wait for one synthesis.
+        `synthesize` must not get the same key again, it would wait for itself.
+
+        :param key: The cache key.
+        :param synthesize: Synthesize the audio.
+        :return: The audio.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                future: Future[bytes] = Future()
+                self._pending[key] = future
+                # a synthesis may have finished between the miss and the lock
+                cached = key in self.memory or key in self._index
+        if pending is not None:
+            return pending.result()
+        try:
+            data = self.get(key) if cached else None
+            if data is None:
+                data = synthesize()
+                self.put(key, data)
+            future.set_result(data)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+        return data
+
+    @property
+    def stats(self) -> dict[str, t.Any]:
+        """
+        Get the hit rate metrics of the cache.
+
+        :return: A dictionary of the counters of the memory and disk tiers.
+        """
+        memoryStats = self.memory.stats
+        with self._lock:
+            return {
+                "memoryHits": memoryStats["hits"],
+                "diskHits": self.diskHits,
+                "misses": self.misses,
+                "diskFiles": len(self._index),
+                "diskBytes": self.currentBytes,
+                "diskEvictions": self.evictions,
+                "memoryBytes": memoryStats["bytes"],
+            }
@@ -3,26 +3,104 @@ import typing as t
 from fastapi import APIRouter
 from fastapi import HTTPException
 from fastapi import Header
+from fastapi import Query
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 
 from .models import chatLLMDataModel
+from .models import chatLLMStreamModel
 from .models import ChatRecallModel
 from .models import ChatIdResponse
 
 from APIv2.config import settings
 from APIv2.logger import logger
 from APIv2.dependence import dbSessionDepend
+from APIv2.dependence import createDbSession
 from APIv2.dependence import getGoogleServiceDepend
 from APIv2.dependence import getUserSessionServiceDepend
 from APIv2.dependence import getChatLLMServiceDepend
+from APIv2.dependence import imageIngestPool
+from APIv2.modules.exception import ChatLLMServiceError
+from APIv2.modules.GoogleServices import GoogleServices
+from APIv2.modules.ApplicationModel import User
 
 from ChatLLMv2 import DataHandler
+from ChatLLMv2 import ImageIngest
 from ChatLLMv2.ChatModel.Property import InvokeContextValues
 
 router = APIRouter(prefix="/chatLLM")
 
 
+def parseRequestMessage(messageRequest: chatLLMDataModel.Request) -> t.Tuple[DataHandler.ChatMessage, InvokeContextValues]:
+    """
+    Parse the user message and invoke context from a chatLLM request.
+
+    :param messageRequest: The chatLLM request.
+    :raises HTTPException: If an attachment is invalid or cannot be processed.
+    :return: The user message and the context values for the invocation.
+    """
+    logger.debug(f"Parcing {messageRequest.chatId=} chat message")
+    try:
+        media = imageIngestPool.ingestDataUrls(messageRequest.content.media) if messageRequest.content.media is not None else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Image Provided")
+    except ImageIngest.ImageIngestError:
+        raise HTTPException(status_code=503, detail="Image Processing Unavailable, Please Retry")
+    attachments = list(map(
+        lambda m: DataHandler.MessageAttachment(
+            baseDataPath=settings.applicationChatLLMMessageAttachmentPath,
+            data=m[0],
+            mimeType=m[1],
+        ),
+        media
+    ))
+
+    message = DataHandler.ChatMessage("user", messageRequest.content.message, attachments)
+    contextValues = InvokeContextValues(
+        location=messageRequest.location if messageRequest.location else "unknown",
+    )
+    return message, contextValues
+
+
+def responseTextToSpeech(googleService: GoogleServices, text: str, messageRequest: chatLLMDataModel.Request) -> dict[str, t.Any]:
+    """
+    Get the TTS audio fields of a response as requested.
+
+    :param googleService: The google service of the request.
+    :param text: The response text.
+    :param messageRequest: The chatLLM request.
+    :return: The `ttsAudio`, `ttsAudioId` and `ttsAudioPlaylist` fields of the response.
+    """
+    fields: dict[str, t.Any] = {"ttsAudio": "", "ttsAudioId": None, "ttsAudioPlaylist": None}
+    if messageRequest.disableTTS:
+        return fields
+    encoding = messageRequest.ttsEncoding or settings.ttsAudioEncoding
+    try:
+        if messageRequest.ttsDelivery == "playlist":
+            fields["ttsAudioPlaylist"] = googleService.createSpeechPlaylist(text, encoding=encoding)
+        elif messageRequest.ttsDelivery == "handle":
+            fields["ttsAudioId"] = googleService.createSpeechHandle(text, encoding=encoding)
+        else:
+            fields["ttsAudio"] = googleService.textToSpeech(text, encoding=encoding)
+    except Exception as e:
+        logger.error(f"cannot perform tts {e}")
+    return fields
+
+
+def formatServerSentEvent(event: str, data: BaseModel) -> str:
+    """
+    Format a server-sent event.
+
+    :param event: The event name.
+    :param data: The event data.
+    :return: The event in text/event-stream format.
+    """
+    return f"event: {event}\ndata: {data.model_dump_json()}\n\n"
+
+
 @router.post("", response_model=chatLLMDataModel.Response)
-async def chatLLM(
+def chatLLM(
     getGoogleService: getGoogleServiceDepend,
     messageRequest: chatLLMDataModel.Request,
     dbSession: dbSessionDepend,
@@ -34,71 +112,126 @@ async def chatLLM(
     Invoke the language model with a user message and get the response.
     """
     requestChatId = messageRequest.chatId
-    requestDisableTTS = messageRequest.disableTTS
     logger.info(f"Validating chatLLM request {messageRequest=}")
     session = getUserSessionService(dbSession).validateSessionToken(x_SessionToken)
-    logger.debug(f"Parcing {requestChatId=} chat message")
-    try:
-        attachments = list(map(
-            lambda url: DataHandler.MessageAttachment(url, settings.applicationChatLLMMessageAttachmentPath),
-            messageRequest.content.media
-        )) if messageRequest.content.media is not None else []
-    except:
-        raise HTTPException(status_code=400, detail="Invalid Image Provided")
-
-    message = DataHandler.ChatMessage("user", messageRequest.content.message, attachments)
-    contextValues = InvokeContextValues(
-        location=messageRequest.location if messageRequest.location else "unknown",
-    )
+    message, contextValues = parseRequestMessage(messageRequest)
     logger.debug(f"Invoking {requestChatId=} controller")
     chatLLMService = getChatLLMService(dbSession, session.user)
     response: DataHandler.ChatMessage = chatLLMService.invokeChatModel(requestChatId, message, contextValues)
 
-    ttsAudio = ""
-    if not requestDisableTTS:
-        try:
-            ttsAudio = getGoogleService(dbSession, session.user).textToSpeech(response.text)
-        except Exception as e:
-            logger.error(f"cannot perform tts {e}")
-            ttsAudio = ""
+    ttsFields = responseTextToSpeech(getGoogleService(dbSession, session.user), response.text, messageRequest)
 
     dbSession.commit()
     return chatLLMDataModel.Response(
         message=response.text,
         chatId=requestChatId,
-        ttsAudio=ttsAudio,
+        **ttsFields,
     )
 
 
+@router.post("/stream", response_class=StreamingResponse)
+def chatLLMStream(
+    getGoogleService: getGoogleServiceDepend,
+    messageRequest: chatLLMDataModel.Request,
+    dbSession: dbSessionDepend,
+    getUserSessionService: getUserSessionServiceDepend,
+    getChatLLMService: getChatLLMServiceDepend,
+    x_SessionToken: t.Annotated[str | None, Header()] = None,
+) -> StreamingResponse:
+    """
+    Invoke the language model with a user message and stream the response as server-sent events.
+
+    Partial response text is sent as `token` events, tool usage as `toolStart`/`toolEnd` events,
+    and the saved response as the final `message` event in the same shape as `POST /chatLLM`.
+    """
+    requestChatId = messageRequest.chatId
+    logger.info(f"Validating chatLLM stream request {messageRequest=}")
+    session = getUserSessionService(dbSession).validateSessionToken(x_SessionToken)
+    message, contextValues = parseRequestMessage(messageRequest)
+    logger.debug(f"Streaming {requestChatId=} controller")
+    streamChat = getChatLLMService(dbSession, session.user).streamChatModel(requestChatId, message, contextValues)
+    userId = session.user.id
+    dbSession.commit()
+
+    def eventStream() -> t.Iterator[str]:
+        # the request session is closed once the route returns, before the response is streamed
+        with createDbSession() as streamSession:
+            try:
+                for event in streamChat(streamSession):
+                    if event.event != "message":
+                        yield formatServerSentEvent(event.event, chatLLMStreamModel.Event(
+                            content=event.content,
+                            toolName=event.toolName,
+                        ))
+                        continue
+
+                    user = streamSession.get(User, userId)
+                    ttsFields = responseTextToSpeech(getGoogleService(streamSession, user), event.content, messageRequest)
+                    streamSession.commit()
+                    yield formatServerSentEvent(event.event, chatLLMDataModel.Response(
+                        message=event.content,
+                        chatId=requestChatId,
+                        **ttsFields,
+                    ))
+            except ChatLLMServiceError as e:
+                logger.error(f"chatLLM stream for {requestChatId=} failed {e}")
+                yield formatServerSentEvent("error", chatLLMStreamModel.Error(
+                    detail="There is an error processing your request" if not e.args else e.args[0],
+                ))
+
+    return StreamingResponse(eventStream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
 @router.get("/recall/{chatId}", response_model=ChatRecallModel.Response)
-async def chatRecall(
+def chatRecall(
     chatId: str,
+    response: Response,
     dbSession: dbSessionDepend,
     getUserSessionService: getUserSessionServiceDepend,
     getChatLLMService: getChatLLMServiceDepend,
+    limit: t.Annotated[int | None, Query(ge=1, le=200)] = None,
+    before_id: t.Annotated[int | None, Query(ge=1)] = None,
     x_SessionToken: t.Annotated[str | None, Header()] = None,
-) -> ChatRecallModel.Response:
+    if_None_Match: t.Annotated[str | None, Header()] = None,
+) -> ChatRecallModel.Response | Response:
     """
     Recall a chat session and return the session.
+
+    Without `limit` all messages are returned. With `limit` the latest messages older than
+    `before_id` are returned, pass `nextBeforeId` of the response as `before_id` for the next page.
+    Responds 304 when `If-None-Match` matches the `ETag` of the same page.
     """
-    logger.info(f"Recalling {chatId=} controller")
+    logger.info(f"Recalling {chatId=} controller, {limit=}, {before_id=}")
     session = getUserSessionService(dbSession).validateSessionToken(x_SessionToken)
     chatLLMService = getChatLLMService(dbSession, session.user)
-    messages: t.List[DataHandler.ChatMessage] = chatLLMService.recall(chatId)
+    roles = ["user", "ai"]
+    lastMessageId = chatLLMService.recallLastMessageId(chatId, roles)
+    etag = f'"{lastMessageId or 0}-{limit or ""}-{before_id or ""}"'
+    if if_None_Match is not None and etag in [tag.strip() for tag in if_None_Match.split(",")]:
+        logger.debug(f"Recall {chatId=} not modified")
+        return Response(status_code=304, headers={"ETag": etag})
+
+    messages: t.List[DataHandler.ChatMessage] = chatLLMService.recall(chatId, limit, before_id, roles)
     responseMessageList = list(map(lambda i: ChatRecallModel.ResponseMessage(
+        id=i.id,
         role=i.role,
         message=i.text,
         dateTime=str(i.dateTime)
-    ), filter(lambda i: i.role != "system", messages)))
+    ), messages))
     logger.debug(f"Recalled {chatId=} messages")
+    response.headers["ETag"] = etag
     return ChatRecallModel.Response(
         chatId=chatId,
-        messages=responseMessageList
+        messages=responseMessageList,
+        nextBeforeId=messages[0].id if limit is not None and len(messages) == limit else None,
     )
 
 
 @router.get("/request", response_model=ChatIdResponse)
-async def chatRequest(
+def chatRequest(
     dbSession: dbSessionDepend,
     getUserSessionService: getUserSessionServiceDepend,
     getChatLLMService: getChatLLMServiceDepend,
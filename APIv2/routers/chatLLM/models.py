@@ -34,6 +34,14 @@ class chatLLMDataModel:
             description="controls weather to include TTS audio data in the response",
             default=None
         )
+        ttsEncoding: t.Optional[t.Literal["LINEAR16", "OGG_OPUS", "MP3"]] = Field(
+            description="The TTS audio encoding, LINEAR16 is WAV, the server default if not set",
+            default=None
+        )
+        ttsDelivery: t.Literal["inline", "handle", "playlist"] = Field(
+            description="inline to include the TTS audio in ttsAudio, handle to get a ttsAudioId to fetch from GET /googleServices/tts/{ttsAudioId}, playlist to get ttsAudioPlaylist of one id per sentence chunk",
+            default="inline"
+        )
 
     class Response(BaseModel):
         message: str = Field(
@@ -45,11 +53,48 @@ class chatLLMDataModel:
         ttsAudio: str = Field(
             description="TTS Audio data in base64",
         )
+        ttsAudioId: t.Optional[str] = Field(
+            description="The id of the TTS audio at GET /googleServices/tts/{ttsAudioId} when ttsDelivery is handle",
+            default=None,
+        )
+        ttsAudioPlaylist: t.Optional[list[str]] = Field(
+            description="The ids of the TTS audio of each sentence chunk, in play order, when ttsDelivery is playlist",
+            default=None,
+        )
+
+
+class chatLLMStreamModel:
+    """
+    Server-sent events of `POST /chatLLM/stream`.
+
+    `token`, `toolStart` and `toolEnd` events carry `Event`,
+    the final `message` event carries `chatLLMDataModel.Response`,
+    and an `error` event carries `Error`.
+    """
+
+    class Event(BaseModel):
+        content: str = Field(
+            description="Partial response text for token events, tool input for toolStart events",
+            default="",
+        )
+        toolName: t.Optional[str] = Field(
+            description="The name of the tool for toolStart and toolEnd events",
+            default=None,
+        )
+
+    class Error(BaseModel):
+        detail: str = Field(
+            description="Reason the stream was ended",
+        )
 
 
 class ChatRecallModel:
 
     class ResponseMessage(BaseModel):
+        id: t.Optional[int] = Field(
+            description="The message id, pass as before_id to get older messages",
+            default=None,
+        )
         role: t.Literal["user", "ai", "system"]
         message: str = Field(
             description="LLM Response Message",
@@ -65,6 +110,10 @@ class ChatRecallModel:
         messages: list["ChatRecallModel.ResponseMessage"] = Field(
             description="List of Messages",
         )
+        nextBeforeId: t.Optional[int] = Field(
+            description="The before_id of the next older page, None when there are no older messages",
+            default=None,
+        )
 
 
 class ChatIdResponse(BaseModel):
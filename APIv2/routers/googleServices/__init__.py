@@ -1,9 +1,22 @@
+import re
+import typing as t
+
 from fastapi import APIRouter
+from fastapi import Header
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi import Response
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartException
+from starlette.formparsers import MultiPartParser
 
 from .models import geocodeDataModel
 from .models import SpeechToTextModel
 from APIv2.dependence import dbSessionDepend
 from APIv2.dependence import getGoogleServiceDepend
+from APIv2.config import settings
+from APIv2.modules.GoogleServices import SpeechSynthesisError
 from APIv2.logger import logger
 
 
@@ -28,7 +41,7 @@ def get_geocoding(
 
 
 @router.post("/stt")
-def speechToText(
+async def speechToText(
     dbSession: dbSessionDepend,
     getGoogleService: getGoogleServiceDepend,
     request: SpeechToTextModel.Request,
@@ -47,8 +60,154 @@ def speechToText(
         return SpeechToTextModel.Response(
             message="No Audio"
         )
-    response = getGoogleService(dbSession, None).speechToText(dataSplit[1])
+    response = await run_in_threadpool(getGoogleService(dbSession, None).speechToText, dataSplit[1])
     logger.debug(f"Respondign to transcribe {request.audioData[:10]=} - {response[:10]=}")
     return SpeechToTextModel.Response(
         message=response
     )
+
+
+async def cappedBody(request: Request, maxBytes: int) -> t.AsyncGenerator[bytes, None]:
+    """
+    Stream the request body, stopping once it is larger than `maxBytes`, with or without a Content-Length.
+
+    :param request: The upload request.
+    :param maxBytes: The maximum bytes of the body.
+    :raises HTTPException: 413 if the body is larger than `maxBytes`.
+    :return: The body chunks.
+    """
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > maxBytes:
+            raise HTTPException(status_code=413, detail="Audio Too Large")
+        yield chunk
+
+
+async def readUploadedAudio(request: Request, maxBytes: int) -> bytes:
+    """
+    Read the audio of an upload, the "audio" file of a multipart form or the raw request body.
+
+    A raw body is collected in memory, at most `maxBytes`, a multipart file is spooled by the form parser.
+
+    :param request: The upload request.
+    :param maxBytes: The maximum bytes of the request body.
+    :raises HTTPException: 413 if the body is larger than `maxBytes`, 400 if the multipart form is invalid.
+    :return: The audio file data.
+    """
+    contentLength = request.headers.get("Content-Length", "")
+    if contentLength.isdigit() and int(contentLength) > maxBytes:
+        raise HTTPException(status_code=413, detail="Audio Too Large")
+    if request.headers.get("Content-Type", "").startswith("multipart/form-data"):
+        # parsed from the capped body, request.form would read a chunked body without limit
+        parser = MultiPartParser(request.headers, cappedBody(request, maxBytes), max_files=1, max_fields=1)
+        try:
+            form = await parser.parse()
+        except MultiPartException as e:
+            raise HTTPException(status_code=400, detail=e.message)
+        try:
+            audio = form.get("audio")
+            if not isinstance(audio, UploadFile):
+                return b""
+            return await audio.read()
+        finally:
+            await form.close()
+    body = bytearray()
+    async for chunk in cappedBody(request, maxBytes):
+        body += chunk
+    return bytes(body)
+
+
+@router.post("/stt/upload")
+async def speechToTextUpload(
+    dbSession: dbSessionDepend,
+    getGoogleService: getGoogleServiceDepend,
+    request: Request,
+) -> SpeechToTextModel.Response:
+    """
+    Transcribe an audio file sent as the raw request body, or as the `audio` file of a multipart form.
+
+    WAV is downmixed and resampled on the server, other formats need ffmpeg installed
+    or are sent to the recognizer as is.
+    """
+    data = await readUploadedAudio(request, settings.sttUploadMaxBytes)
+    logger.debug(f"Performing transcribe for upload of {len(data)} bytes")
+    if not data:
+        return SpeechToTextModel.Response(
+            message="No Audio"
+        )
+    response = await run_in_threadpool(getGoogleService(dbSession, None).transcribeAudio, data)
+    logger.debug(f"Respondign to transcribe upload of {len(data)} bytes - {response[:10]=}")
+    return SpeechToTextModel.Response(
+        message=response
+    )
+
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parseRange(rangeHeader: str, size: int) -> t.Optional[tuple[int, int]]:
+    """
+    Parse a single byte range of a Range header.
+
+    :param rangeHeader: The Range header value, like `bytes=0-1023`, `bytes=1024-` or `bytes=-512`.
+    :param size: The size of the content.
+    :raises ValueError: If the range cannot be satisfied.
+    :return: The first and last byte of the range, None if the header is not a single byte range.
+    """
+    match = RANGE_PATTERN.match(rangeHeader.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if start == "":
+        # suffix range, the last n bytes
+        first, last = max(0, size - int(end)), size - 1
+    else:
+        first, last = int(start), min(int(end), size - 1) if end else size - 1
+    if first > last or first >= size:
+        raise ValueError("Range Not Satisfiable")
+    return first, last
+
+
+@router.get("/tts/{audioId}", response_class=Response)
+def getTextToSpeechAudio(
+    audioId: str,
+    dbSession: dbSessionDepend,
+    getGoogleService: getGoogleServiceDepend,
+    rangeHeader: t.Annotated[str | None, Header(alias="Range")] = None,
+) -> Response:
+    """
+    Get the TTS audio of a `ttsAudioId` from chatLLM, with HTTP range support.
+
+    The audio is synthesized on the first fetch, the id is derived from the content so the response never changes.
+    """
+    logger.debug(f"Getting tts audio {audioId=} {rangeHeader=}")
+    try:
+        audio = getGoogleService(dbSession, None).speechAudio(audioId)
+    except SpeechSynthesisError as e:
+        if e.unavailable:
+            raise HTTPException(status_code=503, detail="Speech Synthesis Unavailable, Please Retry", headers={"Retry-After": "1"})
+        raise HTTPException(status_code=502, detail="Speech Synthesis Failed")
+    if audio is None:
+        raise HTTPException(status_code=404)
+    data, mimeType = audio
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=86400, immutable",
+        "ETag": f'"{audioId}"',
+    }
+    if rangeHeader is None:
+        return Response(content=data, media_type=mimeType, headers=headers)
+    try:
+        byteRange = parseRange(rangeHeader, len(data))
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(data)}"})
+    if byteRange is None:
+        return Response(content=data, media_type=mimeType, headers=headers)
+    first, last = byteRange
+    return Response(
+        content=data[first:last + 1],
+        status_code=206,
+        media_type=mimeType,
+        headers={**headers, "Content-Range": f"bytes {first}-{last}/{len(data)}"},
+    )
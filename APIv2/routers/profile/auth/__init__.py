@@ -19,7 +19,7 @@ router.include_router(cognito.router)
 
 
 @router.get("", response_model=AuthDataModel.Response)
-async def auth(
+def auth(
     dbSession: dbSessionDepend,
     getUserService: getUserServiceDepend,
     getTotpService: getTotpServiceDepend,
@@ -51,7 +51,7 @@ async def auth(
 
 
 @router.get("/ping", response_model=AuthDataModel.Response)
-async def ping(
+def ping(
     dbSession: dbSessionDepend,
     getUserSessionService:  getUserSessionServiceDepend,
     x_SessionToken: t.Annotated[str | None, Header()] = None,
@@ -20,7 +20,7 @@ router = APIRouter(prefix="/cognito")
 
 
 @router.get("", response_model=AuthDataModel.Response)
-async def cognitoLogin(
+def cognitoLogin(
     dbSession: dbSessionDepend,
     getCognitoService: getCognitoServiceDepend,
     getUserService: getUserServiceDepend,
@@ -24,7 +24,7 @@ router = APIRouter(prefix="/summory")
 
 
 @router.get("", response_model=ProfileSummoryGet.Response)
-async def requestSummoryGet(
+def requestSummoryGet(
     dbSession: dbSessionDepend,
     getUserSessionService: getUserSessionServiceDepend,
     x_SessionToken: t.Annotated[str | None, Header()] = None,
@@ -42,7 +42,7 @@ async def requestSummoryGet(
 
 
 @router.post("", response_model=ProfileSummoryRequest.Response)
-async def requestSummory(
+def requestSummory(
     dbSession: dbSessionDepend,
     getUserService: getUserServiceDepend,
     x_FacebookAccessToken: t.Annotated[str | None, Header()] = None,
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import functools
+import threading
+import typing as t
+from collections import OrderedDict
+
+from .ExternalIo import logger, FETCH_FAILED_MESSAGE, FailedResult
+
+
+# Injected by langchain, not part of the tool input
+IGNORED_ARGUMENTS = ["run_manager", "callbacks", "config"]
+
+
+def normalizeArgument(value: t.Any) -> t.Any:
+    """
+    Normalize a tool argument so equivalent inputs share a cache key.
+
+    Text is lower cased with whitespace collapsed, lists of scalars are sorted.
+
+    :param value: The argument value.
+    :return: The normalized value.
+    """
+    if isinstance(value, str):
+        return " ".join(value.split()).lower()
+    if isinstance(value, (list, tuple, set)):
+        items = [normalizeArgument(v) for v in value]  # type: ignore
+        if all(isinstance(i, (str, int, float)) for i in items):
+            items.sort(key=lambda i: (type(i).__name__, i))
+        return items
+    if isinstance(value, dict):
+        return {k: normalizeArgument(v) for k, v in sorted(value.items())}  # type: ignore
+    return value
+
+
+def makeKey(toolName: str, args: t.Tuple[t.Any, ...], kwargs: dict[str, t.Any]) -> str:
+    """
+    Make the cache key of a tool call.
+
+    Empty arguments are dropped, so a missing argument and its empty default share a key.
+
+    :param toolName: The name of the tool.
+    :param args: The positional arguments of the call.
+    :param kwargs: The keyword arguments of the call.
+    :return: The cache key.
+    """
+    normalized = {
+        k: normalizeArgument(v) for k, v in kwargs.items()
+        if k not in IGNORED_ARGUMENTS and v not in (None, "", [], {})
+    }
+    payload = json.dumps([normalizeArgument(list(args)), normalized], sort_keys=True, default=str, ensure_ascii=False)
+    return f"{toolName}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+class ToolResultCache:
+    """
+    Cache of tool results with a per entry time to live.
+
+    Results are kept in an in-process LRU, backed by an optional sqlite file
+    that all worker processes on the host share.
+    """
+
+    def __init__(self,
+                 path: t.Optional[str] = None,
+                 maxMemoryEntries: int = 1024,
+                 ) -> None:
+        """
+        Initialize a ToolResultCache instance.
+
+        :param path: The sqlite file shared between processes, in-process only if None.
+        :param maxMemoryEntries: The maximum number of results kept in process.
+        """
+        self.path = path
+        self.maxMemoryEntries = max(0, maxMemoryEntries)
+        self._memory: OrderedDict[str, t.Tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.memoryHits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.toolStats: dict[str, dict[str, int]] = {}
+        if self.path is not None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connection() as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS tool_results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get the sqlite connection of the current thread."""
+        connection: t.Optional[sqlite3.Connection] = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)  # type: ignore
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, key: str, counter: str) -> None:
+        toolName = key.split(":")[0]
+        stats = self.toolStats.setdefault(toolName, {"hits": 0, "misses": 0})
+        stats[counter] += 1
+
+    def _remember(self, key: str, value: str, expires: float) -> None:
+        if not self.maxMemoryEntries:
+            return
+        self._memory[key] = (value, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxMemoryEntries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> t.Optional[str]:
+        """
+        Get a cached result.
+
+        :param key: The cache key.
+        :return: The result or None if it is not cached or expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] > now:
+                self._memory.move_to_end(key)
+                self.memoryHits += 1
+                self._count(key, "hits")
+                return entry[0]
+            if entry is not None:
+                del self._memory[key]
+
+        row = None
+        if self.path is not None:
+            try:
+                row = self._connection().execute(
+                    "SELECT value, expires FROM tool_results WHERE key = ? AND expires > ?", (key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to read tool cache {self.path}: {e}")
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                self._count(key, "misses")
+                return None
+            self.diskHits += 1
+            self._count(key, "hits")
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def set(self, key: str, value: str, ttlSeconds: float) -> None:
+        """
+        Cache a result.
+
+        :param key: The cache key.
+        :param value: The result.
+        :param ttlSeconds: How long the result stays valid.
+        """
+        expires = time.time() + ttlSeconds
+        with self._lock:
+            self._remember(key, value, expires)
+            self._writes += 1
+            purge = self._writes % 256 == 0
+        if self.path is None:
+            return
+        try:
+            connection = self._connection()
+            connection.execute("INSERT OR REPLACE INTO tool_results (key, value, expires) VALUES (?, ?, ?)", (key, value, expires))
+            if purge:
+                connection.execute("DELETE FROM tool_results WHERE expires <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write tool cache {self.path}: {e}")
+
+    @property
+    def stats(self) -> dict[str, t.Any]:
+        """
+        Get the hit rate metrics of the cache.
+
+        :return: A dictionary of the counters, with per tool hits and misses.
+        """
+        with self._lock:
+            lookups = self.memoryHits + self.diskHits + self.misses
+            return {
+                "memoryHits": self.memoryHits,
+                "diskHits": self.diskHits,
+                "misses": self.misses,
+                "hitRate": (self.memoryHits + self.diskHits) / lookups if lookups else 0.0,
+                "memoryEntries": len(self._memory),
+                "tools": {name: dict(counters) for name, counters in self.toolStats.items()},
+            }
+
+
+toolResultCache: t.Optional[ToolResultCache] = ToolResultCache()
+
+
+def setToolResultCache(cache: t.Optional[ToolResultCache]) -> None:
+    """
+    Set the cache used by cached tools, None disables caching.
+
+    :param cache: The cache to use.
+    """
+    global toolResultCache
+    toolResultCache = cache
+
+
+def cachedRun(ttlSeconds: float) -> t.Callable[[t.Callable[..., t.Any]], t.Callable[..., t.Any]]:
+    """
+    Cache the results of a tool `_run` method by its normalized arguments.
+
+    Only successful text results are cached, `FailedResult` and results of failed fetches are not.
+
+    example usage:
+    @cachedRun(ttlSeconds=600)
+    def _run(self, **kwargs) -> str:
+
+    :param ttlSeconds: How long a result stays valid.
+    """
+    def decorator(func: t.Callable[..., t.Any]) -> t.Callable[..., t.Any]:
+        @functools.wraps(func)
+        def wrapper(self: t.Any, *args: t.Any, **kwargs: t.Any) -> t.Any:
+            cache = toolResultCache
+            if cache is None:
+                return func(self, *args, **kwargs)
+            key = makeKey(self.name, args, kwargs)
+            cached = cache.get(key)
+            if cached is not None:
+                logger.debug(f"Tool cache hit for {self.name}")
+                return cached
+            result = func(self, *args, **kwargs)
+            if isinstance(result, str) and not isinstance(result, FailedResult) and FETCH_FAILED_MESSAGE not in result:
+                cache.set(key, result, ttlSeconds)
+            return result
+        return wrapper
+    return decorator
@@ -1,7 +1,14 @@
 import os
 import json
-import requests
+import time
 import logging
+import threading
+import typing as t
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +24,13 @@ def setLogger(external_logger: logging.Logger) -> None:
     logger = external_logger
 
 
+FETCH_FAILED_MESSAGE = "Failed to get data from url"
+
+
+class FailedResult(str):
+    """A tool result reporting a failure, passed to the llm as text but never cached"""
+
+
 REQUEST_HEADERS = {
     "accept": "application/json",
     "accept-language": "en,en-US;q=0.9,en-GB;q=0.8,en-HK;q=0.7,zh-HK;q=0.6,zh;q=0.5",
@@ -35,32 +49,214 @@ REQUEST_HEADERS = {
 }
 
 
-def fetch(url: str, params: dict = {}) -> dict | list | str:
-    logger.info(f"Fetching data from: {url}")
-    response = requests.request(
-        method=params.get("method", "GET"),
-        url=url,
-        headers=params.get("headers", REQUEST_HEADERS),
-        data=params.get("body", None),
-    )
-    if not response.ok:
-        logger.error(f'Failed Fetching data from: {url}')
-        return "Failed to get data from url"
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class HttpStats:
+    """
+    Per host latency and connection reuse counters of a http client.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hosts: dict[str, dict[str, float]] = {}
+
+    def record(self, host: str, seconds: float, newConnections: int, failed: bool = False) -> None:
+        """
+        Record a request.
+
+        :param host: The host of the request.
+        :param seconds: How long the request took, including retries.
+        :param newConnections: The number of connections opened for the request, 0 if a pooled connection was reused.
+        :param failed: Whether the request failed.
+        """
+        with self._lock:
+            stats = self.hosts.setdefault(host, {
+                "requests": 0, "errors": 0, "connections": 0, "reusedConnections": 0,
+                "totalSeconds": 0.0, "maxSeconds": 0.0,
+            })
+            stats["requests"] += 1
+            stats["errors"] += int(failed)
+            stats["connections"] += newConnections
+            stats["reusedConnections"] += int(not failed and newConnections == 0)
+            stats["totalSeconds"] += seconds
+            stats["maxSeconds"] = max(stats["maxSeconds"], seconds)
+
+    @property
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Get the counters of each host.
+
+        :return: A dictionary of host to its counters, with the average seconds of a request.
+        """
+        with self._lock:
+            return {
+                host: {**stats, "averageSeconds": stats["totalSeconds"] / stats["requests"] if stats["requests"] else 0.0}
+                for host, stats in self.hosts.items()
+            }
+
+
+class HttpClient:
+    """
+    Connection pooled http client of the tools.
+
+    One keep alive session is shared by every tool, with connect and read timeouts,
+    a bounded number of connections per host and retries with jittered backoff
+    on connection errors and 429 or 5xx responses of idempotent requests.
+    """
+
+    def __init__(self,
+                 connectTimeout: float = 5.0,
+                 readTimeout: float = 20.0,
+                 retries: int = 2,
+                 backoffFactor: float = 0.3,
+                 backoffJitter: float = 0.3,
+                 poolConnections: int = 8,
+                 poolMaxSize: int = 8,
+                 ) -> None:
+        """
+        Initialize a HttpClient instance.
+
+        :param connectTimeout: Seconds to wait for a connection.
+        :param readTimeout: Seconds to wait between bytes of the response.
+        :param retries: The number of retries after the first attempt.
+        :param backoffFactor: The base seconds of the exponential backoff between retries.
+        :param backoffJitter: The maximum random seconds added to each backoff.
+        :param poolConnections: The number of hosts connections are kept for.
+        :param poolMaxSize: The maximum number of connections kept per host.
+        """
+        self.timeout = (connectTimeout, readTimeout)
+        self.retries = max(0, retries)
+        self.backoffFactor = backoffFactor
+        self.backoffJitter = backoffJitter
+        self.poolConnections = poolConnections
+        self.poolMaxSize = poolMaxSize
+        self.httpStats = HttpStats()
+        self._session: t.Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """The pooled session, created on first use."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    retry = Retry(
+                        total=self.retries,
+                        backoff_factor=self.backoffFactor,
+                        backoff_jitter=self.backoffJitter,
+                        status_forcelist=RETRY_STATUS_CODES,
+                        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                        respect_retry_after_header=True,
+                        raise_on_status=False,
+                    )
+                    adapter = HTTPAdapter(
+                        pool_connections=self.poolConnections,
+                        pool_maxsize=self.poolMaxSize,
+                        pool_block=True,
+                        max_retries=retry,
+                    )
+                    session = requests.Session()
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def _openedConnections(self, url: str) -> int:
+        """
+        Get the number of connections the pools of the url host have opened so far.
+
+        Concurrent requests to the same host may see each other's connections,
+        the counts are exact for sequential requests.
+        """
+        hostname = urlsplit(url).hostname
+        try:
+            pools = self.session.get_adapter(url).poolmanager.pools  # type: ignore
+            return sum(pools[key].num_connections for key in pools.keys() if key.key_host == hostname)
+        except Exception:
+            return 0
+
+    def request(self, method: str, url: str, headers: t.Optional[dict] = None, data: t.Any = None) -> requests.Response:
+        """
+        Send a request.
+
+        :param method: The http method.
+        :param url: The url.
+        :param headers: The request headers.
+        :param data: The request body.
+        :raises requests.RequestException: If the request failed after all retries.
+        :return: The response.
+        """
+        host = urlsplit(url).netloc
+        openedBefore = self._openedConnections(url)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method=method, url=url, headers=headers, data=data, timeout=self.timeout)
+        except requests.RequestException:
+            self.httpStats.record(host, time.perf_counter() - start, self._openedConnections(url) - openedBefore, failed=True)
+            raise
+        seconds = time.perf_counter() - start
+        newConnections = self._openedConnections(url) - openedBefore
+        self.httpStats.record(host, seconds, newConnections, failed=not response.ok)
+        logger.debug(f"{method} {host} {response.status_code} in {seconds:.3f}s, {'new' if newConnections else 'reused'} connection")
+        return response
+
+    @property
+    def stats(self) -> dict[str, dict[str, float]]:
+        return self.httpStats.stats
+
+    def close(self) -> None:
+        """Close the pooled connections."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+httpClient = HttpClient()
+
+
+def setHttpClient(client: HttpClient) -> None:
+    """
+    Set the http client used by fetch.
+
+    :param client: The client of fetch.
+    """
+    global httpClient
+    httpClient = client
+
+
+def decode_response(url: str, responseContent: bytes) -> dict | list | str:
     try:
-        responseContent = response.content
         decodedContent = responseContent.decode("utf-8")
         return json.loads(decodedContent)
     except json.decoder.JSONDecodeError:
-        return response.content.decode("utf-8")
+        return responseContent.decode("utf-8")
     except Exception as e:
         if os.path.exists("./errors"):
             with open("./errors/last.txt", 'w') as f:
                 f.write(str(responseContent))
-            with open("./errors/last-dev.txt", 'w') as f:
-                f.write(str(decodedContent))
         raise Exception(f'Failed Decoding data from: {url}: Error: {e}')
 
 
+def fetch(url: str, params: dict = {}) -> dict | list | str:
+    logger.info(f"Fetching data from: {url}")
+    try:
+        response = httpClient.request(
+            method=params.get("method", "GET"),
+            url=url,
+            headers=params.get("headers", REQUEST_HEADERS),
+            data=params.get("body", None),
+        )
+    except requests.RequestException as e:
+        logger.error(f'Failed Fetching data from: {url}: {e}')
+        return FETCH_FAILED_MESSAGE
+    if not response.ok:
+        logger.error(f'Failed Fetching data from: {url}')
+        return FETCH_FAILED_MESSAGE
+    return decode_response(url, response.content)
+
+
 def create_folder_if_not_exists(folder_path: str):
     if not os.path.exists(folder_path):
         logger.info(f"Folder {folder_path} does not exist, creating")
@@ -7,7 +7,8 @@ from langchain_google_community import GoogleSearchAPIWrapper
 
 import googlemaps
 
-from .ExternalIo import logger
+from .ExternalIo import logger, FailedResult
+from .Cache import cachedRun
 
 
 class GoogleToolBase(BaseTool):
@@ -35,10 +36,11 @@ class PerformGoogleSearchTool(GoogleToolBase):
     description: str = "Used to perform google search to get recent and relevent information. Can be used to lookup anything. If there is somethgin you are not 100% sure, use this to look it up."
     args_schema: t.Type[BaseModel] = ToolArgs
 
+    @cachedRun(ttlSeconds=3600)
     def _run(self, query: str, **kwargs) -> str:
         if not self._google_api_key or not self._google_cse_id:
             logger.debug("No google api key defined, returning not avalable")
-            return 'Cannot Perform Google Search'
+            return FailedResult('Cannot Perform Google Search')
         search = GoogleSearchAPIWrapper(
             google_api_key=self._google_api_key,
             google_cse_id=self._google_cse_id
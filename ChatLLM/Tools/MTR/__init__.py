@@ -3,7 +3,9 @@ from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool
 from google.oauth2.service_account import Credentials
 
-from .caller import MTRApi
+from .caller import MTRApi, getMTRApi
+from ..Cache import cachedRun
+from ..ExternalIo import logger
 
 
 class MTRApiToolBase(BaseTool):
@@ -13,11 +15,13 @@ class MTRApiToolBase(BaseTool):
                  **kwargs:  dict[str, t.Any],
                  ) -> None:
         super().__init__(**kwargs)
-        self._mtr = MTRApi(credentials=credentials, **kwargs)
+        self._credentials = credentials
+        self._mtrKwargs = kwargs
 
     @property
     def mtr(self,) -> MTRApi:
-        return self._mtr
+        # one MTRApi with its embeddings and chroma clients is shared by all MTR tools
+        return getMTRApi(credentials=self._credentials, **self._mtrKwargs)
 
 
 class GetAllMTRStationInfoTool(MTRApiToolBase):
@@ -75,10 +79,29 @@ class GetMTRRouteSuggestionTool(MTRApiToolBase):
         destination_station_id: int = Field(
             description="ID of the destination MTR Station, can be either obtained from the `Get MTR Station By Name` tool, or the `Get All MTR Station Info` tool."
         )
+        include_fares: bool = Field(
+            default=False,
+            description="Set to true only when fares or the live route options from MTR are needed, it is slower."
+        )
 
     name: str = "Get_MTR_Route_Suggention"
-    description: str = "Used to get route suggestion by MTR, providing the origin and destination station id will resault one or more route option from origin to destination station. This tool return a string description of each route info."
+    description: str = "Used to get route suggestion by MTR, providing the origin and destination station id will resault one or more route option from origin to destination station. This tool return a string description of each route info. By default the fastest route is estimated locally without fares, or taken from MTR when a line on it is delayed, set `include_fares` to get fares and the route options from MTR."
     args_schema: t.Type[BaseModel] = ToolArgs
 
-    def _run(self, origin_station_id: int, destination_station_id: int, **kwargs) -> str:
+    @cachedRun(ttlSeconds=86400)
+    def _cached_route_suggestion(self, origin_station_id: int, destination_station_id: int) -> str:
+        return self.mtr.get_route_suggestion(origin_station_id, destination_station_id)
+
+    def _run(self, origin_station_id: int, destination_station_id: int, include_fares: bool = False, **kwargs) -> str:
+        # the local route depends on the live line status, only the MTR api result is cached
+        if include_fares:
+            return self._cached_route_suggestion(origin_station_id, destination_station_id)
+        try:
+            local_route = self.mtr.get_local_route_suggestion(origin_station_id, destination_station_id)
+        except Exception as e:
+            logger.warning(f"Local MTR routing failed, using MTR api: {e}")
+            return self._cached_route_suggestion(origin_station_id, destination_station_id)
+        if local_route is not None:
+            return local_route
+        # not connected locally or a line on the route is delayed, the MTR journey planner has the live service
         return self.mtr.get_route_suggestion(origin_station_id, destination_station_id)
@@ -1,5 +1,7 @@
 import os
+import time
 import inspect
+import threading
 
 import typing as t
 
@@ -8,12 +10,20 @@ from langchain_google_vertexai import VertexAIEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 
-from ..ExternalIo import fetch, write_file, read_file, logger
+from ..ExternalIo import fetch, write_file, read_file, logger, FailedResult
+from .routing import MTRRouter, LINE_NAMES
+from .stations import StationTable, Station
 
 
 class MTRApi():
 
-    _stations = []
+    # station tables by data source, shared by every instance
+    _stationTables: dict[str, StationTable] = {}
+    _stationTablesLock = threading.Lock()
+    # live delay flags by (line code, station code), with the time they expire
+    _lineDelays: dict[t.Tuple[str, str], t.Tuple[bool, float]] = {}
+    _lineDelaysLock = threading.Lock()
+    line_status_ttl_seconds = 60
 
     def __init__(self,
                  credentials: t.Optional[Credentials] = None,
@@ -95,64 +105,124 @@ class MTRApi():
         )
 
     @property
-    def stations(self) -> list[dict[str, str]]:
-        if self._stations:
-            return self._stations
-        # No data in RAM
-        docs_in_db = self.vector_store.get(include=["documents"])["documents"]
-        if not docs_in_db:
-            logger.debug('No data found in chroma db, loading data')
-            self.load_data()
-            docs_in_db = self.vector_store.get(
-                include=["documents"])["documents"]
-        # logger.debug(docs_in_db)
-        self._stations = list(
-            map(MTRApi.format_chroma_doc_to_dict, docs_in_db))
-        return self._stations
+    def station_table(self) -> StationTable:
+        table_key = f"{self.chroma_db_path if self.store else ''}:{self.chroma_db_collection}"
+        table = MTRApi._stationTables.get(table_key)
+        if table:
+            return table
+        with MTRApi._stationTablesLock:
+            table = MTRApi._stationTables.get(table_key)
+            if table:
+                return table
+            # No data in RAM
+            docs_in_db = self.vector_store.get(include=["documents"])["documents"]
+            if not docs_in_db:
+                logger.debug('No data found in chroma db, loading data')
+                self.load_data()
+                docs_in_db = self.vector_store.get(
+                    include=["documents"])["documents"]
+            table = StationTable(map(MTRApi.format_chroma_doc_to_dict, docs_in_db))
+            logger.debug(f"Loaded {len(table)} MTR station rows")
+            MTRApi._stationTables[table_key] = table
+        return table
+
+    @property
+    def stations(self) -> t.Sequence[Station]:
+        return self.station_table.rows
 
     @staticmethod
-    def prettify_station(stations: list[dict[str, str]] | dict[str, str]) -> str:
-        if type(stations) is not list:
-            stations = [stations] if isinstance(stations, dict) else stations
+    def prettify_station(stations: t.Sequence[Station] | Station) -> str:
+        if not isinstance(stations, (list, tuple)):
+            stations = [stations]
         headers = ",".join(stations[0].keys())
         values = "\n".join(
             [",".join(str(value) for value in station.values()) for station in stations])
         return f"{headers}\n{values}"
 
-    def get_station_from_station_id(self, station_id: int) -> dict[str, str] | None:
+    def get_station_from_station_id(self, station_id: int) -> Station | None:
         logger.debug("Getting Station ID " + str(station_id))
-        filtered_stations = list(
-            filter(lambda station: station['Station ID'] == f"{station_id}", self.stations))
-        return filtered_stations[0] if filtered_stations else None
+        return self.station_table.getById(station_id)
 
-    def get_station_from_station_code(self, station_code: str) -> dict[str, str] | None:
+    def get_station_from_station_code(self, station_code: str) -> Station | None:
         logger.debug("Getting Station Code " + str(station_code))
-        filtered_stations = list(
-            filter(lambda station: station['Station Code'] == f"{station_code}", self.stations))
-        return filtered_stations[0] if filtered_stations else None
+        return self.station_table.getByCode(station_code)
 
-    def get_station_from_station_name(self, station_name: str) -> list[dict[str, str]] | None:
+    def get_station_from_station_name(self, station_name: str) -> t.Sequence[Station] | None:
         logger.debug("Seasrching Station Name " + str(station_name))
-        if self.vector_store.get(limit=1, include=["documents"])["documents"] == []:
-            logger.debug(
-                "No data in Chroma DB yet. Calling .stations to inti chroma db")
-            self.stations
+        # also makes sure the chroma db has data
+        lexical_match, match_type = self.station_table.nameIndex.search(station_name, limit=4)
+        if lexical_match:
+            logger.debug(f"Found {len(lexical_match)} station by {match_type} name match")
+            return lexical_match
+        logger.debug("No lexical match, searching by embeddings")
         resault = self.vector_store.similarity_search(station_name, k=4)
         logger.debug("Found Station " + str(resault))
         return list(map(MTRApi.format_chroma_doc_to_dict, list(map(lambda d: d.page_content, resault))))
 
+    @property
+    def router(self) -> MTRRouter:
+        return self.station_table.router
+
+    def is_line_delayed(self, line_code: str, station_id: int) -> bool:
+        """Check the MTR next train data for a live delay on a line at a station, False if the status is unknown"""
+        station_code = (self.get_station_from_station_id(station_id) or {}).get('Station Code')
+        if not station_code:
+            return False
+        key = (line_code, station_code)
+        now = time.time()
+        with MTRApi._lineDelaysLock:
+            status = MTRApi._lineDelays.get(key)
+        if status is not None and status[1] > now:
+            return status[0]
+        json_data = fetch(url=f"https://rt.data.gov.hk/v1/transport/mtr/getSchedule.php?line={line_code}&sta={station_code}")
+        if not isinstance(json_data, dict):
+            logger.warning(f"No MTR line status for {line_code} at {station_code}")
+            return False
+        delayed = json_data.get("isdelay") == "Y"
+        with MTRApi._lineDelaysLock:
+            MTRApi._lineDelays[key] = (delayed, now + self.line_status_ttl_seconds)
+        return delayed
+
+    def get_local_route_suggestion(self, originStationId: int, destinationStationId: int) -> str | None:
+        """Get the fastest route from the local network graph, None if it cannot be routed locally or a line on it is delayed"""
+        route = self.router.route(originStationId, destinationStationId)
+        if route is None:
+            return None
+        delayed_lines = [leg.lineCode for leg in route.legs if self.is_line_delayed(leg.lineCode, leg.fromStationId)]
+        if delayed_lines:
+            logger.info(f"MTR delays reported on {', '.join(delayed_lines)}, not routing locally")
+            return None
+
+        def station_name(station_id: int) -> str:
+            return (self.get_station_from_station_id(station_id) or {}).get('English Name', 'Unknown Station')
+
+        text = []
+        text.append("Estimated route from the MTR network, times are estimates. Fares are not included.")
+        text.append(f"\nFrom {station_name(route.originStationId)} to {station_name(route.destinationStationId)}")
+        text.append(f"Estimated Time: {round(route.minutes)} minutes")
+        text.append(f"Stops: {route.stops}, Interchanges: {route.interchanges}")
+        text.append("Path:(Sequence of Lines)")
+        for leg in route.legs:
+            text.append("  {}: {} to {}, {} stops".format(
+                LINE_NAMES.get(leg.lineCode, leg.lineCode),
+                station_name(leg.fromStationId),
+                station_name(leg.toStationId),
+                leg.stops,
+            ))
+        return "\n".join(text)
+
     def get_route_suggestion(self, originStationId: int, destinationStationId: int) -> str:
         queryParams = f'lang=E&o={originStationId}&d={destinationStationId}'
         json_data = fetch(url="https://www.mtr.com.hk/share/customer/jp/api/HRRoutes/?" + queryParams)
         if isinstance(json_data, dict) and json_data.get("errorCode") != "0":
-            return json_data.get("errorMsg", "Unknown error")
+            return FailedResult(json_data.get("errorMsg", "Unknown error"))
         text = []
         text.append("Terms and Conditions:")
         if isinstance(json_data, dict) and 'tnc' in json_data:
             text.append(json_data['tnc'])
 
         if not isinstance(json_data, dict):
-            return "No Data"
+            return FailedResult("No Data")
         for route in json_data.get('routes', []):
             text.append(f"\nRoute Option Name: {route['routeName']}")
             text.append(f"Total Time: {route['time']} minutes")
@@ -178,3 +248,30 @@ class MTRApi():
                 text.append(f"  {path_text}")
 
         return "\n".join(text)
+
+
+_mtrApis: dict[tuple[t.Any, ...], MTRApi] = {}
+_mtrApisLock = threading.Lock()
+
+
+def getMTRApi(credentials: t.Optional[Credentials] = None, **kwargs: t.Any) -> MTRApi:
+    """
+    Get the MTRApi of the given settings, created on first use and shared by every caller.
+
+    :param credentials: The credentials for the embeddings.
+    :param kwargs: The MTRApi settings.
+    :return: The shared MTRApi.
+    """
+    parameters = inspect.signature(MTRApi.__init__).parameters
+    settings = tuple(kwargs.get(name, parameters[name].default) for name in ["store", "chroma_db_path", "chroma_db_colection", "data_csv_file_path", "mtr_data_url"])
+    key = (getattr(credentials, "project_id", None), getattr(credentials, "service_account_email", None)) + settings
+    mtr = _mtrApis.get(key)
+    if mtr is not None:
+        return mtr
+    with _mtrApisLock:
+        mtr = _mtrApis.get(key)
+        if mtr is None:
+            logger.debug(f"Creating shared MTRApi for {settings}")
+            mtr = MTRApi(credentials=credentials, **kwargs)
+            _mtrApis[key] = mtr
+    return mtr
@@ -0,0 +1,191 @@
+import typing as t
+from collections import defaultdict
+
+import numpy as np
+from pydantic.dataclasses import dataclass
+
+from ..ExternalIo import logger
+
+
+LINE_NAMES = {
+    "AEL": "Airport Express",
+    "DRL": "Disneyland Resort Line",
+    "EAL": "East Rail Line",
+    "ISL": "Island Line",
+    "KTL": "Kwun Tong Line",
+    "SIL": "South Island Line",
+    "TCL": "Tung Chung Line",
+    "TKL": "Tseung Kwan O Line",
+    "TML": "Tuen Ma Line",
+    "TWL": "Tsuen Wan Line",
+}
+
+
+@dataclass
+class RouteLeg:
+    lineCode: str
+    fromStationId: int
+    toStationId: int
+    stops: int
+
+
+@dataclass
+class Route:
+    originStationId: int
+    destinationStationId: int
+    minutes: float
+    stops: int
+    interchanges: int
+    legs: list[RouteLeg]
+
+
+class MTRRouter:
+    """
+    Route between MTR stations on a graph built from the MTR lines and stations data.
+
+    Each node is a station on a line. Consecutive stations of a line are linked by a ride,
+    and the nodes of the same station on different lines by an interchange.
+    The shortest time, stops and interchanges between every pair of stations are precomputed,
+    so looking up a journey does not search the graph.
+    Travel times are estimates from a fixed time per stop and per interchange, the data has no timetable.
+    """
+
+    def __init__(self,
+                 stations: t.List[dict[str, str]],
+                 minutesPerStop: float = 2.0,
+                 interchangeMinutes: float = 5.0,
+                 ) -> None:
+        """
+        Initialize a MTRRouter instance.
+
+        :param stations: The rows of the MTR lines and stations data, with `Line Code`, `Direction`, `Station ID` and `Sequence`.
+        :param minutesPerStop: The estimated minutes of riding to the next station.
+        :param interchangeMinutes: The estimated minutes of changing line at a station.
+        """
+        self.minutesPerStop = minutesPerStop
+        self.interchangeMinutes = interchangeMinutes
+
+        sequences: dict[t.Tuple[str, str], list[t.Tuple[float, int]]] = defaultdict(list)
+        for row in stations:
+            try:
+                key = (row["Line Code"].strip(), row["Direction"].strip())
+                sequences[key].append((float(row["Sequence"]), int(row["Station ID"])))
+            except (KeyError, ValueError):
+                continue
+
+        # nodes are (line code, station id)
+        self.nodes: list[t.Tuple[str, int]] = sorted({(line, stationId) for (line, _), seq in sequences.items() for _, stationId in seq})
+        self.nodeIndex = {node: i for i, node in enumerate(self.nodes)}
+        self.stationIds: list[int] = sorted({stationId for _, stationId in self.nodes})
+        self.stationIndex = {stationId: i for i, stationId in enumerate(self.stationIds)}
+
+        nodeCount = len(self.nodes)
+        time = np.full((nodeCount, nodeCount), np.inf)
+        stops = np.zeros((nodeCount, nodeCount), dtype=np.int32)
+        interchanges = np.zeros((nodeCount, nodeCount), dtype=np.int32)
+        np.fill_diagonal(time, 0)
+
+        for (line, _), seq in sequences.items():
+            seq.sort()
+            for (_, a), (_, b) in zip(seq, seq[1:]):
+                i, j = self.nodeIndex[(line, a)], self.nodeIndex[(line, b)]
+                for x, y in ((i, j), (j, i)):
+                    time[x, y] = minutesPerStop
+                    stops[x, y] = 1
+
+        nodesOfStation: dict[int, list[int]] = defaultdict(list)
+        for i, (_, stationId) in enumerate(self.nodes):
+            nodesOfStation[stationId].append(i)
+        for nodeIndexes in nodesOfStation.values():
+            for i in nodeIndexes:
+                for j in nodeIndexes:
+                    if i != j:
+                        time[i, j] = interchangeMinutes
+                        interchanges[i, j] = 1
+
+        # next node on the shortest path from i to j
+        nextNode = np.where(np.isfinite(time), np.arange(nodeCount)[None, :], -1).astype(np.int32)
+
+        logger.debug(f"Computing MTR all pairs shortest paths for {nodeCount} nodes")
+        for k in range(nodeCount):
+            candidate = time[:, k, None] + time[None, k, :]
+            better = candidate < time - 1e-9
+            time = np.where(better, candidate, time)
+            stops = np.where(better, stops[:, k, None] + stops[None, k, :], stops)
+            interchanges = np.where(better, interchanges[:, k, None] + interchanges[None, k, :], interchanges)
+            nextNode = np.where(better, nextNode[:, k, None], nextNode)
+        self.nodeTime = time
+        self.nextNode = nextNode
+
+        # reduce to stations, keeping the best pair of line nodes
+        stationOfNode = np.array([self.stationIndex[stationId] for _, stationId in self.nodes])
+        stationCount = len(self.stationIds)
+        self.stationTime = np.full((stationCount, stationCount), np.inf)
+        self.stationStops = np.zeros((stationCount, stationCount), dtype=np.int32)
+        self.stationInterchanges = np.zeros((stationCount, stationCount), dtype=np.int32)
+        self.stationNodes = np.full((stationCount, stationCount, 2), -1, dtype=np.int32)
+        for i in range(nodeCount):
+            for j in range(nodeCount):
+                si, sj = stationOfNode[i], stationOfNode[j]
+                if time[i, j] < self.stationTime[si, sj]:
+                    self.stationTime[si, sj] = time[i, j]
+                    self.stationStops[si, sj] = stops[i, j]
+                    self.stationInterchanges[si, sj] = interchanges[i, j]
+                    self.stationNodes[si, sj] = (i, j)
+        np.fill_diagonal(self.stationTime, 0)
+        np.fill_diagonal(self.stationStops, 0)
+        np.fill_diagonal(self.stationInterchanges, 0)
+        logger.debug(f"MTR router ready with {stationCount} stations")
+
+    def hasStation(self, stationId: int) -> bool:
+        return stationId in self.stationIndex
+
+    def travelMinutes(self, originStationId: int, destinationStationId: int) -> t.Optional[float]:
+        """
+        Get the estimated minutes between two stations.
+
+        :param originStationId: The id of the origin station.
+        :param destinationStationId: The id of the destination station.
+        :return: The estimated minutes or None if the stations are unknown or not connected.
+        """
+        if not self.hasStation(originStationId) or not self.hasStation(destinationStationId):
+            return None
+        minutes = self.stationTime[self.stationIndex[originStationId], self.stationIndex[destinationStationId]]
+        return float(minutes) if np.isfinite(minutes) else None
+
+    def route(self, originStationId: int, destinationStationId: int) -> t.Optional[Route]:
+        """
+        Get the fastest estimated route between two stations.
+
+        :param originStationId: The id of the origin station.
+        :param destinationStationId: The id of the destination station.
+        :return: The route or None if the stations are unknown or not connected.
+        """
+        minutes = self.travelMinutes(originStationId, destinationStationId)
+        if minutes is None:
+            return None
+        si, sj = self.stationIndex[originStationId], self.stationIndex[destinationStationId]
+        legs: list[RouteLeg] = []
+        if si != sj:
+            start, end = (int(n) for n in self.stationNodes[si, sj])
+            path = [start]
+            while path[-1] != end:
+                path.append(int(self.nextNode[path[-1], end]))
+            for a, b in zip(path, path[1:]):
+                lineA, stationA = self.nodes[a]
+                lineB, stationB = self.nodes[b]
+                if stationA == stationB:
+                    continue
+                if legs and legs[-1].lineCode == lineA and legs[-1].toStationId == stationA:
+                    legs[-1].toStationId = stationB
+                    legs[-1].stops += 1
+                else:
+                    legs.append(RouteLeg(lineCode=lineA, fromStationId=stationA, toStationId=stationB, stops=1))
+        return Route(
+            originStationId=originStationId,
+            destinationStationId=destinationStationId,
+            minutes=minutes,
+            stops=int(self.stationStops[si, sj]),
+            interchanges=int(self.stationInterchanges[si, sj]),
+            legs=legs,
+        )
@@ -0,0 +1,216 @@
+import sys
+import bisect
+import threading
+import typing as t
+from types import MappingProxyType
+
+from .routing import MTRRouter
+
+
+Station = t.Mapping[str, str]
+
+
+def normalizeStationName(name: str) -> str:
+    """
+    Normalize a station name for lookup, ignoring case, spaces and punctuation.
+
+    :param name: The English or Chinese station name.
+    :return: The normalized name.
+    """
+    return "".join(c for c in name.casefold() if c.isalnum())
+
+
+# ordered rules folding Hong Kong government romanization and Jyutping spellings together
+ROMANIZATION_FOLDS = [
+    ("tsz", "zi"), ("ts", "z"), ("ch", "z"), ("c", "z"), ("sh", "s"),
+    ("kw", "gw"), ("k", "g"), ("t", "d"), ("p", "b"), ("j", "y"),
+    ("aa", "a"), ("oo", "u"), ("ee", "i"), ("eoi", "ui"),
+]
+
+
+def foldRomanization(name: str) -> str:
+    """
+    Fold a normalized romanized name so spelling variants share a key.
+
+    e.g. `Tsim Sha Tsui` and the Jyutping `zim1 saa1 zeoi2` both fold to `zimsazui`.
+    Chinese characters are kept as is.
+
+    :param name: The normalized name.
+    :return: The folded name.
+    """
+    name = "".join(c for c in name if not c.isdigit())
+    for source, target in ROMANIZATION_FOLDS:
+        name = name.replace(source, target)
+    return name
+
+
+def nameGrams(name: str) -> set[str]:
+    """
+    Get the character n-grams of a normalized name, trigrams for latin and bigrams for Chinese names.
+
+    :param name: The normalized name.
+    :return: The set of n-grams.
+    """
+    size = 3 if name.isascii() else 2
+    padded = f" {name} "
+    return {padded[i:i + size] for i in range(max(1, len(padded) - size + 1))}
+
+
+class StationNameIndex:
+    """
+    Lexical index of English and Chinese station names.
+
+    A query is matched by, in order, the exact name, the romanization folded name,
+    a name prefix, and n-gram similarity. No network is used.
+    """
+
+    def __init__(self, stations: t.Iterable[Station], minSimilarity: float = 0.5) -> None:
+        """
+        Initialize a StationNameIndex instance.
+
+        :param stations: One row per station.
+        :param minSimilarity: The minimum n-gram dice similarity of a fuzzy match.
+        """
+        self.minSimilarity = minSimilarity
+        self.exact: dict[str, list[Station]] = {}
+        self.folded: dict[str, list[Station]] = {}
+        self.grams: dict[str, set[str]] = {}
+        self.gramIndex: dict[str, set[str]] = {}
+        self.gramCounts: dict[str, int] = {}
+        for station in stations:
+            for nameKey in ("English Name", "Chinese Name"):
+                name = normalizeStationName(station.get(nameKey, ""))
+                if not name:
+                    continue
+                self.exact.setdefault(name, []).append(station)
+                foldedName = foldRomanization(name)
+                self.folded.setdefault(foldedName, []).append(station)
+                grams = nameGrams(foldedName)
+                self.gramCounts[foldedName] = len(grams)
+                for gram in grams:
+                    self.gramIndex.setdefault(gram, set()).add(foldedName)
+        self.sortedFolded = sorted(self.folded)
+
+    def search(self, query: str, limit: int = 4) -> t.Tuple[t.List[Station], str]:
+        """
+        Find stations by name.
+
+        :param query: The English, Chinese or Jyutping station name.
+        :param limit: The maximum number of stations.
+        :return: The stations, best first, and how they matched: `exact`, `folded`, `prefix`, `similar`, or `none`.
+        """
+        name = normalizeStationName(query)
+        if not name:
+            return [], "none"
+        if name in self.exact:
+            return self._unique(self.exact[name], limit), "exact"
+        foldedName = foldRomanization(name)
+        if foldedName in self.folded:
+            return self._unique(self.folded[foldedName], limit), "folded"
+
+        if len(foldedName) >= (3 if foldedName.isascii() else 1):
+            start = bisect.bisect_left(self.sortedFolded, foldedName)
+            prefixed: list[Station] = []
+            for key in self.sortedFolded[start:]:
+                if not key.startswith(foldedName):
+                    break
+                prefixed += self.folded[key]
+            if prefixed:
+                # shorter names first, `kowloon` prefers Kowloon over Kowloon Tong
+                prefixed.sort(key=lambda s: len(normalizeStationName(s.get("English Name", ""))))
+                return self._unique(prefixed, limit), "prefix"
+
+        queryGrams = nameGrams(foldedName)
+        shared: dict[str, int] = {}
+        for gram in queryGrams:
+            for key in self.gramIndex.get(gram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        scored = sorted(
+            ((2 * count / (len(queryGrams) + self.gramCounts[key]), key) for key, count in shared.items()),
+            reverse=True,
+        )
+        similar = [station for score, key in scored if score >= self.minSimilarity for station in self.folded[key]]
+        if similar:
+            return self._unique(similar, limit), "similar"
+        return [], "none"
+
+    @staticmethod
+    def _unique(stations: t.List[Station], limit: int) -> t.List[Station]:
+        seen: set[str] = set()
+        unique: list[Station] = []
+        for station in stations:
+            stationId = station.get("Station ID", "")
+            if stationId in seen:
+                continue
+            seen.add(stationId)
+            unique.append(station)
+        return unique[:limit]
+
+
+class StationTable:
+    """
+    Read only table of MTR stations with lookups by id and code, and a name index.
+
+    Rows are the lines and stations data, one per station on each line and direction.
+    Lookups by id and code return the first row of the station.
+    """
+
+    __slots__ = ("rows", "byId", "byCode", "_router", "_nameIndex", "_lock")
+
+    def __init__(self, rows: t.Iterable[t.Mapping[str, str]]) -> None:
+        """
+        Initialize a StationTable instance.
+
+        :param rows: The rows of the MTR lines and stations data.
+        """
+        # the same line codes, names and headers repeat on every row
+        self.rows: t.Tuple[Station, ...] = tuple(
+            MappingProxyType({sys.intern(k): sys.intern(v) for k, v in row.items()}) for row in rows
+        )
+        byId: dict[int, Station] = {}
+        byCode: dict[str, Station] = {}
+        for row in self.rows:
+            try:
+                byId.setdefault(int(row.get("Station ID", "")), row)
+            except ValueError:
+                pass
+            if row.get("Station Code"):
+                byCode.setdefault(row["Station Code"].upper(), row)
+        self.byId: t.Mapping[int, Station] = MappingProxyType(byId)
+        self.byCode: t.Mapping[str, Station] = MappingProxyType(byCode)
+        self._router: t.Optional[MTRRouter] = None
+        self._nameIndex: t.Optional[StationNameIndex] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __bool__(self) -> bool:
+        return bool(self.rows)
+
+    def getById(self, stationId: int | str) -> t.Optional[Station]:
+        try:
+            return self.byId.get(int(stationId))
+        except ValueError:
+            return None
+
+    def getByCode(self, stationCode: str) -> t.Optional[Station]:
+        return self.byCode.get(stationCode.strip().upper())
+
+    @property
+    def nameIndex(self) -> StationNameIndex:
+        """The lexical name index of the stations, built on first use."""
+        if self._nameIndex is None:
+            with self._lock:
+                if self._nameIndex is None:
+                    self._nameIndex = StationNameIndex(self.byId.values())
+        return self._nameIndex
+
+    @property
+    def router(self) -> MTRRouter:
+        """The router of the stations, built on first use."""
+        if self._router is None:
+            with self._lock:
+                if self._router is None:
+                    self._router = MTRRouter(list(self.rows))
+        return self._router
@@ -2,18 +2,19 @@ import typing as t
 from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool
 
-from .caller import RestaurantSearchApi
+from .caller import RestaurantSearchApi, get_restaurant_search_api
 
 
 class OpenricaApiToolBase(BaseTool):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._openrice = RestaurantSearchApi(**kwargs)
+        self._openriceKwargs = kwargs
 
     @property
     def openrice(self) -> RestaurantSearchApi:
-        return self._openrice
+        # one RestaurantSearchApi with its filters and chroma handle is shared by all Openrice tools
+        return get_restaurant_search_api(**self._openriceKwargs)
 
 
 class GetOpenriceRestaurantRecommendationTool(OpenricaApiToolBase):
@@ -69,6 +70,7 @@ This tool should only be called once for every requirements, as the output will
 """
     args_schema: t.Type[BaseModel] = ToolArgs
 
+    # results are cached by the restaurant search cache, a tool result cache in front of it would hide its ttl and refresh
     def _run(self,
              landmarkIds: list[int] = [],
              districtIds: list[int] = [],
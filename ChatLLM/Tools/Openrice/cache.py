@@ -0,0 +1,132 @@
+import time
+import threading
+import typing as t
+from collections import OrderedDict
+
+from ..ExternalIo import logger
+
+
+class SearchResultCache():
+    """
+    In process cache of formatted restaurant search results with a time to live and a size bound.
+
+    Entries looked up again close to expiry are refreshed in the background,
+    so popular searches keep being answered from memory.
+    """
+
+    def __init__(self,
+                 ttl_seconds: float = 900,
+                 max_entries: int = 256,
+                 refresh_ahead: float = 0.2,
+                 refresh_min_hits: int = 2,
+                 ):
+        """
+        :param ttl_seconds: How long a result stays valid, 0 disables the cache.
+        :param max_entries: The maximum number of results kept, least recently used are dropped first.
+        :param refresh_ahead: The share of the ttl before expiry in which a hit refreshes the entry.
+        :param refresh_min_hits: The number of hits an entry needs to be refreshed.
+        """
+        self.ttl_seconds = max(0.0, ttl_seconds)
+        self.max_entries = max(0, max_entries)
+        self.refresh_ahead = refresh_ahead
+        self.refresh_min_hits = refresh_min_hits
+        # key: (results, expires, hits)
+        self._entries: OrderedDict[t.Hashable, tuple[list[dict], float, int]] = OrderedDict()
+        self._refreshing: set[t.Hashable] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get_or_fetch(self, key: t.Hashable, fetch: t.Callable[[], t.Optional[list[dict]]]) -> list[dict]:
+        """
+        Get the cached results of a search, fetching them on a miss.
+
+        :param key: The canonical key of the search.
+        :param fetch: Fetches the results, None if the fetch failed, which is not cached.
+        :return: A copy of the results.
+        """
+        if not self.enabled:
+            return fetch() or []
+        now = time.time()
+        refresh = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                results, expires, hits = entry
+                self._entries[key] = (results, expires, hits + 1)
+                self._entries.move_to_end(key)
+                self.hits += 1
+                refresh = (
+                    hits + 1 >= self.refresh_min_hits
+                    and expires - now < self.ttl_seconds * self.refresh_ahead
+                    and key not in self._refreshing
+                )
+                if refresh:
+                    self._refreshing.add(key)
+            else:
+                if entry is not None:
+                    del self._entries[key]
+                results = None
+                self.misses += 1
+
+        if results is not None:
+            if refresh:
+                threading.Thread(target=self._refresh, args=(key, fetch), daemon=True).start()
+            return [dict(r) for r in results]
+
+        results = fetch()
+        if results is None:
+            return []
+        self._store(key, results, hits=0)
+        return [dict(r) for r in results]
+
+    def _store(self, key: t.Hashable, results: list[dict], hits: int) -> None:
+        with self._lock:
+            self._entries[key] = (results, time.time() + self.ttl_seconds, hits)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, key: t.Hashable, fetch: t.Callable[[], t.Optional[list[dict]]]) -> None:
+        try:
+            results = fetch()
+            if results is not None:
+                # a refreshed entry has to be hit again to be refreshed again
+                self._store(key, results, hits=0)
+                with self._lock:
+                    self.refreshes += 1
+        except Exception as e:
+            logger.warning(f"Failed to refresh openrice search {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> dict[str, t.Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+search_result_cache = SearchResultCache()
+
+
+def set_search_result_cache(cache: SearchResultCache) -> None:
+    """Set the cache used by every RestaurantSearchApi"""
+    global search_result_cache
+    search_result_cache = cache
@@ -1,12 +1,17 @@
 import os
 import inspect
+import contextlib
+import threading
 import typing as t
+from types import MappingProxyType
 from google.oauth2.service_account import Credentials
 from langchain_google_vertexai import VertexAIEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 
 from ..ExternalIo import fetch, write_json_file, read_json_file
+from .lexical import BM25Index
+from . import cache
 
 
 def divide_chunks(data, chunk_size):
@@ -28,10 +33,116 @@ class OpenriceBase():
                 f'\033[43;30m[openrice][{inspect.stack()[1][3]}] ' + msg + '\x1b[0m')
 
 
+_vectorStores: dict[tuple[t.Any, ...], Chroma] = {}
+_metadataLoaders: dict[tuple[t.Any, ...], "OpenriceMetadataLoader"] = {}
+_restaurantSearchApis: dict[tuple[t.Any, ...], "RestaurantSearchApi"] = {}
+_registryLock = threading.RLock()
+
+
+def credentials_key(credentials: t.Optional[Credentials]) -> tuple[t.Any, ...]:
+    return (getattr(credentials, "project_id", None), getattr(credentials, "service_account_email", None))
+
+
+def get_vector_store(credentials: t.Optional[Credentials], chroma_db_path: t.Optional[str], collection_name: str) -> Chroma:
+    """Get the chroma handle of a collection, created once and shared by every filter"""
+    key = credentials_key(credentials) + (chroma_db_path, collection_name)
+    with _registryLock:
+        if key not in _vectorStores:
+            chroma_param: dict[str, t.Any] = {
+                "collection_name": collection_name,
+                "embedding_function": VertexAIEmbeddings(
+                    credentials=credentials,
+                    project=credentials.project_id if credentials is not None else None,
+                    model_name="text-multilingual-embedding-002",
+                ),
+            }
+            if chroma_db_path is not None:
+                chroma_param["persist_directory"] = chroma_db_path
+            _vectorStores[key] = Chroma(**chroma_param)
+        return _vectorStores[key]
+
+
+class OpenriceMetadataLoader(OpenriceBase):
+    """Load the Openrice region and country metadata once for the filters built together, and release it after"""
+
+    def __init__(self, data_base_path: str = "./data", store_data: bool = True, verbose: bool = True):
+        super().__init__(verbose)
+        self.data_base_path = data_base_path
+        self.store_data = store_data
+        self._raw_data: dict[str, t.Any] = {}
+        self._holders = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def loading(self) -> t.Iterator[None]:
+        """Keep the raw data in memory while the filters in the block are built, the raw data is dropped after the last block"""
+        with self._lock:
+            self._holders += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._holders -= 1
+                if not self._holders:
+                    self._raw_data.clear()
+
+    def raw_data(self, data_url: str, raw_data_path: str) -> t.Any:
+        if raw_data_path in self._raw_data:
+            return self._raw_data[raw_data_path]
+        with self._lock:
+            if raw_data_path in self._raw_data:
+                return self._raw_data[raw_data_path]
+
+            raw_data = None
+            if self.store_data and os.path.exists(raw_data_path):
+                self.logger(f"getting raw data from {raw_data_path}")
+                raw_data = read_json_file(raw_data_path)
+
+            if not raw_data:
+                self.logger(
+                    "raw data not in file or file store not enabled, fetching from api")
+                raw_data = fetch(data_url)
+                if not isinstance(raw_data, (dict, list)):
+                    self.logger(f"Error, Got {type(raw_data)=},{raw_data=}")
+                    raise TypeError("Expected raw_data to be a dictionary or list")
+                if self.store_data:
+                    self.logger("storage enabled, writing raw data to file")
+                    write_json_file(raw_data, raw_data_path)
+
+            # the raw data is several MB, it is only kept for the filters loading together
+            if self._holders:
+                self._raw_data[raw_data_path] = raw_data
+            return raw_data
+
+
+def get_metadata_loader(data_base_path: str, store_data: bool, verbose: bool) -> OpenriceMetadataLoader:
+    key = (os.path.abspath(data_base_path), store_data)
+    with _registryLock:
+        if key not in _metadataLoaders:
+            _metadataLoaders[key] = OpenriceMetadataLoader(data_base_path, store_data, verbose)
+        return _metadataLoaders[key]
+
+
+def to_filter_id(value: t.Any) -> int | None:
+    """Convert a filter id from the api search key or the llm input to int, None if it is not an id"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value.strip())
+    return None
+
+
+def filter_document(item: dict[str, t.Any]) -> str:
+    """Get the text of a filter item, as stored in chroma and returned by search"""
+    return ', '.join(f"\"{str(k)}\": \"{v}\"" for k, v in item.items())
+
+
 class FilterBase(OpenriceBase):
 
-    _raw_data: t.Optional[t.Any] = None
     _data: t.Optional[t.Any] = None
+    _index: t.Mapping[int, dict[str, t.Any]] = MappingProxyType({})
     _FILTER_RAW_DATA_URL: str = "https://www.openrice.com/api/v2/metadata/region/all?uiLang=en&uiCity=hongkong"
     _METADATA_RAW_DATA_URL: str = "https://www.openrice.com/api/v2/metadata/country/all"
 
@@ -53,23 +164,14 @@ class FilterBase(OpenriceBase):
         self.store_data = store_data
         self.initChroma = initChroma
 
-        # chroma setup
-        self.logger(f"initializing chroma db filter for {searchKey}")
-        # when only doing where doc search, no embedding func is needed
-        embeddings = VertexAIEmbeddings(
-            credentials=credentials,
-            project=credentials.project_id if credentials is not None else None,
-            model_name="text-multilingual-embedding-002",
+        # chroma setup, one handle is shared by all filters of the same collection
+        self.logger(f"getting chroma db for {searchKey}")
+        self.vector_store = get_vector_store(
+            credentials,
+            chroma_db_path if self.store_data else None,
+            chroma_db_collection_prefix,
         )
-        chroma_param: dict[str, t.Any] = {
-            "collection_name": chroma_db_collection_prefix,
-            "embedding_function": embeddings,
-        }
-        if self.store_data:
-            self.logger("chroma presist directory enabled")
-            chroma_param["persist_directory"] = chroma_db_path
-        self.logger("setting up chromadb")
-        self.vector_store = Chroma(**chroma_param)
+        self.loader = get_metadata_loader(data_base_path, store_data, verbose)
 
         # case for non specific filter, dont inti data
         if self.searchKey is None:
@@ -120,6 +222,7 @@ class FilterBase(OpenriceBase):
                 write_json_file(self._data, self.data_path)
 
         if isinstance(self._data, list) and all(isinstance(i, dict) for i in self._data):
+            self._index = self.build_index(self._data)
             self.init_chroma_data(self._data)
         else:
             raise TypeError("Expected self._data to be a list of dictionaries")
@@ -128,32 +231,17 @@ class FilterBase(OpenriceBase):
 
     @property
     def raw_data(self) -> t.Any:
-        self.logger("getting raw data from cache")
-        if self._raw_data:
-            self.logger("raw data exist in cache, returning")
-            return self._raw_data
-
-        self.logger("raw data not exist in cache")
-        if self.store_data and os.path.exists(self.raw_data_path):
-            self.logger("getting raw data from file")
-            self._raw_data = read_json_file(self.raw_data_path)
-            # self.logger(f"Got data from file: {self._raw_data}")
-            if self._raw_data:
-                self.logger("got raw data from file, returning")
-                return self._raw_data
-
-        self.logger(
-            "raw data not in file or file store not enabled, fetching from api")
-        raw_data = fetch(self.data_url)
-        if self.store_data:
-            self.logger("storage enabled, writing raw data to file")
-            if isinstance(raw_data, (dict, list)):
-                write_json_file(raw_data, self.raw_data_path)
-            else:
-                self.logger(f"Error, Got {type(raw_data)=},{raw_data=}")
-                raise TypeError("Expected raw_data to be a dictionary or list")
-        self.logger("got raw data from API, returning")
-        return raw_data
+        return self.loader.raw_data(self.data_url, self.raw_data_path)
+
+    def build_index(self, data: list[dict[str, t.Any]]) -> t.Mapping[int, dict[str, t.Any]]:
+        """Index the filter items by their int id, the first item wins on duplicated ids"""
+        index: dict[int, dict[str, t.Any]] = {}
+        for item in data:
+            filter_id = to_filter_id(item.get(self.searchKey))  # type: ignore
+            if filter_id is not None:
+                index.setdefault(filter_id, item)
+        self.logger(f"indexed {len(index)} {self.searchKey} items")
+        return MappingProxyType(index)
 
     def init_chroma_data(self, data_expected: list[dict[str, t.Any]]):
         if not self.initChroma:
@@ -179,10 +267,7 @@ class FilterBase(OpenriceBase):
 
             self.logger("adding documents to chroma db")
             self.vector_store.add_documents(list(map(lambda item: Document(
-                ', '.join(list(map(
-                    lambda l: f"\"{str(l)}\": \"{item[l]}\"",
-                    dict(item).keys(),
-                ))),
+                filter_document(item),
                 metadata={
                     "openrice_searchKey": self.searchKey,
                     "source": self.data_url,
@@ -214,18 +299,28 @@ class FilterBase(OpenriceBase):
             self.vector_store.similarity_search(**search_param)
         ))
 
-    def by_id(self, id: int) -> dict | None:
+    def by_id(self, id: int | str) -> dict | None:
         if not self.searchKey:
             raise NotImplementedError(
                 "This methoad cannot be called on instence without searchKey")
-        resault = list(filter(
-            # is is compairing string because my dumb fuck decided to get the id from search key string so everything is compatable.
-            lambda flt: flt[self.searchKey] == f"{id}",
-            self._data if isinstance(self._data, list) else []
-        ))
-        if resault != []:
-            return resault[0]
-        return None
+        filter_id = to_filter_id(id)
+        if filter_id is None:
+            return None
+        return self._index.get(filter_id)
+
+    def validate_ids(self, ids: t.Iterable[int | str] | int | str) -> list[int]:
+        """Get the ids known to the filter, in order and without duplicates"""
+        if not self.searchKey:
+            raise NotImplementedError(
+                "This methoad cannot be called on instence without searchKey")
+        if isinstance(ids, (int, str)):
+            ids = [ids]
+        valid: dict[int, None] = {}
+        for id in ids:
+            filter_id = to_filter_id(id)
+            if filter_id is not None and filter_id in self._index:
+                valid[filter_id] = None
+        return list(valid)
 
     def get_api_filter_search_key(self, id: int) -> str:
         self.logger(f"getting {id=} on {self.searchKey}")
@@ -235,6 +330,11 @@ class FilterBase(OpenriceBase):
         self.logger(f"{id=} not found on {self.searchKey}")
         return ""
 
+    def get_api_filter_search_keys(self, ids: t.Iterable[int | str] | int | str) -> list[str]:
+        valid = self.validate_ids(ids)
+        self.logger(f"found {valid=} on {self.searchKey}")
+        return [f"{self.searchKey}={id}" for id in valid]
+
 
 class LandmarkFilter(FilterBase):
 
@@ -294,16 +394,53 @@ class PriceRangeFilter(FilterBase):
 
 
 class Filters(FilterBase):
+
+    min_lexical_coverage: float = 0.5
+
     def __init__(self, **kwargs):
         kwargs["searchKey"] = None
         super().__init__(**kwargs)
-        self.landmark = LandmarkFilter(**kwargs)
-        self.district = DistrictFilter(**kwargs)
-        self.cuisine = CuisineFilter(**kwargs)
-        self.dish = DishFilter(**kwargs)
-        self.theme = ThemeFilter(**kwargs)
-        self.amenity = AmenityFilter(**kwargs)
-        self.priceRange = PriceRangeFilter(**kwargs)
+        # all filters are parsed from the same raw data, read once and released when they are built
+        with self.loader.loading():
+            self.landmark = LandmarkFilter(**kwargs)
+            self.district = DistrictFilter(**kwargs)
+            self.cuisine = CuisineFilter(**kwargs)
+            self.dish = DishFilter(**kwargs)
+            self.theme = ThemeFilter(**kwargs)
+            self.amenity = AmenityFilter(**kwargs)
+            self.priceRange = PriceRangeFilter(**kwargs)
+
+        # lexical index of the names of every filter item, searched before chroma
+        items = [
+            item
+            for flt in (self.landmark, self.district, self.cuisine, self.dish, self.theme, self.amenity, self.priceRange)
+            for item in flt.all
+        ]
+        self.documents = [filter_document(item) for item in items]
+        self.lexical_index = BM25Index([
+            " ".join(str(item.get(f"name{l.upper()}", "")) for l in self.lang_dict_options)
+            for item in items
+        ])
+
+    def search(self, keyword: str, k: int = 5) -> list[str]:
+        """
+        Find filter items by keyword.
+
+        Items are matched by BM25 over their English and Chinese names.
+        Only when no item covers at least `min_lexical_coverage` of the keyword,
+        the lexical and chroma results are fused by reciprocal rank.
+        """
+        hits = self.lexical_index.search(keyword, k)
+        if hits and hits[0][2] >= self.min_lexical_coverage:
+            self.logger(f"lexical match for {keyword=}")
+            return [self.documents[i] for i, _, _ in hits]
+
+        self.logger(f"low lexical confidence for {keyword=}, searching chroma")
+        fused: dict[str, float] = {}
+        for results in ([self.documents[i] for i, _, _ in hits], super().search(keyword)):
+            for rank, document in enumerate(results):
+                fused[document] = fused.get(document, 0.0) + 1 / (60 + rank)
+        return sorted(fused, key=lambda d: -fused[d])[:k]
 
 
 class RestaurantSearchApi(OpenriceBase):
@@ -422,78 +559,38 @@ class RestaurantSearchApi(OpenriceBase):
                count: int = 3
                ) -> list[dict]:
 
-        filterSearchKeys = []
-        # landmark
-        if type(landmarkIds) == int:
-            landmarkIds = [landmarkIds]
-        for id in landmarkIds:
-            self.logger(f"finding {landmarkIds=} to search")
-            searchKey = self.filters.landmark.get_api_filter_search_key(id)
-            if searchKey:
-                self.logger(f"adding {searchKey=} to search key")
-                filterSearchKeys.append(searchKey)
-        # district]
-        if type(districtIds) == int:
-            districtIds = [districtIds]
-        for id in districtIds:
-            self.logger(f"finding {districtIds=} to search")
-            searchKey = self.filters.district.get_api_filter_search_key(id)
-            if searchKey:
-                filterSearchKeys.append(searchKey)
-        # cuisine
-        if type(cuisineIds) == int:
-            cuisineIds = [cuisineIds]
-        for id in cuisineIds:
-            self.logger(f"finding {cuisineIds=} to search")
-            searchKey = self.filters.cuisine.get_api_filter_search_key(id)
-            if searchKey:
-                self.logger(f"adding {searchKey=} to search key")
-                filterSearchKeys.append(searchKey)
-        # dish
-        if type(dishIds) == int:
-            dishIds = [dishIds]
-        for id in dishIds:
-            self.logger(f"finding {dishIds=} to search")
-            searchKey = self.filters.dish.get_api_filter_search_key(id)
-            if searchKey:
-                self.logger(f"adding {searchKey=} to search key")
-                filterSearchKeys.append(searchKey)
-        # theme
-        if type(themeIds) == int:
-            themeIds = [themeIds]
-        for id in themeIds:
-            self.logger(f"finding {themeIds=} to search")
-            searchKey = self.filters.theme.get_api_filter_search_key(id)
-            if searchKey:
-                self.logger(f"adding {searchKey=} to search key")
-                filterSearchKeys.append(searchKey)
-        # amenity
-        if type(amenityIds) == int:
-            amenityIds = [amenityIds]
-        for id in amenityIds:
-            self.logger(f"finding {amenityIds=} to search")
-            searchKey = self.filters.amenity.get_api_filter_search_key(id)
-            if searchKey:
-                self.logger(f"adding {searchKey=} to search key")
-                filterSearchKeys.append(searchKey)
-        # price range
-        if type(priceRangeIds) == int:
-            priceRangeIds = [priceRangeIds]
-        for id in priceRangeIds:
-            self.logger(f"finding {priceRangeIds=} to search")
-            searchKey = self.filters.priceRange.get_api_filter_search_key(id)
-            if searchKey:
-                self.logger(f"adding {searchKey=} to search key")
-                filterSearchKeys.append(searchKey)
+        filterSearchKeys: list[str] = []
+        for flt, ids in (
+            (self.filters.landmark, landmarkIds),
+            (self.filters.district, districtIds),
+            (self.filters.cuisine, cuisineIds),
+            (self.filters.dish, dishIds),
+            (self.filters.theme, themeIds),
+            (self.filters.amenity, amenityIds),
+            (self.filters.priceRange, priceRangeIds),
+        ):
+            if ids == []:
+                continue
+            self.logger(f"finding {ids=} on {flt.searchKey} to search")
+            # sorted so the same set of filters in any order share a cache entry
+            filterSearchKeys += sorted(flt.get_api_filter_search_keys(ids))
+        keywords = " ".join(keywords.split()).lower() if isinstance(keywords, str) else ""
+        self.logger(f"using {filterSearchKeys=} {keywords=} to search")
 
         searchParams = "&".join(filterSearchKeys)
         searchUrl = self._SEARCH_BASE_API_URL + "&" + searchParams + \
             f"&startAt=0&&rows={count}&keyword={keywords}&uiLang=en"
+        return cache.search_result_cache.get_or_fetch(
+            (tuple(filterSearchKeys), keywords, count),
+            lambda: self.fetch_search(searchUrl),
+        )
 
+    def fetch_search(self, searchUrl: str) -> list[dict] | None:
+        """Fetch and format the results of a search url, None if the api failed"""
         resault = fetch(searchUrl)
         if isinstance(resault, dict) and resault.get('success') == False:
             self.logger(f'Error: from API\n{resault}')
-            return []
+            return None
 
         if isinstance(resault, dict) and "paginationResult" in resault and "results" in resault["paginationResult"]:
             return list(map(
@@ -502,7 +599,16 @@ class RestaurantSearchApi(OpenriceBase):
             ))
         else:
             self.logger(f'Unexpected API response format: {resault}')
-            return []
+            return None
+
+
+def get_restaurant_search_api(credentials: Credentials, **kwargs) -> RestaurantSearchApi:
+    """Get the RestaurantSearchApi of the given settings, created on first use and shared by every tool"""
+    key = credentials_key(credentials) + tuple(sorted((k, repr(v)) for k, v in kwargs.items()))
+    with _registryLock:
+        if key not in _restaurantSearchApis:
+            _restaurantSearchApis[key] = RestaurantSearchApi(credentials=credentials, **kwargs)
+        return _restaurantSearchApis[key]
 
 
 if __name__ == "__main__":
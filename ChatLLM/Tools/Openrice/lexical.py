@@ -0,0 +1,73 @@
+import re
+import math
+import typing as t
+from collections import Counter
+
+
+# latin words and digits, or single CJK characters
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[㐀-鿿豈-﫿]")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lower cased latin words and Chinese character unigrams and bigrams"""
+    tokens: list[str] = []
+    previous_cjk, previous_end = "", -1
+    for match in TOKEN_PATTERN.finditer(text.casefold()):
+        token = match.group()
+        if token.isascii():
+            tokens.append(token)
+            previous_cjk = ""
+            continue
+        tokens.append(token)
+        if previous_cjk and match.start() == previous_end:
+            tokens.append(previous_cjk + token)
+        previous_cjk, previous_end = token, match.end()
+    return tokens
+
+
+class BM25Index():
+    """Okapi BM25 index of short documents, kept in memory"""
+
+    def __init__(self, documents: t.Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_frequencies: list[Counter[str]] = [Counter(tokenize(doc)) for doc in documents]
+        self.lengths = [sum(tf.values()) for tf in self.term_frequencies]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.postings: dict[str, list[int]] = {}
+        for i, tf in enumerate(self.term_frequencies):
+            for term in tf:
+                self.postings.setdefault(term, []).append(i)
+        count = len(self.term_frequencies)
+        self.idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.term_frequencies)
+
+    def search(self, query: str, k: int = 5) -> list[tuple[int, float, float]]:
+        """
+        Get the best matching documents of a query.
+
+        :param query: The query text.
+        :param k: The maximum number of documents.
+        :return: The document index, BM25 score and the share of query terms found in the document, best first.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        scores: dict[int, float] = {}
+        matched: dict[int, int] = {}
+        for term in terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i in self.postings[term]:
+                tf = self.term_frequencies[i][term]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.average_length)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[i] = matched.get(i, 0) + 1
+        best = sorted(scores, key=lambda i: (-scores[i], self.lengths[i]))[:k]
+        return [(i, scores[i], matched[i] / len(terms)) for i in best]
@@ -3,6 +3,7 @@ from pydantic import BaseModel
 from langchain_core.tools import BaseTool
 
 from .ExternalIo import fetch, logger
+from .Cache import cachedRun
 
 class WeatherToolBase(BaseTool):
 
@@ -23,6 +24,8 @@ class GetWeatherForcastTool(WeatherToolBase):
     description: str = "Used to get the current weather in Hong Kong."
     args_schema: t.Type[BaseModel] = ToolArgs
 
+    # the forecast is updated a few times a day
+    @cachedRun(ttlSeconds=1800)
     def _run(self, **kwargs) -> str:
         logger.debug("Getting current weather tempecture")
         return "JSON data fetched from hong kong observatory API" + str(fetch(f"https://data.weather.gov.hk/weatherAPI/opendata/weather.php?dataType=fnd&lang=en"))
@@ -40,6 +43,8 @@ class GetCurrentWeatherTempetureTool(WeatherToolBase):
     description: str = "Used to get the current weather from loacation."
     args_schema: t.Type[BaseModel] = ToolArgs
 
+    # the current weather report is updated every 10 minutes
+    @cachedRun(ttlSeconds=300)
     def _run(self, **kwargs) -> str:
         tempectureUrlMapping = {
             "en": "https://rss.weather.gov.hk/rss/CurrentWeather.xml",
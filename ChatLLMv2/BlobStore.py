@@ -0,0 +1,310 @@
+import os
+import abc
+import mmap
+import hashlib
+import logging
+import tempfile
+import contextlib
+import typing as t
+
+
+logger = logging.getLogger(__name__)
+
+
+def setLogger(external_logger: logging.Logger) -> None:
+    """
+    Set the logger for the module.
+
+    :param external_logger: The external logger to use.
+    """
+    global logger
+    logger = external_logger
+
+
+class BlobStore(abc.ABC):
+    """
+    Base class of content addressed binary blob storage.
+
+    Blobs are stored as raw bytes under the sha256 hex digest of their content,
+    so storing the same content twice keeps a single copy.
+    """
+
+    def __init__(self, shardLevels: int = 2, shardWidth: int = 2) -> None:
+        """
+        Initialize a BlobStore instance.
+
+        :param shardLevels: The number of directory levels blobs are sharded into.
+        :param shardWidth: The number of key characters used by each directory level.
+        """
+        self.shardLevels = shardLevels
+        self.shardWidth = shardWidth
+
+    @staticmethod
+    def keyOf(data: bytes) -> str:
+        """
+        Get the key of blob data.
+
+        :param data: The blob data.
+        :return: The sha256 hex digest of the data.
+        """
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def isKey(key: str) -> bool:
+        """
+        Check if a string is a blob key.
+
+        :param key: The string to check.
+        :return: True if the string is a sha256 hex digest.
+        """
+        return len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+    def shardedPath(self, key: str) -> str:
+        """
+        Get the hash prefix sharded relative path of a blob.
+
+        :param key: The blob key.
+        :return: The relative path, e.g. `ab/cd/abcd...`.
+        """
+        if not self.isKey(key):
+            raise ValueError(f"Invalid blob key {key=}")
+        shards = [key[i * self.shardWidth:(i + 1) * self.shardWidth] for i in range(self.shardLevels)]
+        return "/".join(shards + [key])
+
+    @abc.abstractmethod
+    def put(self, data: bytes) -> str:
+        """
+        Store blob data.
+
+        :param data: The blob data.
+        :return: The key of the blob.
+        """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> t.Optional[bytes]:
+        """
+        Get blob data.
+
+        :param key: The blob key.
+        :return: The blob data or None if it does not exist.
+        """
+
+    @abc.abstractmethod
+    def iterChunks(self, key: str, chunkSize: int = 64 * 1024) -> t.Iterator[bytes]:
+        """
+        Stream blob data in chunks.
+
+        :param key: The blob key.
+        :param chunkSize: The maximum size of each chunk.
+        :return: An iterator of chunks, empty if the blob does not exist.
+        """
+
+    @contextlib.contextmanager
+    def view(self, key: str) -> t.Iterator[t.Optional[t.Union[bytes, mmap.mmap]]]:
+        """
+        Get a read only bytes like view of blob data, valid within the context.
+
+        :param key: The blob key.
+        :return: A context yielding the view or None if the blob does not exist.
+        """
+        yield self.get(key)
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        """
+        Check if a blob exists.
+
+        :param key: The blob key.
+        :return: True if the blob exists.
+        """
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Delete a blob, nothing is done if it does not exist.
+
+        :param key: The blob key.
+        """
+
+
+class LocalBlobStore(BlobStore):
+    """Blob store on the local file system."""
+
+    def __init__(self,
+                 basePath: str,
+                 shardLevels: int = 2,
+                 shardWidth: int = 2,
+                 mmapThreshold: int = 256 * 1024,
+                 ) -> None:
+        """
+        Initialize a LocalBlobStore instance.
+
+        :param basePath: The directory blobs are stored in.
+        :param shardLevels: The number of directory levels blobs are sharded into.
+        :param shardWidth: The number of key characters used by each directory level.
+        :param mmapThreshold: Blobs of at least this size are memory mapped by `view`.
+        """
+        super().__init__(shardLevels, shardWidth)
+        self.basePath = basePath
+        self.mmapThreshold = mmapThreshold
+
+    def path(self, key: str) -> str:
+        """
+        Get the file path of a blob.
+
+        :param key: The blob key.
+        :return: The file path.
+        """
+        return os.path.join(self.basePath, *self.shardedPath(key).split("/"))
+
+    def put(self, data: bytes) -> str:
+        key = self.keyOf(data)
+        path = self.path(key)
+        if os.path.exists(path):
+            logger.debug(f"Blob {key=} exists, skipping write")
+            return key
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        logger.debug(f"Writing blob {key=} of {len(data)} bytes to {path}")
+        # write to a temporary file first so readers never see a partial blob
+        fd, tempPath = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tempPath, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tempPath)
+            raise
+        return key
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def iterChunks(self, key: str, chunkSize: int = 64 * 1024) -> t.Iterator[bytes]:
+        try:
+            f = open(self.path(key), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            while chunk := f.read(chunkSize):
+                yield chunk
+
+    @contextlib.contextmanager
+    def view(self, key: str) -> t.Iterator[t.Optional[t.Union[bytes, mmap.mmap]]]:
+        try:
+            f = open(self.path(key), "rb")
+        except FileNotFoundError:
+            yield None
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.mmapThreshold:
+                yield f.read()
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def delete(self, key: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path(key))
+
+
+class S3BlobStore(BlobStore):
+    """
+    Blob store on an S3 compatible object storage.
+
+    Set `endpointUrl` to use a local S3 compatible server such as MinIO instead of AWS.
+    Requires boto3 to be installed.
+    """
+
+    def __init__(self,
+                 bucket: str,
+                 prefix: str = "",
+                 endpointUrl: t.Optional[str] = None,
+                 region: t.Optional[str] = None,
+                 shardLevels: int = 2,
+                 shardWidth: int = 2,
+                 client: t.Any = None,
+                 ) -> None:
+        """
+        Initialize a S3BlobStore instance.
+
+        :param bucket: The bucket blobs are stored in.
+        :param prefix: The key prefix of blobs in the bucket.
+        :param endpointUrl: The url of the S3 compatible server, AWS is used if not set.
+        :param region: The region of the bucket.
+        :param shardLevels: The number of key prefix levels blobs are sharded into.
+        :param shardWidth: The number of key characters used by each prefix level.
+        :param client: A boto3 s3 client to use instead of creating one.
+        """
+        super().__init__(shardLevels, shardWidth)
+        if client is None:
+            try:
+                import boto3
+            except ImportError as e:
+                raise ImportError("boto3 is required for S3BlobStore, install it with `pip install boto3`") from e
+            client = boto3.client("s3", endpoint_url=endpointUrl, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def objectKey(self, key: str) -> str:
+        """
+        Get the object key of a blob.
+
+        :param key: The blob key.
+        :return: The object key in the bucket.
+        """
+        path = self.shardedPath(key)
+        return f"{self.prefix}/{path}" if self.prefix else path
+
+    def _getObject(self, key: str) -> t.Optional[dict[str, t.Any]]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.objectKey(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def put(self, data: bytes) -> str:
+        key = self.keyOf(data)
+        if self.exists(key):
+            logger.debug(f"Blob {key=} exists, skipping upload")
+            return key
+        logger.debug(f"Uploading blob {key=} of {len(data)} bytes to {self.bucket}")
+        self.client.put_object(Bucket=self.bucket, Key=self.objectKey(key), Body=data)
+        return key
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        response = self._getObject(key)
+        if response is None:
+            return None
+        return response["Body"].read()
+
+    def iterChunks(self, key: str, chunkSize: int = 64 * 1024) -> t.Iterator[bytes]:
+        response = self._getObject(key)
+        if response is None:
+            return
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(chunkSize)
+        finally:
+            body.close()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.objectKey(key))
+            return True
+        except self.client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.objectKey(key))
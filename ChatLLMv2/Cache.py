@@ -0,0 +1,131 @@
+import logging
+import threading
+import typing as t
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+def setLogger(external_logger: logging.Logger) -> None:
+    """
+    Set the logger for the module.
+
+    :param external_logger: The external logger to use.
+    """
+    global logger
+    logger = external_logger
+
+
+K = t.TypeVar("K", bound=t.Hashable)
+V = t.TypeVar("V")
+
+
+class ByteBudgetLRUCache(t.Generic[K, V]):
+    """
+    A thread safe least recently used cache bounded by the total size of its values.
+
+    Values are stored and returned as is, a hit does not copy the value.
+    """
+
+    def __init__(self,
+                 maxBytes: int,
+                 sizeOf: t.Callable[[V], int] = len,  # type: ignore
+                 ) -> None:
+        """
+        Initialize a ByteBudgetLRUCache instance.
+
+        :param maxBytes: The maximum total size of the cached values, 0 disables the cache.
+        :param sizeOf: Get the size in bytes of a value.
+        """
+        self.maxBytes = max(0, maxBytes)
+        self.sizeOf = sizeOf
+        self.currentBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[K, tuple[V, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> t.Optional[V]:
+        """
+        Get a value and mark it as recently used.
+
+        :param key: The key of the value.
+        :return: The value or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: K, value: V) -> None:
+        """
+        Cache a value, evicting the least recently used values to stay within the budget.
+
+        Values larger than the whole budget are not cached.
+
+        :param key: The key of the value.
+        :param value: The value.
+        """
+        size = self.sizeOf(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.currentBytes -= previous[1]
+            if size > self.maxBytes:
+                logger.debug(f"Not caching {key=}, {size=} exceed {self.maxBytes=}")
+                return
+            while self._entries and self.currentBytes + size > self.maxBytes:
+                _, (_, evictedSize) = self._entries.popitem(last=False)
+                self.currentBytes -= evictedSize
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self.currentBytes += size
+
+    def pop(self, key: K) -> t.Optional[V]:
+        """
+        Remove a value from the cache.
+
+        :param key: The key of the value.
+        :return: The removed value or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self.currentBytes -= entry[1]
+            return entry[0]
+
+    def clear(self) -> None:
+        """Remove all values from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.currentBytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Get the usage counters of the cache.
+
+        :return: A dictionary of the counters.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.currentBytes,
+                "maxBytes": self.maxBytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -9,6 +9,7 @@ from .DataHandler import ChatMessage
 
 from .ChatModel.Base import BaseModel
 from .ChatModel.Property import InvokeContextValues
+from .ChatModel.Property import ChatStreamEvent
 
 
 logger = logging.getLogger(__name__)
@@ -135,3 +136,66 @@ class ChatController:
 
         logger.debug(f"Returning Response {aiMessage.text[:10]=}")
         return ChatMessage('ai', aiMessage.text)
+
+    def streamLLM(self,
+                  message: ChatMessage,
+                  contextValues: InvokeContextValues
+                  ) -> t.Iterator[ChatStreamEvent]:
+        """
+        Invoke the language model with a user message and yield the AI response as it is generated.
+
+        The AI response is saved to the chat before the final `message` event is yielded.
+
+        :param message: The new user message.
+        :param contextValues: Additional context values for the invocation.
+        :return: An iterator of stream events, ending with a `message` event.
+        """
+        logger.info(f"Streaming LLM: Message: {message.text[:10]=}, Invoking _initialize_chat()")
+        self._initialize_chat()
+
+        if not message.text.strip():
+            logger.debug(f"Message: {message.text[:10]=} is Empty {message.text.strip()=}")
+            yield ChatStreamEvent(event="message", content="Please provide a message.")
+            return
+
+        logger.debug(f"Adding Message: {message.text[:10]=} to current referenced chat")
+        self._chat.add_message(message)
+
+        logger.debug(f"Streaming LlmModel with current chat:{self._chat.id=}")
+        for event in self.llmModel.stream(self._chat, contextValues):
+            if event.event != "message":
+                yield event
+                continue
+
+            logger.debug(f"Got LlmModel Response:{event.content[:10]=}")
+            self._chat.add_message(ChatMessage('ai', event.content))
+
+            logger.debug(f"Saving changes of {self._chat.id=} to DB")
+            self.dbSession.commit()
+            yield event
+
+    def recallMessages(self,
+                       limit: t.Optional[int] = None,
+                       beforeId: t.Optional[int] = None,
+                       roles: t.Optional[t.Sequence[str]] = None,
+                       ) -> t.List[ChatMessage]:
+        """
+        Get a page of messages of the current chat.
+
+        :param limit: The maximum number of messages, all messages if None.
+        :param beforeId: Only get messages older than the message with this id.
+        :param roles: Only get messages of these roles, all roles if None.
+        :return: The latest matching messages, oldest first.
+        """
+        self._initialize_chat()
+        return self._chat.queryMessages(self.dbSession, limit, beforeId, roles)
+
+    def lastMessageId(self, roles: t.Optional[t.Sequence[str]] = None) -> t.Optional[int]:
+        """
+        Get the id of the latest message of the current chat.
+
+        :param roles: Only consider messages of these roles, all roles if None.
+        :return: The id of the latest message or None if there is none.
+        """
+        self._initialize_chat()
+        return self._chat.lastMessageId(self.dbSession, roles)
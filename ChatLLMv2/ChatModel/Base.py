@@ -1,10 +1,13 @@
 import logging
 import typing as t
 
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
 from ..DataHandler import ChatRecord
 from ..DataHandler import ChatMessage
+from ..ContextBuilder import ContextBuilder
 
-from .Property import AdditionalModelProperty, InvokeContextValues
+from .Property import AdditionalModelProperty, InvokeContextValues, ChatStreamEvent
 
 logger = logging.getLogger(__name__)
 
@@ -22,15 +25,32 @@ def setLogger(external_logger: logging.Logger) -> None:
 class BaseModel:
     """Base model class for language model interactions."""
 
+    # The estimated number of context tokens this model accepts
+    contextTokenBudget: t.Optional[int] = None
+
     def __init__(self,
                  additionalLLMProperty: t.Optional[AdditionalModelProperty] = None,
+                 contextBuilder: t.Optional[ContextBuilder] = None,
                  ) -> None:
         """
         Initialize a BaseModel instance.
 
         :param additionalLLMProperty: Additional properties for the model, if any.
+        :param contextBuilder: Used to assemble the chat messages sent to the model, all messages are sent without it.
         """
         self.additionalLLMProperty = AdditionalModelProperty() if additionalLLMProperty is None else additionalLLMProperty
+        self.contextBuilder = contextBuilder
+
+    def contextMessages(self, chatRecord: ChatRecord) -> list[t.Union[AIMessage, SystemMessage, HumanMessage]]:
+        """
+        Get the chat messages to send to the model.
+
+        :param chatRecord: The chat record to process.
+        :return: A list of LangChain message objects.
+        """
+        if self.contextBuilder is None:
+            return chatRecord.asLcMessages
+        return self.contextBuilder.build(chatRecord, self.contextTokenBudget)
 
     def invoke(self, chatRecord: ChatRecord, contextValues: InvokeContextValues) -> ChatMessage:
         """
@@ -41,3 +61,17 @@ class BaseModel:
         """
         logger.info(f"Invoking Base Mock Model with chatRecord: {chatRecord.chatId} and contextValues: {contextValues}")
         return ChatMessage("ai", f"MockMessage Respond: {chatRecord.messages[-1].text}")
+
+    def stream(self, chatRecord: ChatRecord, contextValues: InvokeContextValues) -> t.Iterator[ChatStreamEvent]:
+        """
+        Invoke the model with a chat record and yield events as the response is generated.
+
+        Models without native streaming yield the complete response as a single token.
+
+        :param chatRecord: The chat record to process.
+        :param contextValues: Additional context values for the invocation.
+        :return: An iterator of stream events, ending with a `message` event.
+        """
+        message = self.invoke(chatRecord, contextValues)
+        yield ChatStreamEvent(event="token", content=message.text)
+        yield ChatStreamEvent(event="message", content=message.text)
@@ -1,3 +1,4 @@
+import json
 import logging
 
 import typing as t
@@ -9,15 +10,16 @@ from langgraph.graph.message import add_messages
 
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, SystemMessage
 from langchain_core.prompts.chat import MessagesPlaceholder
 
 from google.oauth2.service_account import Credentials
 from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory
 
 from .Base import BaseModel
-from .Property import AdditionalModelProperty, InvokeContextValues
+from .Property import AdditionalModelProperty, InvokeContextValues, ChatStreamEvent
 from ..DataHandler import ChatRecord, ChatMessage
+from ..ContextBuilder import ContextBuilder
 
 logger = logging.getLogger(__name__)
 
@@ -46,10 +48,16 @@ class Model:
 
     class State(te.TypedDict):
         messages: t.Annotated[list[t.Union[AIMessage, SystemMessage, HumanMessage]], add_messages]
+        location: str
+        utctime: str
 
     def chatbot(self):
         def executer(state: 'Model.State'):
-            return {"messages": [self.llmWithTool.invoke(state["messages"])]}  # type: ignore
+            return {"messages": [self.llmWithTool.invoke({  # type: ignore
+                "messages": state["messages"],
+                "location": state["location"],
+                "utctime": state["utctime"],
+            })]}
         return executer
 
     def checkToolUse(self):
@@ -60,23 +68,23 @@ class Model:
     def __init__(self,
                  llm: BaseChatModel,
                  additionalLLMProperty: AdditionalModelProperty,
-                 contextValues: InvokeContextValues,
                  ) -> None:
         """
         Initialize a Model instance.
 
+        The graph is compiled here once, per invocation values are passed in as graph state.
+
         :param llm: The language model to use for generating responses.
         :param additionalLLMProperty: Additional properties for the model.
-        :param contextValues: Additional context values for the invocation.
         :return: None
         """
         promptTemplate = ChatPromptTemplate([
             ("system", self.prompt),
             ("system", (
-                f"<context>"
-                f"  <location>{contextValues.location}</location>"
-                f"  <utctime>{contextValues.utctime}</utctime>"
-                f"</context>"
+                "<context>"
+                "  <location>{location}</location>"
+                "  <utctime>{utctime}</utctime>"
+                "</context>"
             )),
             MessagesPlaceholder("messages")
         ])
@@ -91,33 +99,85 @@ class Model:
         self.graphBuilder.add_edge(START, "chatbot")
         self.graph = self.graphBuilder.compile()  # type: ignore
 
-    def invoke(self, chatRecord: ChatRecord) -> ChatMessage:
+    @staticmethod
+    def contentText(content: t.Any) -> str:
         """
-        Invoke the model with a chat record and get the response message.
+        Extract the text from a langchain message content.
 
-        :param chatRecord: The chat record to process.
-        :return: The response message from the model.
+        :param content: The message content, either a string or a list of content blocks.
+        :return: The text of the content.
+        """
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return "".join(block if isinstance(block, str) else str(block.get("text", "")) for block in content)  # type: ignore
+        return ""
+
+    def stream(self,
+               messages: list[t.Union[AIMessage, SystemMessage, HumanMessage]],
+               contextValues: InvokeContextValues,
+               ) -> t.Iterator[ChatStreamEvent]:
+        """
+        Invoke the model with chat messages and yield events as the graph runs.
+
+        :param messages: The chat messages to process.
+        :param contextValues: Additional context values for the invocation.
+        :return: An iterator of stream events, ending with a `message` event.
         """
         response = ""
-        for chunk in self.graph.stream({
-            "messages": chatRecord.asLcMessages
-        }, stream_mode="updates"):
-            try:
-                response += chunk['chatbot']['messages'][-1].content
-            except:
+        for mode, chunk in self.graph.stream({
+            "messages": messages,
+            "location": contextValues.location,
+            "utctime": contextValues.utctime,
+        }, stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                messageChunk, metadata = chunk  # type: ignore
+                if metadata.get("langgraph_node") != "chatbot" or not isinstance(messageChunk, AIMessageChunk):
+                    continue
+                text = self.contentText(messageChunk.content)
+                if text:
+                    yield ChatStreamEvent(event="token", content=text)
                 continue
             logger.debug(f"[GRAPH DEBUG] => {chunk}")
+            if "chatbot" in chunk:
+                message = chunk["chatbot"]["messages"][-1]  # type: ignore
+                for toolCall in getattr(message, "tool_calls", None) or []:
+                    yield ChatStreamEvent(event="toolStart", toolName=toolCall["name"], content=json.dumps(toolCall.get("args", {})))
+                response += self.contentText(message.content)  # type: ignore
+            if "tool" in chunk:
+                for toolMessage in chunk["tool"]["messages"]:  # type: ignore
+                    yield ChatStreamEvent(event="toolEnd", toolName=getattr(toolMessage, "name", None))
+        yield ChatStreamEvent(event="message", content=response)
+
+    def invoke(self,
+               messages: list[t.Union[AIMessage, SystemMessage, HumanMessage]],
+               contextValues: InvokeContextValues,
+               ) -> ChatMessage:
+        """
+        Invoke the model with chat messages and get the response message.
+
+        :param messages: The chat messages to process.
+        :param contextValues: Additional context values for the invocation.
+        :return: The response message from the model.
+        """
+        response = ""
+        for event in self.stream(messages, contextValues):
+            if event.event == "message":
+                response = event.content
         return ChatMessage("ai", str(response))
 
 
 class GraphModel(BaseModel):
     """Graph model class for language model interactions."""
 
+    contextTokenBudget = 128000
+
     def __init__(self,
                  additionalLLMProperty: AdditionalModelProperty,
                  gcpCredentials: t.Optional[Credentials] = None,
+                 contextBuilder: t.Optional[ContextBuilder] = None,
                  ) -> None:
-        super().__init__(additionalLLMProperty)
+        super().__init__(additionalLLMProperty, contextBuilder)
         if gcpCredentials is None:
             logger.warning("No GCP credentials provided, Improper setup will cause issues.")
         self.llm = ChatVertexAI(
@@ -135,6 +195,7 @@ class GraphModel(BaseModel):
             response_mime_type="application/json",
             # response_schema={"type": "OBJECT", "properties": {"action": {"type": "STRING"}, "action_input": {"type": "STRING"}}, "required": ["action", "action_input"]},
         )
+        self.model = Model(self.llm, self.additionalLLMProperty)
 
     def invoke(self, chatRecord: ChatRecord, contextValues: InvokeContextValues) -> ChatMessage:
         """
@@ -144,5 +205,14 @@ class GraphModel(BaseModel):
         :param contextValues: Additional context values for the invocation.
         :return: The response message from the model.
         """
-        model = Model(self.llm, self.additionalLLMProperty, contextValues)
-        return model.invoke(chatRecord)
+        return self.model.invoke(self.contextMessages(chatRecord), contextValues)
+
+    def stream(self, chatRecord: ChatRecord, contextValues: InvokeContextValues) -> t.Iterator[ChatStreamEvent]:
+        """
+        Invoke the model with a chat record and yield events as the response is generated.
+
+        :param chatRecord: The chat record to process.
+        :param contextValues: Additional context values for the invocation.
+        :return: An iterator of stream events, ending with a `message` event.
+        """
+        return self.model.stream(self.contextMessages(chatRecord), contextValues)
@@ -47,6 +47,21 @@ class InvokeContextValues:
         description="The location of the user. This is used to provide context to the LLM.",
     )
     utctime: str = Field(
-        default=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        default_factory=lambda: datetime.datetime.now(datetime.timezone.utc).isoformat(),
         description="The current UTC time in ISO format. This is used to provide context to the LLM.",
     )
+
+
+@dataclass
+class ChatStreamEvent:
+    event: t.Literal["token", "toolStart", "toolEnd", "message"] = Field(
+        description="The type of the event. `message` is always the last event of a stream and carries the complete response.",
+    )
+    content: str = Field(
+        default="",
+        description="Partial response text for `token`, tool input for `toolStart`, complete response text for `message`.",
+    )
+    toolName: t.Optional[str] = Field(
+        default=None,
+        description="The name of the tool for `toolStart` and `toolEnd` events.",
+    )
@@ -1,9 +1,15 @@
+import re
+import json
+import queue
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from ..DataHandler import ChatRecord, ChatMessage
+from ..ContextBuilder import ContextBuilder
 from .Base import BaseModel
 
-from .Property import AdditionalModelProperty, InvokeContextValues
+from .Property import AdditionalModelProperty, InvokeContextValues, ChatStreamEvent
 
 import typing as t
 import typing_extensions as te
@@ -16,6 +22,7 @@ from langchain_openai import AzureChatOpenAI
 from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory
 
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain.agents import create_structured_chat_agent, AgentExecutor  # type: ignore
 
 
@@ -37,8 +44,123 @@ class LLMResponseFormat(te.TypedDict):
     action_input: te.Annotated[t.Any, ..., "The action input"]
 
 
+# the start of the response text in the json blob of a final answer
+FINAL_ANSWER_PATTERN = re.compile(r'"action"\s*:\s*"Final Answer"\s*,\s*"action_input"\s*:\s*"')
+JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def decodePartialJsonString(text: str, start: int) -> t.Tuple[str, int, bool]:
+    """
+    Decode the available part of a json string of which only the beginning may have been generated yet.
+
+    :param text: The text containing the json string.
+    :param start: The position after the opening quote, or where the last decode stopped.
+    :return: The decoded text, the position to continue from and whether the closing quote was reached.
+    """
+    decoded: list[str] = []
+    i = start
+    while i < len(text):
+        char = text[i]
+        if char == '"':
+            return "".join(decoded), i + 1, True
+        if char != "\\":
+            decoded.append(char)
+            i += 1
+            continue
+        if i + 1 >= len(text):
+            break
+        if text[i + 1] != "u":
+            decoded.append(JSON_ESCAPES.get(text[i + 1], text[i + 1]))
+            i += 2
+            continue
+        if i + 6 > len(text):
+            break
+        try:
+            code = int(text[i + 2:i + 6], 16)
+        except ValueError:
+            code = 0
+        # a high surrogate is decoded together with the low surrogate that follows it
+        length = 12 if 0xD800 <= code < 0xDC00 else 6
+        if i + length > len(text):
+            break
+        try:
+            decoded.append(json.loads(f'"{text[i:i + length]}"'))
+        except ValueError:
+            decoded.append(text[i:i + length])
+        i += length
+    return "".join(decoded), i, False
+
+
+class StreamCancelled(Exception):
+    """Raised in the agent of a stream when the stream is no longer read"""
+
+
+class FinalAnswerTokenHandler(BaseCallbackHandler):
+    """
+    Callback handler passing on the response text of the final answer as the llm generates it.
+
+    The structured chat agent answers with a json blob, tokens of tool actions and the json
+    around the response text are not passed on.
+    When the cancel event is set, the llm call in progress and the next one raise `StreamCancelled`.
+    """
+
+    def __init__(self, onText: t.Callable[[str], None], cancelled: t.Optional[threading.Event] = None) -> None:
+        """
+        :param onText: Called with each part of the response text.
+        :param cancelled: Set to stop the agent.
+        """
+        self.onText = onText
+        self.cancelled = cancelled
+        # let StreamCancelled reach the agent instead of being logged by the callback manager
+        self.raise_error = cancelled is not None
+        self.streamed = False
+        # run id: (generated text, position of the response text or -1 if not found yet, finished)
+        self._runs: dict[t.Any, t.Tuple[str, int, bool]] = {}
+
+    def _checkCancelled(self) -> None:
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise StreamCancelled()
+
+    def on_chat_model_start(self, serialized: t.Any, messages: t.Any, *, run_id: t.Any, **kwargs: t.Any) -> None:
+        self._checkCancelled()
+        self._runs[run_id] = ("", -1, False)
+
+    def on_llm_start(self, serialized: t.Any, prompts: t.Any, *, run_id: t.Any, **kwargs: t.Any) -> None:
+        self._checkCancelled()
+        self._runs[run_id] = ("", -1, False)
+
+    def on_llm_new_token(self, token: str, *, run_id: t.Any, **kwargs: t.Any) -> None:
+        self._checkCancelled()
+        generated, position, finished = self._runs.get(run_id, ("", -1, False))
+        if finished:
+            return
+        generated += token
+        if position < 0:
+            match = FINAL_ANSWER_PATTERN.search(generated)
+            if match is None:
+                self._runs[run_id] = (generated, -1, False)
+                return
+            position = match.end()
+        text, position, finished = decodePartialJsonString(generated, position)
+        self._runs[run_id] = (generated, position, finished)
+        if text:
+            self.streamed = True
+            self.onText(text)
+
+    def on_llm_end(self, response: t.Any, *, run_id: t.Any, **kwargs: t.Any) -> None:
+        self._runs.pop(run_id, None)
+
+
 class v1LLMChainModel(BaseModel):
-    """Model class for pure language model interactions."""
+    """
+    Model class for pure language model interactions.
+
+    The llm client and the agent executor are created once and are safe to share between threads,
+    create one instance per process and reuse it for every request.
+    Streamed agents run on a bounded pool of the instance.
+    """
+
+    contextTokenBudget = 32000
     systemPromptTemplate = (
         "Respond to the human as helpfully and accurately as possible. You have access to the following tools:\n"
         "{tools}\n"
@@ -71,38 +193,62 @@ class v1LLMChainModel(BaseModel):
         "Begin! Reminder to ALWAYS respond with a valid json blob of a single action. Use tools if necessary. Format is Action:```$JSON_BLOB```then Observation"
     )
 
-    def get_response_from_llm(self,
-                              messagesRecord: ChatRecord,
-                              contextValues: InvokeContextValues
-                              ) -> t.Dict[str, t.Any]:
+    def create_agent_executor(self) -> AgentExecutor:
+        """
+        Create the agent executor of this model.
+
+        The executor holds no per request state, the chat history and context values are passed as inputs,
+        so one executor is shared by every invocation of this model.
+        """
         messages: list[t.Any] = [
             ('system', self.systemPromptTemplate),
             ('system', (
-                f"<context>"
-                f"    <userLocation>{contextValues.location}</userLocation>"
-                f"    <userUTCTime>{contextValues.utctime}</userUTCTime>"
-                f"</context>"
+                "<context>"
+                "    <userLocation>{userLocation}</userLocation>"
+                "    <userUTCTime>{userUTCTime}</userUTCTime>"
+                "</context>"
             )),
             MessagesPlaceholder('chat_history'),
             ("system",
              "{agent_scratchpad}\n (reminder to respond in a JSON blob no matter what and response with markdown in the Final Answer response json blob.)")]
         prompt = ChatPromptTemplate(messages)
-        executor = AgentExecutor(
+        return AgentExecutor(
             agent=create_structured_chat_agent(self.llm, self.tools, prompt),
             tools=self.tools,
             verbose=True,
             handle_parsing_errors=True,
         )
-        return executor.invoke({
-            "chat_history": messagesRecord.asLcMessages,
-        })
+
+    def get_agent_inputs(self,
+                         messagesRecord: ChatRecord,
+                         contextValues: InvokeContextValues
+                         ) -> t.Dict[str, t.Any]:
+        return {
+            "chat_history": self.contextMessages(messagesRecord),
+            "userLocation": contextValues.location,
+            "userUTCTime": contextValues.utctime,
+        }
+
+    def get_response_from_llm(self,
+                              messagesRecord: ChatRecord,
+                              contextValues: InvokeContextValues
+                              ) -> t.Dict[str, t.Any]:
+        return self.agentExecutor.invoke(self.get_agent_inputs(messagesRecord, contextValues))
 
     def __init__(self,
                  gcpCredentials: t.Optional[Credentials] = None,
                  additionalLLMProperty: AdditionalModelProperty | None = None,
+                 contextBuilder: t.Optional[ContextBuilder] = None,
+                 streamWorkers: int = 8,
                  ) -> None:
-        super().__init__(additionalLLMProperty)
+        """
+        Initialize a v1LLMChainModel instance.
+
+        :param streamWorkers: The number of streamed agents running at the same time, more streams wait for a worker.
+        """
+        super().__init__(additionalLLMProperty, contextBuilder)
         logger.debug("Creating ChatLLMv1 Chanin Model")
+        self.streamExecutor = ThreadPoolExecutor(max_workers=max(1, streamWorkers), thread_name_prefix="v1-agent-stream")
 
         if self.additionalLLMProperty.openAIProperty is None:
             raise ValueError("additionalLLMProperty or openAIProperty must be provided")
@@ -142,8 +288,67 @@ class v1LLMChainModel(BaseModel):
             except Exception as e:
                 logger.error(f"Failed to create ChatVertexAI instance: {e}")
                 raise ValueError("Failed to initialize LLM model, check your configuration") from e
+        self.agentExecutor = self.create_agent_executor()
 
     def invoke(self, chatRecord: ChatRecord, contextValues: t.Optional[InvokeContextValues] = None) -> ChatMessage:
         contextValues = contextValues or InvokeContextValues()
         result = self.get_response_from_llm(chatRecord, contextValues)
         return ChatMessage('ai', result['output'])
+
+    def stream(self, chatRecord: ChatRecord, contextValues: t.Optional[InvokeContextValues] = None) -> t.Iterator[ChatStreamEvent]:
+        """
+        Invoke the model with a chat record and yield events as the response is generated.
+
+        The agent runs on the stream pool, response text is yielded as the llm generates the final answer,
+        tool usage as the agent takes each step.
+        When the iterator is closed, like when the client disconnects, the agent stops at its next llm token or step.
+
+        :param chatRecord: The chat record to process.
+        :param contextValues: Additional context values for the invocation.
+        :return: An iterator of stream events, ending with a `message` event.
+        """
+        contextValues = contextValues or InvokeContextValues()
+        inputs = self.get_agent_inputs(chatRecord, contextValues)
+        # events of the agent thread, None when it finished
+        events: queue.Queue[t.Union[ChatStreamEvent, BaseException, None]] = queue.Queue()
+        cancelled = threading.Event()
+        handler = FinalAnswerTokenHandler(lambda text: events.put(ChatStreamEvent(event="token", content=text)), cancelled)
+
+        def run() -> None:
+            if cancelled.is_set():
+                events.put(None)
+                return
+            chunks = self.agentExecutor.stream(inputs, config={"callbacks": [handler]})
+            try:
+                output = ""
+                for chunk in chunks:
+                    if cancelled.is_set():
+                        logger.debug("Stream closed, stopping agent")
+                        return
+                    for action in chunk.get("actions", []):
+                        toolInput = action.tool_input if isinstance(action.tool_input, str) else json.dumps(action.tool_input)
+                        events.put(ChatStreamEvent(event="toolStart", toolName=action.tool, content=toolInput))
+                    for step in chunk.get("steps", []):
+                        events.put(ChatStreamEvent(event="toolEnd", toolName=step.action.tool))
+                    if "output" in chunk:
+                        output = str(chunk["output"])
+                if not handler.streamed:
+                    # the answer was not a json string, like a parsing error reply
+                    events.put(ChatStreamEvent(event="token", content=output))
+                events.put(ChatStreamEvent(event="message", content=output))
+            except StreamCancelled:
+                logger.debug("Stream closed, stopped agent")
+            except BaseException as e:
+                events.put(e)
+            finally:
+                chunks.close()
+                events.put(None)
+
+        self.streamExecutor.submit(run)
+        try:
+            while (event := events.get()) is not None:
+                if isinstance(event, BaseException):
+                    raise event
+                yield event
+        finally:
+            cancelled.set()
@@ -0,0 +1,288 @@
+import math
+import logging
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy.orm as so
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+from .DataHandler import ChatRecord
+from .DataHandler import ChatMessage
+from .DataHandler import ChatContextSummory
+
+
+logger = logging.getLogger(__name__)
+
+
+def setLogger(external_logger: logging.Logger) -> None:
+    """
+    Set the logger for the module.
+
+    :param external_logger: The external logger to use.
+    """
+    global logger
+    logger = external_logger
+
+
+# Summorize messages, given the summory of the messages before them if any
+Summorizer = t.Callable[[t.List[ChatMessage], t.Optional[str]], str]
+
+
+class ContextBuilder:
+    """
+    Assemble the messages sent to the language model within a token budget.
+
+    The latest messages are kept verbatim, earlier messages are replaced by a rolling summory
+    stored with the chat, and attachments of all but the latest messages are sent as references.
+    Earlier messages are summorized in batches, until then they are kept verbatim as the budget allows.
+    Only the messages the summory does not cover yet are loaded, and a long backlog is summorized oldest first
+    in batches that fit the summorizer.
+    """
+
+    def __init__(self,
+                 summorizer: t.Optional[Summorizer] = None,
+                 tokenBudget: int = 16000,
+                 keepLastMessages: int = 8,
+                 keepMediaLastMessages: int = 2,
+                 mediaTokenCost: int = 258,
+                 charsPerToken: float = 4,
+                 summorizeBatchMessages: int = 4,
+                 maxPendingMessages: int = 32,
+                 sessionFactory: t.Optional[t.Callable[[], so.Session]] = None,
+                 ) -> None:
+        """
+        Initialize a ContextBuilder instance.
+
+        :param summorizer: Used to summorize messages that no longer fit, without it they are dropped.
+        :param tokenBudget: The estimated number of tokens the messages may use.
+        :param keepLastMessages: The maximum number of latest messages kept verbatim.
+        :param keepMediaLastMessages: The number of latest messages that keep their attachment data.
+        :param mediaTokenCost: The estimated number of tokens of an attachment.
+        :param charsPerToken: The estimated number of characters of a token.
+        :param summorizeBatchMessages: The number of earlier messages not in the summory that trigger summorizing them.
+        :param maxPendingMessages: The maximum number of earlier messages not in the summory loaded with the latest messages,
+            and the maximum number of messages summorized in one call.
+        :param sessionFactory: Opens a database session, when given messages are summorized on a background thread
+            with their own session instead of during the build.
+        """
+        self.summorizer = summorizer
+        self.tokenBudget = tokenBudget
+        self.keepLastMessages = max(1, keepLastMessages)
+        self.keepMediaLastMessages = keepMediaLastMessages
+        self.mediaTokenCost = mediaTokenCost
+        self.charsPerToken = charsPerToken
+        self.summorizeBatchMessages = max(1, summorizeBatchMessages)
+        self.maxPendingMessages = max(0, maxPendingMessages)
+        self.sessionFactory = sessionFactory
+        self._summorizing: set[int] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summory") if sessionFactory is not None else None
+
+    def estimateTextTokens(self, text: str) -> int:
+        """
+        Estimate the number of tokens of a text.
+
+        :param text: The text.
+        :return: The estimated number of tokens.
+        """
+        return math.ceil(len(text) / self.charsPerToken)
+
+    def estimateMessageTokens(self, message: ChatMessage, includeMedia: bool) -> int:
+        """
+        Estimate the number of tokens of a message.
+
+        :param message: The message.
+        :param includeMedia: Whether the attachment data is sent with the message.
+        :return: The estimated number of tokens.
+        """
+        mediaTokens = self.mediaTokenCost if includeMedia else 32
+        return self.estimateTextTokens(message.text) + len(message.attachments) * mediaTokens
+
+    def summorize(self, chatRecord: ChatRecord, messages: t.List[ChatMessage]) -> t.Optional[str]:
+        """
+        Get the summory of messages, updating the stored summory with messages it does not cover yet.
+
+        :param chatRecord: The chat record the messages belong to.
+        :param messages: The earlier messages not sent verbatim.
+        :return: The summory or None if there is nothing to summorize.
+        """
+        summory = chatRecord.contextSummory
+        if not messages:
+            return None
+        lastMessageId = summory.lastMessageId if summory is not None else 0
+        pendingMessages = [m for m in messages if m.id is not None and m.id > lastMessageId]
+        if not pendingMessages:
+            return summory.text if summory is not None else None
+        if self.summorizer is None:
+            logger.warning(f"No summorizer, dropping {len(pendingMessages)} messages of {chatRecord.chatId=} from context")
+            return summory.text if summory is not None else None
+
+        logger.debug(f"Summorizing {len(pendingMessages)} messages of {chatRecord.chatId=} after {lastMessageId=}")
+        try:
+            text = self.summorizer(pendingMessages, summory.text if summory is not None else None)
+        except Exception as e:
+            logger.error(f"Failed to summorize {chatRecord.chatId=}, using previous summory: {e}")
+            return summory.text if summory is not None else None
+
+        if summory is None:
+            chatRecord.contextSummory = ChatContextSummory(text, pendingMessages[-1].id)
+        else:
+            summory.text = text
+            summory.lastMessageId = pendingMessages[-1].id
+        return text
+
+    def summorizeBatches(self,
+                         chatRecord: ChatRecord,
+                         messages: t.List[ChatMessage],
+                         commit: t.Optional[t.Callable[[], None]] = None,
+                         ) -> t.Optional[str]:
+        """
+        Summorize messages oldest first, in batches of at most `maxPendingMessages` messages and the token budget.
+
+        Stops at the first batch that fails, the summory then covers the batches before it.
+
+        :param chatRecord: The chat record the messages belong to.
+        :param messages: The earlier messages not sent verbatim, oldest first.
+        :param commit: Called after each batch to save the summory.
+        :return: The summory or None if there is nothing to summorize.
+        """
+        batchMessages = max(1, self.maxPendingMessages)
+        batches: list[list[ChatMessage]] = []
+        batchTokens = 0
+        for message in messages:
+            messageTokens = self.estimateMessageTokens(message, False)
+            if not batches or len(batches[-1]) >= batchMessages or batchTokens + messageTokens > self.tokenBudget:
+                batches.append([])
+                batchTokens = 0
+            batches[-1].append(message)
+            batchTokens += messageTokens
+
+        text = None
+        for batch in batches:
+            text = self.summorize(chatRecord, batch)
+            summory = chatRecord.contextSummory
+            if summory is None or summory.lastMessageId < batch[-1].id:
+                break
+            if commit is not None:
+                commit()
+        return text
+
+    def summorizeInBackground(self, chatRecordId: int, lastMessageId: int) -> None:
+        """
+        Summorize the messages of a chat up to a message on the background thread, unless the chat is already being summorized.
+
+        :param chatRecordId: The id of the chat record.
+        :param lastMessageId: The id of the last message to summorize.
+        """
+        if self._executor is None or self.sessionFactory is None:
+            return
+        with self._lock:
+            if chatRecordId in self._summorizing:
+                return
+            self._summorizing.add(chatRecordId)
+
+        def run() -> None:
+            try:
+                with self.sessionFactory() as dbSession:  # type: ignore
+                    chatRecord = dbSession.get(ChatRecord, chatRecordId)
+                    if chatRecord is None:
+                        return
+                    pageMessages = max(1, self.maxPendingMessages) * 4
+                    while True:
+                        summory = chatRecord.contextSummory
+                        afterId = summory.lastMessageId if summory is not None else 0
+                        # a page of the oldest messages at a time, the backlog of a long chat may not fit in memory
+                        messages = chatRecord.queryMessages(dbSession, limit=pageMessages, afterId=afterId, oldest=True)
+                        messages = [m for m in messages if m.id <= lastMessageId]
+                        if not messages:
+                            return
+                        self.summorizeBatches(chatRecord, messages, commit=dbSession.commit)
+                        summory = chatRecord.contextSummory
+                        if summory is None or summory.lastMessageId < messages[-1].id or len(messages) < pageMessages:
+                            return
+            except Exception as e:
+                logger.error(f"Failed to summorize {chatRecordId=} in background: {e}")
+            finally:
+                with self._lock:
+                    self._summorizing.discard(chatRecordId)
+        self._executor.submit(run)
+
+    def loadMessages(self, chatRecord: ChatRecord) -> list[ChatMessage]:
+        """
+        Load the messages of a chat the summory does not cover yet, at most the latest messages and the pending ones.
+
+        Without a background session all messages not in the summory are loaded, they are summorized during the build.
+
+        :param chatRecord: The chat record.
+        :return: The messages, oldest first.
+        """
+        dbSession = so.object_session(chatRecord)
+        if dbSession is None:
+            return list(chatRecord.messages)
+        # give a new chat and its new messages their ids
+        dbSession.flush()
+        summory = chatRecord.contextSummory
+        summorizedHere = self.sessionFactory is None and self.summorizer is not None
+        return chatRecord.queryMessages(
+            dbSession,
+            limit=None if summorizedHere else self.keepLastMessages + self.maxPendingMessages,
+            afterId=summory.lastMessageId if summory is not None else None,
+        )
+
+    def build(self, chatRecord: ChatRecord, tokenBudget: t.Optional[int] = None) -> list[t.Union[AIMessage, SystemMessage, HumanMessage]]:
+        """
+        Build the messages to send to the language model for a chat record.
+
+        :param chatRecord: The chat record.
+        :param tokenBudget: The token budget of the model, the smaller of this and the builder budget is used.
+        :return: A list of LangChain message objects.
+        """
+        budget = min(tokenBudget, self.tokenBudget) if tokenBudget else self.tokenBudget
+        # leave room for the summory of the earlier messages
+        messageBudget = budget - budget // 8
+        messages = self.loadMessages(chatRecord)
+
+        window: list[tuple[ChatMessage, bool]] = []
+        usedTokens = 0
+        for index, message in enumerate(reversed(messages)):
+            includeMedia = index < self.keepMediaLastMessages
+            messageTokens = self.estimateMessageTokens(message, includeMedia)
+            if window and (len(window) >= self.keepLastMessages or usedTokens + messageTokens > messageBudget):
+                break
+            window.insert(0, (message, includeMedia))
+            usedTokens += messageTokens
+        # the verbatim messages should start on a user turn
+        while len(window) > 1 and window[0][0].role != "user":
+            window.pop(0)
+
+        # earlier messages not in the summory yet are kept as the budget allows until they are summorized
+        pendingMessages = messages[:len(messages) - len(window)]
+        keptPending: list[tuple[ChatMessage, bool]] = []
+        for message in reversed(pendingMessages):
+            messageTokens = self.estimateMessageTokens(message, False)
+            if usedTokens + messageTokens > messageBudget:
+                break
+            keptPending.insert(0, (message, False))
+            usedTokens += messageTokens
+        while keptPending and keptPending[0][0].role != "user":
+            usedTokens -= self.estimateMessageTokens(keptPending.pop(0)[0], False)
+
+        summory = chatRecord.contextSummory
+        summoryText = summory.text if summory is not None else None
+        if pendingMessages and (len(pendingMessages) >= self.summorizeBatchMessages or len(keptPending) < len(pendingMessages)):
+            if self.sessionFactory is not None and chatRecord.id is not None:
+                self.summorizeInBackground(chatRecord.id, pendingMessages[-1].id)
+            else:
+                summoryText = self.summorizeBatches(chatRecord, pendingMessages)
+                if chatRecord.contextSummory is not None:
+                    # only the messages after a failed batch are still kept verbatim
+                    summorizedId = chatRecord.contextSummory.lastMessageId
+                    keptPending = [(message, includeMedia) for message, includeMedia in keptPending if message.id > summorizedId]
+
+        logger.debug(f"Building context of {chatRecord.chatId=} with {len(window)} messages, {len(keptPending)} of {len(pendingMessages)} pending summory, ~{usedTokens} tokens")
+        lcMessages: list[t.Union[AIMessage, SystemMessage, HumanMessage]] = []
+        if summoryText:
+            lcMessages.append(SystemMessage(content=f"<conversationSummory>{summoryText}</conversationSummory>"))
+        lcMessages += [message.toLcMessageObject(includeMedia) for message, includeMedia in keptPending + window]
+        return lcMessages
@@ -4,13 +4,15 @@ import logging
 import hashlib
 import datetime
 import typing as t
-from PIL import Image
-from io import BytesIO
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 import sqlalchemy.sql as sl
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
+from .Cache import ByteBudgetLRUCache
+from .BlobStore import BlobStore, LocalBlobStore
+from . import ImageIngest
+
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +27,34 @@ def setLogger(external_logger: logging.Logger) -> None:
     logger = external_logger
 
 
+# Base64 data of attachments by blob name, shared by all sessions of the process
+attachmentCache: ByteBudgetLRUCache[str, str] = ByteBudgetLRUCache(64 * 1024 * 1024)
+
+
+def setAttachmentCache(cache: ByteBudgetLRUCache[str, str]) -> None:
+    """
+    Set the cache of attachment data for the module.
+
+    :param cache: The cache to use.
+    """
+    global attachmentCache
+    attachmentCache = cache
+
+
+# Where attachment data is stored, shared by all sessions of the process
+blobStore: BlobStore = LocalBlobStore("./chat_data/messageAttachment")
+
+
+def setBlobStore(store: BlobStore) -> None:
+    """
+    Set the blob store of attachment data for the module.
+
+    :param store: The blob store to use.
+    """
+    global blobStore
+    blobStore = store
+
+
 class TableBase(so.DeclarativeBase):
     """Base class for SQLAlchemy table definitions."""
     pass
@@ -42,61 +72,80 @@ class MessageAttachment(TableBase):
 
     _base64Data: str = ""
 
-    def __init__(self, dataUrl: str, baseDataPath: str = "./data/messageAttachment") -> None:
+    def __init__(self,
+                 dataUrl: t.Optional[str] = None,
+                 baseDataPath: str = "./data/messageAttachment",
+                 data: t.Optional[bytes] = None,
+                 mimeType: t.Optional[str] = None,
+                 ) -> None:
         """
         Initialize a MessageAttachment instance.
 
+        Either a data URL, which is verified and converted on the calling thread,
+        or data already processed by `ImageIngest` with its mime type is required.
+
         :param dataUrl: The javascript data URL of the attachment.
-        :param baseDataPath: The base path to store the attachment data.
+        :param baseDataPath: The base path of attachments stored before the blob store, kept for reading them.
+        :param data: The processed raw data of the attachment.
+        :param mimeType: The mime type of the processed data.
         """
-        logger.debug(f"Starting check for {dataUrl}")
-
-        if not dataUrl.startswith("data"):
-            raise ValueError("dataUrl must be a javascript data URL")
-        if not os.path.exists(baseDataPath):
-            os.makedirs(baseDataPath)
         self.baseDataPath = baseDataPath
+        if data is not None and mimeType is not None:
+            self.mimeType = mimeType
+            self.data = data
+            return
+        if dataUrl is None:
+            raise ValueError("either dataUrl or data with mimeType is required")
+
+        logger.debug(f"Ingesting {dataUrl[:30]=}")
+        data, mimeType = ImageIngest.ingestDataUrl(dataUrl)
+        self.mimeType = mimeType
+        self.data = data
 
-        logger.debug(f"Parsing {dataUrl[:30]=} to md5 for blobname")
-        self.blobName = hashlib.md5(dataUrl.encode()).hexdigest()
-        mimeType = dataUrl.split(";")[0].split(":")[1]
-        data = dataUrl.split(",")[1]
-
-        if mimeType.split("/")[0] == "image" and mimeType.split("/")[1] != "gif":
-            logger.debug(f"Starting Image convert to png")
-            targetFormat = "png"
-            processedImage = BytesIO()
-            try:
-
-                im = Image.open(BytesIO(base64.b64decode(data)))
-                logger.debug(f"Starting Image verify")
-                im.verify()
-                # https://stackoverflow.com/questions/75644033/pillow-gives-attributeerror-nonetype-object-has-no-attribute-seek-when-tryi
-                # https://docs.djangoproject.com/en/4.2/ref/forms/fields/#django.forms.ImageField
-                # image need to be reopened becaused PIL.Image.open() close the underlying file, no idea why this slipped through unitests
-                # Unitest is fine and the image is outputed correctly
-                # TODO: fix unitest
-                logger.debug(f"Exporting Image to png")
-                im = Image.open(BytesIO(base64.b64decode(data)))
-                im.save(processedImage, targetFormat)
-                logger.debug(f"Extracting png base64 data")
-                data = base64.b64encode(processedImage.getvalue()).decode()
-                mimeType = f"image/{targetFormat}"
-            except Exception as e:
-                logger.error(f"Invalid image data: {e}")
-                raise ValueError("Invalid image data")
-
-        if mimeType == "image/gif":
-            logger.debug(f"Starting Image verify for gif")
-            try:
-                im = Image.open(BytesIO(base64.b64decode(data)))
-                im.verify()
-            except Exception as e:
-                logger.error(f"Invalid gif data: {e}")
-                raise ValueError("Invalid gif data")
+    @property
+    def legacyDataPath(self) -> str:
+        """
+        Get the path of the attachment if it was stored as base64 text before the blob store.
 
-        self.mimeType = mimeType
-        self.base64Data = data
+        :return: The path of the base64 text file.
+        """
+        return os.path.join(self.baseDataPath, self.blobName)
+
+    @property
+    def data(self) -> bytes:
+        """
+        Get the raw data of the attachment.
+
+        :return: The raw data, empty if not found.
+        """
+        logger.debug(f"fetching {self.blobName} data")
+        data = blobStore.get(self.blobName) if BlobStore.isKey(self.blobName) else None
+        if data is not None:
+            return data
+        return base64.b64decode(self.base64Data)
+
+    @data.setter
+    def data(self, value: bytes) -> None:
+        """
+        Store the raw data of the attachment, the blob name is set to the key of the data.
+
+        :param value: The raw data.
+        """
+        self.blobName = blobStore.put(value)
+        logger.debug(f"stored data as {self.blobName}")
+        self._base64Data = base64.b64encode(value).decode("ascii")
+        attachmentCache.put(self.blobName, self._base64Data)
+
+    def iterData(self, chunkSize: int = 64 * 1024) -> t.Iterator[bytes]:
+        """
+        Stream the raw data of the attachment in chunks.
+
+        :param chunkSize: The maximum size of each chunk.
+        :return: An iterator of chunks.
+        """
+        if BlobStore.isKey(self.blobName) and blobStore.exists(self.blobName):
+            return blobStore.iterChunks(self.blobName, chunkSize)
+        return iter([self.data])
 
     @property
     def base64Data(self) -> str:
@@ -107,15 +156,28 @@ class MessageAttachment(TableBase):
         """
         logger.debug(f"fetching {self.blobName} base64 data")
         if self._base64Data:
-            logger.debug(f"found in cache returning")
+            logger.debug(f"found in instance returning")
             return self._base64Data
-        fullDataPath = os.path.join(self.baseDataPath, self.blobName)
-        logger.debug(f"getting data from {fullDataPath}")
-        if not os.path.exists(fullDataPath):
-            logger.warning(f"data not found at {fullDataPath} returning \"\"")
-            return ""
-        with open(fullDataPath, "rb") as f:
-            return f.read().decode('ascii')
+        cachedData = attachmentCache.get(self.blobName)
+        if cachedData is not None:
+            logger.debug(f"found in attachment cache returning")
+            self._base64Data = cachedData
+            return cachedData
+        data: t.Optional[str] = None
+        if BlobStore.isKey(self.blobName):
+            with blobStore.view(self.blobName) as view:
+                if view is not None:
+                    data = base64.b64encode(view).decode("ascii")
+        if data is None:
+            logger.debug(f"getting legacy data from {self.legacyDataPath}")
+            if not os.path.exists(self.legacyDataPath):
+                logger.warning(f"data not found at {self.legacyDataPath} returning \"\"")
+                return ""
+            with open(self.legacyDataPath, "rb") as f:
+                data = f.read().decode('ascii')
+        self._base64Data = data
+        attachmentCache.put(self.blobName, self._base64Data)
+        return self._base64Data
 
     @base64Data.setter
     def base64Data(self, value: str) -> None:
@@ -124,11 +186,7 @@ class MessageAttachment(TableBase):
 
         :param value: The base64 encoded data.
         """
-        self._base64Data = value
-        fullDataPath = os.path.join(self.baseDataPath, self.blobName)
-        logger.debug(f"storeing data to {fullDataPath}")
-        with open(fullDataPath, 'wb') as f:
-            f.write(self._base64Data.encode("ascii"))
+        self.data = base64.b64decode(value)
 
     @property
     def asLcMessageDict(self) -> dict[str, str]:
@@ -143,6 +201,18 @@ class MessageAttachment(TableBase):
             "mime_type": self.mimeType,
         }
 
+    @property
+    def asLcReferenceDict(self) -> dict[str, str]:
+        """
+        Convert the attachment to a text reference without the data.
+
+        :return: A dictionary representation of the reference.
+        """
+        return {
+            "type": "text",
+            "text": f"<media type=\"{self.mimeType}\" ref=\"{self.blobName}\">omitted, shared earlier in the conversation</media>",
+        }
+
     @property
     def uri(self) -> str:
         """
@@ -199,12 +269,21 @@ class ChatMessage(TableBase):
         """
         Convert the message to a list of dictionary representations.
 
+        :return: A list of dictionary representations of the message.
+        """
+        return self.toLcMessageList()
+
+    def toLcMessageList(self, includeMedia: bool = True) -> list[dict[str, str]]:
+        """
+        Convert the message to a list of dictionary representations.
+
+        :param includeMedia: Whether to include the attachment data, when False attachments are referenced by text.
         :return: A list of dictionary representations of the message.
         """
         return [{
             "type": "text",
             "text": self.text,
-        }] + list(map(lambda x: x.asLcMessageDict, self.attachments))
+        }] + list(map(lambda x: x.asLcMessageDict if includeMedia else x.asLcReferenceDict, self.attachments))
 
     @property
     def asLcMessageObject(self) -> t.Union[AIMessage, SystemMessage, HumanMessage]:
@@ -213,7 +292,16 @@ class ChatMessage(TableBase):
 
         :return: A LangChain message object.
         """
-        return self.lcMessageMapping[self.role](content=self.asLcMessageList)  # type: ignore
+        return self.toLcMessageObject()
+
+    def toLcMessageObject(self, includeMedia: bool = True) -> t.Union[AIMessage, SystemMessage, HumanMessage]:
+        """
+        Convert the message to a LangChain message object.
+
+        :param includeMedia: Whether to include the attachment data, when False attachments are referenced by text.
+        :return: A LangChain message object.
+        """
+        return self.lcMessageMapping[self.role](content=self.toLcMessageList(includeMedia))  # type: ignore
 
 
 class ChatRecord(TableBase):
@@ -222,6 +310,11 @@ class ChatRecord(TableBase):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     chatId: so.Mapped[str] = so.mapped_column(sa.String, nullable=False, unique=True, index=True)
     messages: so.Mapped[t.List["ChatMessage"]] = so.relationship(back_populates="chat")
+    contextSummory: so.Mapped[t.Optional["ChatContextSummory"]] = so.relationship(back_populates="chat")
+    # kept in step with messages by add_message so appending never loads the chat history
+    messageCount: so.Mapped[int] = so.mapped_column("message_count", sa.Integer, nullable=False, default=0, server_default="0")
+    lastRole: so.Mapped[t.Optional[str]] = so.mapped_column("last_role", sa.String, nullable=True)
+    lastMessageAt: so.Mapped[t.Optional[datetime.datetime]] = so.mapped_column("last_message_at", sa.DateTime(), nullable=True)
 
     def __init__(self,
                  chatId: t.Optional[str] = None,
@@ -235,6 +328,9 @@ class ChatRecord(TableBase):
         """
         self.chatId = chatId or hashlib.md5(str(datetime.datetime.now(datetime.UTC)).encode()).hexdigest()
         self.messages = messages
+        self.messageCount = len(messages)
+        self.lastRole = messages[-1].role if messages else None
+        self.lastMessageAt = None
 
     @classmethod
     def init(cls,
@@ -267,14 +363,85 @@ class ChatRecord(TableBase):
             raise ValueError(f'message role must be one of ["user", "system", "ai"]')
         if not message.text.strip():
             message.text = "<EMPTY>"
-        if len(self.messages) == 0 and message.role == "ai":
+        dbSession = so.object_session(self)
+        if dbSession is not None and self.id is not None:
+            # lock the chat row until commit so concurrent requests on the chat check and count messages one at a time,
+            # key share locks of rows referencing the chat are still allowed
+            messageCount, lastRole = dbSession.execute(
+                sa.select(ChatRecord.messageCount, ChatRecord.lastRole)
+                .where(ChatRecord.id == self.id)
+                .with_for_update(key_share=True)
+            ).one()
+        else:
+            messageCount, lastRole = self.messageCount or 0, self.lastRole
+        if messageCount == 0 and message.role == "ai":
             raise ValueError("Cannot append message role=AI on the first message")
-        if len(self.messages) > 0 and self.messages[-1].role == "ai" and message.role == "ai":
+        if messageCount > 0 and lastRole == "ai" and message.role == "ai":
             raise ValueError("Cannot have consective AI message")
-        if len(self.messages) > 0 and self.messages[-1].role == "user" and message.role == "user":
+        if messageCount > 0 and lastRole == "user" and message.role == "user":
             raise ValueError("Cannot have consective USER message")
         logger.debug(f"Checks passed added message to chat {self.chatId}, {message.role=}:{message.text[:10]=}")
-        self.messages.append(message)
+        # the backref queues the message on the unloaded collection without loading it
+        message.chat = self
+        if dbSession is not None:
+            dbSession.add(message)
+        # incremented by the database, so no concurrent increment is lost
+        self.messageCount = ChatRecord.messageCount + 1 if self.id is not None else messageCount + 1  # type: ignore
+        self.lastRole = message.role
+        self.lastMessageAt = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+    def lastMessageId(self, dbSession: so.Session, roles: t.Optional[t.Sequence[str]] = None) -> t.Optional[int]:
+        """
+        Get the id of the latest message of the chat.
+
+        :param dbSession: The database session.
+        :param roles: Only consider messages of these roles, all roles if None.
+        :return: The id of the latest message or None if there is none.
+        """
+        if self.id is None:
+            return None
+        statement = sa.select(sa.func.max(ChatMessage.id)).where(ChatMessage.chat_id == self.id)
+        if roles is not None:
+            statement = statement.where(ChatMessage.role.in_(roles))
+        return dbSession.scalar(statement)
+
+    def queryMessages(self,
+                      dbSession: so.Session,
+                      limit: t.Optional[int] = None,
+                      beforeId: t.Optional[int] = None,
+                      roles: t.Optional[t.Sequence[str]] = None,
+                      afterId: t.Optional[int] = None,
+                      oldest: bool = False,
+                      ) -> list[ChatMessage]:
+        """
+        Get a page of messages of the chat with their attachments, without loading the whole chat.
+
+        :param dbSession: The database session.
+        :param limit: The maximum number of messages, all messages if None.
+        :param beforeId: Only get messages older than the message with this id.
+        :param roles: Only get messages of these roles, all roles if None.
+        :param afterId: Only get messages newer than the message with this id.
+        :param oldest: Get the oldest matching messages instead of the latest.
+        :return: The latest or oldest matching messages, oldest first.
+        """
+        if self.id is None:
+            return []
+        statement = sa.select(ChatMessage) \
+            .where(ChatMessage.chat_id == self.id) \
+            .options(so.selectinload(ChatMessage.attachments)) \
+            .order_by(ChatMessage.id.asc() if oldest else ChatMessage.id.desc())
+        if roles is not None:
+            statement = statement.where(ChatMessage.role.in_(roles))
+        if beforeId is not None:
+            statement = statement.where(ChatMessage.id < beforeId)
+        if afterId is not None:
+            statement = statement.where(ChatMessage.id > afterId)
+        if limit is not None:
+            statement = statement.limit(limit)
+        messages = list(dbSession.scalars(statement))
+        if not oldest:
+            messages.reverse()
+        return messages
 
     @property
     def asLcMessages(self) -> list[t.Union[AIMessage, SystemMessage, HumanMessage]]:
@@ -284,3 +451,24 @@ class ChatRecord(TableBase):
         :return: A list of LangChain message objects.
         """
         return list(map(lambda msg: msg.asLcMessageObject, self.messages))
+
+
+class ChatContextSummory(TableBase):
+    """Represents the rolling summory of the earlier messages of a chat."""
+    __tablename__ = "chat_context_summories"
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    text: so.Mapped[str] = so.mapped_column(sa.String, nullable=False)
+    lastMessageId: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    lastUpdate: so.Mapped[datetime.datetime] = so.mapped_column(sa.DateTime(timezone=True), default=sl.func.now(), onupdate=sl.func.now())
+    chat_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("chats.id"), unique=True, index=True)
+    chat: so.Mapped["ChatRecord"] = so.relationship(back_populates="contextSummory")
+
+    def __init__(self, text: str, lastMessageId: int) -> None:
+        """
+        Initialize a ChatContextSummory instance.
+
+        :param text: The summory of the messages up to and including lastMessageId.
+        :param lastMessageId: The id of the last message covered by the summory.
+        """
+        self.text = text
+        self.lastMessageId = lastMessageId
@@ -0,0 +1,221 @@
+import base64
+import logging
+import binascii
+import threading
+import typing as t
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+from PIL import ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+
+def setLogger(external_logger: logging.Logger) -> None:
+    """
+    Set the logger for the module.
+
+    :param external_logger: The external logger to use.
+    """
+    global logger
+    logger = external_logger
+
+
+# Raw data and mime type of a media
+Media = t.Tuple[bytes, str]
+
+
+class ImageIngestError(RuntimeError):
+    """Raised when media cannot be ingested for a reason other than the media itself, like a crashed worker."""
+
+
+def decodeDataUrl(dataUrl: str) -> Media:
+    """
+    Decode a javascript data URL.
+
+    :param dataUrl: The javascript data URL.
+    :raises ValueError: If the data URL is invalid.
+    :return: The raw data and mime type.
+    """
+    if not dataUrl.startswith("data:") or "," not in dataUrl:
+        raise ValueError("dataUrl must be a javascript data URL")
+    header, data = dataUrl.split(",", 1)
+    mimeType = header[len("data:"):].split(";")[0]
+    try:
+        return base64.b64decode(data, validate=True), mimeType
+    except binascii.Error:
+        raise ValueError("Invalid base64 data")
+
+
+def ingestMedia(data: bytes,
+                mimeType: str,
+                maxDimension: int = 2048,
+                jpegQuality: int = 85,
+                ) -> Media:
+    """
+    Verify an uploaded media and convert images to a size bounded rendition.
+
+    The image is decoded once. Images within `maxDimension` that are already JPEG
+    are kept as is, others are resized and encoded as JPEG, or WEBP if they have transparency.
+    GIF are only verified to keep their animation, other media are returned unchanged.
+
+    :param data: The raw data of the media.
+    :param mimeType: The mime type of the media.
+    :param maxDimension: The maximum width and height of images.
+    :param jpegQuality: The quality of JPEG and WEBP output.
+    :raises ValueError: If the image is invalid.
+    :return: The raw data and mime type of the rendition.
+    """
+    if mimeType.split("/")[0] != "image":
+        return data, mimeType
+
+    try:
+        im = Image.open(BytesIO(data))
+        sourceFormat = im.format
+        # decode the whole image, truncated or corrupted data fails here
+        im.load()
+    except Exception as e:
+        logger.error(f"Invalid image data: {e}")
+        raise ValueError("Invalid image data")
+
+    if sourceFormat == "GIF":
+        return data, "image/gif"
+
+    # 0x0112 is the exif orientation tag, 1 is upright
+    rotated = im.getexif().get(0x0112, 1) != 1
+    resized = max(im.size) > maxDimension
+    if sourceFormat == "JPEG" and not resized and not rotated:
+        logger.debug(f"Keeping {im.size} jpeg as is")
+        return data, "image/jpeg"
+
+    if rotated:
+        im = ImageOps.exif_transpose(im)
+    if resized:
+        im.thumbnail((maxDimension, maxDimension), Image.Resampling.LANCZOS)
+
+    hasAlpha = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+    output = BytesIO()
+    if hasAlpha:
+        im.save(output, "WEBP", quality=jpegQuality, method=4)
+        targetMimeType = "image/webp"
+    else:
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        im.save(output, "JPEG", quality=jpegQuality, optimize=True, progressive=True)
+        targetMimeType = "image/jpeg"
+    logger.debug(f"Converted {sourceFormat} {len(data)} bytes to {targetMimeType} {im.size} {output.tell()} bytes")
+    return output.getvalue(), targetMimeType
+
+
+def ingestDataUrl(dataUrl: str, maxDimension: int = 2048, jpegQuality: int = 85) -> Media:
+    """
+    Decode a javascript data URL and ingest the media.
+
+    :param dataUrl: The javascript data URL.
+    :param maxDimension: The maximum width and height of images.
+    :param jpegQuality: The quality of JPEG and WEBP output.
+    :raises ValueError: If the data URL or the image is invalid.
+    :return: The raw data and mime type of the rendition.
+    """
+    data, mimeType = decodeDataUrl(dataUrl)
+    return ingestMedia(data, mimeType, maxDimension, jpegQuality)
+
+
+class ImageIngestPool:
+    """
+    Run media ingestion on worker processes so image decoding does not hold the request threads.
+
+    Call `start` before the application starts any threads, the workers are forked from the process then.
+    A pool created later, or again after a worker crashed, uses a fork server instead,
+    as forking a process with running threads and gRPC channels can deadlock the child.
+    With no workers the media is ingested on the calling thread.
+    """
+
+    def __init__(self, workers: int = 2, maxDimension: int = 2048, jpegQuality: int = 85) -> None:
+        """
+        Initialize an ImageIngestPool instance.
+
+        :param workers: The number of worker processes, 0 to ingest on the calling thread.
+        :param maxDimension: The maximum width and height of images.
+        :param jpegQuality: The quality of JPEG and WEBP output.
+        """
+        self.workers = max(0, workers)
+        self.maxDimension = maxDimension
+        self.jpegQuality = jpegQuality
+        self._executor: t.Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def _createExecutor(self, startMethod: str) -> Executor:
+        logger.info(f"Starting image ingest pool with {self.workers} {startMethod} workers")
+        context = multiprocessing.get_context(startMethod)
+        if startMethod == "forkserver":
+            context.set_forkserver_preload([__name__])
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def start(self) -> None:
+        """Fork the worker processes, call while the process has no other threads."""
+        if not self.workers:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._createExecutor("fork")
+                # a fork pool starts all workers on the first task
+                self._executor.submit(int).result()
+
+    @property
+    def executor(self) -> t.Optional[Executor]:
+        """The process pool, created on first use if it was not started."""
+        if self._executor is not None or not self.workers:
+            return self._executor
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._createExecutor("forkserver")
+        return self._executor
+
+    def _discard(self, executor: Executor) -> None:
+        """Drop a broken pool, the next use creates a new one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def ingestDataUrls(self, dataUrls: t.List[str]) -> t.List[Media]:
+        """
+        Ingest javascript data URLs.
+
+        :param dataUrls: The javascript data URLs.
+        :raises ValueError: If a data URL or image is invalid.
+        :raises ImageIngestError: If the worker processes failed.
+        :return: The raw data and mime type of each rendition, in order.
+        """
+        decoded = [decodeDataUrl(dataUrl) for dataUrl in dataUrls]
+        executor = self.executor
+        if executor is None or not decoded:
+            return [ingestMedia(data, mimeType, self.maxDimension, self.jpegQuality) for data, mimeType in decoded]
+        try:
+            futures = [
+                executor.submit(ingestMedia, data, mimeType, self.maxDimension, self.jpegQuality)
+                for data, mimeType in decoded
+            ]
+            return [future.result() for future in futures]
+        except ValueError:
+            raise
+        except BrokenProcessPool as e:
+            logger.error(f"Image ingest worker crashed, restarting the pool: {e}")
+            self._discard(executor)
+            raise ImageIngestError("Image ingest workers failed") from e
+        except Exception as e:
+            logger.error(f"Image ingest failed: {e}")
+            raise ImageIngestError("Image ingest failed") from e
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,124 @@
+import os
+import sys
+import base64
+import binascii
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from dotenv import load_dotenv
+
+
+def migrateAttachmentsToBlobStore(dbSession: so.Session, keepLegacyFiles: bool = False, batchSize: int = 100) -> None:
+    """
+    Move attachments stored as base64 text files into the blob store as raw bytes.
+
+    Attachments already in the blob store are skipped, so it is safe to run more than once.
+
+    :param dbSession: The database session.
+    :param keepLegacyFiles: Whether to keep the base64 text files after migrating them.
+    :param batchSize: The number of attachments loaded and committed at a time.
+    """
+    from ChatLLMv2.BlobStore import BlobStore
+    from ChatLLMv2.DataHandler import MessageAttachment
+    from APIv2.modules.AttachmentStore import createBlobStore
+
+    blobStore = createBlobStore()
+    migrated, missing, invalid = 0, 0, 0
+    legacyFiles: list[str] = []
+    lastId = 0
+    while True:
+        # attachments are loaded a batch at a time by id, not all at once
+        attachments = dbSession.scalars(
+            sa.select(MessageAttachment)
+            .where(MessageAttachment.id > lastId)
+            .order_by(MessageAttachment.id)
+            .limit(batchSize)
+        ).all()
+        if not attachments:
+            break
+        lastId = attachments[-1].id
+        for attachment in attachments:
+            if BlobStore.isKey(attachment.blobName) and blobStore.exists(attachment.blobName):
+                continue
+            legacyDataPath = attachment.legacyDataPath
+            if not os.path.exists(legacyDataPath):
+                print(f"Attachment {attachment.id} data not found at {legacyDataPath}, skipping")
+                missing += 1
+                continue
+            with open(legacyDataPath, "rb") as f:
+                try:
+                    data = base64.b64decode(f.read(), validate=True)
+                except binascii.Error:
+                    print(f"Attachment {attachment.id} data at {legacyDataPath} is not base64, skipping")
+                    invalid += 1
+                    continue
+            attachment.blobName = blobStore.put(data)
+            legacyFiles.append(legacyDataPath)
+            migrated += 1
+        dbSession.commit()
+        # the committed batch is not needed anymore
+        dbSession.expunge_all()
+        print(f"Migrated {migrated} attachments")
+
+    # only remove the old files once the new blob names are committed
+    if not keepLegacyFiles:
+        for legacyDataPath in legacyFiles:
+            if os.path.exists(legacyDataPath):
+                os.remove(legacyDataPath)
+    print(f"Migrated {migrated} attachments, {missing} missing, {invalid} invalid")
+
+
+def migrateChatMessageCounters(engine: sa.Engine) -> None:
+    """
+    Add the message_count, last_role and last_message_at columns to chats and backfill them from chat_messages.
+
+    Columns that already exist are kept, the backfill is always run so it is safe to run more than once.
+
+    :param engine: The database engine.
+    """
+    existingColumns = [column["name"] for column in sa.inspect(engine).get_columns("chats")]
+    newColumns = {
+        "message_count": "INTEGER NOT NULL DEFAULT 0",
+        "last_role": "VARCHAR",
+        "last_message_at": "TIMESTAMP",
+    }
+    with engine.begin() as connection:
+        for name, definition in newColumns.items():
+            if name in existingColumns:
+                continue
+            print(f"Adding column chats.{name}")
+            connection.execute(sa.text(f"ALTER TABLE chats ADD COLUMN {name} {definition}"))
+
+        print("Backfilling chat message counters")
+        connection.execute(sa.text("""
+            UPDATE chats SET
+                message_count = (
+                    SELECT COUNT(*) FROM chat_messages WHERE chat_messages.chat_id = chats.id
+                ),
+                last_role = (
+                    SELECT role FROM chat_messages WHERE chat_messages.chat_id = chats.id
+                    ORDER BY chat_messages.id DESC LIMIT 1
+                ),
+                last_message_at = (
+                    SELECT "dateTime" FROM chat_messages WHERE chat_messages.chat_id = chats.id
+                    ORDER BY chat_messages.id DESC LIMIT 1
+                )
+        """))
+    print("Chat message counters migrated")
+
+
+if __name__ == "__main__":
+
+    load_dotenv('.env')
+    args = sys.argv
+    if len(args) < 2 or args[1] not in ["attachments", "chatCounters"]:
+        raise Exception("Invalid input format is [migrate.py attachments [--keep-legacy-files]] or [migrate.py chatCounters]")
+
+    from APIv2.config import settings
+
+    engine = sa.create_engine(url=settings.applicationDatabaseURI)
+    dbSession = so.Session(engine, expire_on_commit=False)
+
+    if args[1] == "attachments":
+        migrateAttachmentsToBlobStore(dbSession, keepLegacyFiles="--keep-legacy-files" in args)
+    if args[1] == "chatCounters":
+        migrateChatMessageCounters(engine)
@@ -0,0 +1,112 @@
+import csv
+import io
+import unittest
+
+from ChatLLM.Tools.MTR.routing import MTRRouter
+from ChatLLM.Tools.MTR.stations import StationNameIndex
+
+
+# two lines meeting at Central Hub, and a line not connected to them
+STATIONS_CSV = """Line Code,Direction,Station Code,Station ID,Chinese Name,English Name,Sequence
+AAA,UT,ALP,1,阿爾法,Alpha,1.00
+AAA,UT,BET,2,貝塔,Beta,2.00
+AAA,UT,CEN,3,中樞,Central Hub,3.00
+AAA,DT,CEN,3,中樞,Central Hub,1.00
+AAA,DT,BET,2,貝塔,Beta,2.00
+AAA,DT,ALP,1,阿爾法,Alpha,3.00
+BBB,UT,CEN,3,中樞,Central Hub,1.00
+BBB,UT,DEL,4,德爾塔,Delta,2.00
+BBB,UT,ECH,5,回聲,Echo,3.00
+CCC,UT,FOX,6,狐步,Foxtrot,1.00
+CCC,UT,GOL,7,高爾夫,Golf,2.00
+"""
+
+NAMED_STATIONS = [
+    {"Station ID": "1", "English Name": "Tsim Sha Tsui", "Chinese Name": "尖沙咀"},
+    {"Station ID": "2", "English Name": "Kowloon", "Chinese Name": "九龍"},
+    {"Station ID": "3", "English Name": "Kowloon Tong", "Chinese Name": "九龍塘"},
+    {"Station ID": "4", "English Name": "Central", "Chinese Name": "中環"},
+    {"Station ID": "5", "English Name": "Admiralty", "Chinese Name": "金鐘"},
+]
+
+
+class MTRRouterTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.router = MTRRouter(list(csv.DictReader(io.StringIO(STATIONS_CSV))), minutesPerStop=2.0, interchangeMinutes=5.0)
+
+    def testSameLineRoute(self):
+        route = self.router.route(1, 3)
+        assert route is not None
+        self.assertEqual(route.minutes, 4.0)
+        self.assertEqual((route.stops, route.interchanges), (2, 0))
+        self.assertEqual([(leg.lineCode, leg.fromStationId, leg.toStationId, leg.stops) for leg in route.legs], [("AAA", 1, 3, 2)])
+
+    def testInterchangeRoute(self):
+        route = self.router.route(1, 5)
+        assert route is not None
+        self.assertEqual(route.minutes, 2 * 4.0 + 5.0)
+        self.assertEqual((route.stops, route.interchanges), (4, 1))
+        self.assertEqual(
+            [(leg.lineCode, leg.fromStationId, leg.toStationId, leg.stops) for leg in route.legs],
+            [("AAA", 1, 3, 2), ("BBB", 3, 5, 2)],
+        )
+
+    def testReverseRoute(self):
+        route = self.router.route(5, 1)
+        assert route is not None
+        self.assertEqual([(leg.lineCode, leg.fromStationId, leg.toStationId) for leg in route.legs], [("BBB", 5, 3), ("AAA", 3, 1)])
+
+    def testSameStation(self):
+        route = self.router.route(3, 3)
+        assert route is not None
+        self.assertEqual((route.minutes, route.stops, route.interchanges, route.legs), (0.0, 0, 0, []))
+
+    def testUnconnectedStation(self):
+        self.assertIsNone(self.router.route(1, 6))
+        self.assertIsNone(self.router.travelMinutes(7, 5))
+        self.assertEqual(self.router.travelMinutes(6, 7), 2.0)
+
+    def testUnknownStation(self):
+        self.assertFalse(self.router.hasStation(99))
+        self.assertIsNone(self.router.route(1, 99))
+
+    def testSkipsMalformedRows(self):
+        router = MTRRouter([{"Line Code": "AAA", "Direction": "UT", "Station ID": "x", "Sequence": "1"}, {"Line Code": "AAA"}])
+        self.assertEqual(router.stationIds, [])
+
+
+class StationNameIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index = StationNameIndex(NAMED_STATIONS)
+
+    def stationIds(self, query: str, limit: int = 4) -> tuple[list[str], str]:
+        stations, match = self.index.search(query, limit)
+        return [station["Station ID"] for station in stations], match
+
+    def testExactName(self):
+        self.assertEqual(self.stationIds("tsim sha tsui"), (["1"], "exact"))
+        self.assertEqual(self.stationIds("Tsim-Sha-Tsui"), (["1"], "exact"))
+        self.assertEqual(self.stationIds("中環"), (["4"], "exact"))
+
+    def testJyutpingName(self):
+        self.assertEqual(self.stationIds("zim1 saa1 zeoi2"), (["1"], "folded"))
+
+    def testPrefix(self):
+        self.assertEqual(self.stationIds("kowl"), (["2", "3"], "prefix"))
+        self.assertEqual(self.stationIds("kowl", limit=1), (["2"], "prefix"))
+        self.assertEqual(self.stationIds("九龍塘"), (["3"], "exact"))
+
+    def testMisspelledName(self):
+        self.assertEqual(self.stationIds("Admirality"), (["5"], "similar"))
+
+    def testNoMatch(self):
+        self.assertEqual(self.stationIds("xyz"), ([], "none"))
+        self.assertEqual(self.stationIds(""), ([], "none"))
+
+
+if __name__ == "__main__":
+    unittest.main()
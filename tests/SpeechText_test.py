@@ -0,0 +1,127 @@
+import struct
+import unittest
+import typing as t
+
+from APIv2.modules.SpeechText import OGG_PAGE_HEADER, joinOggOpus, oggCrc, readOggPages, splitSentences
+
+
+# a SILK 20 ms frame, TOC byte of configuration 1 with one frame, 960 samples at 48 kHz
+OPUS_PACKET = bytes([0x08]) + bytes(10)
+
+
+def referenceCrc(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+def oggPage(headerType: int, granule: int, serial: int, sequence: int, packets: t.Sequence[bytes]) -> bytes:
+    lacing = bytearray()
+    for packet in packets:
+        lacing += bytes([255] * (len(packet) // 255) + [len(packet) % 255])
+    page = bytearray(OGG_PAGE_HEADER.pack(b"OggS", 0, headerType, granule, serial, sequence, 0, len(lacing)))
+    page += lacing + b"".join(packets)
+    struct.pack_into("<I", page, 22, referenceCrc(page))
+    return bytes(page)
+
+
+def oggOpusStream(serial: int, audioPages: int, trimmed: int = 0) -> bytes:
+    """
+    Build an Ogg Opus stream of two packets per audio page, with the last granule trimmed by `trimmed` samples.
+    """
+    pages = [
+        oggPage(0x02, 0, serial, 0, [b"OpusHead" + bytes(11)]),
+        oggPage(0x00, 0, serial, 1, [b"OpusTags" + bytes(8)]),
+    ]
+    for i in range(audioPages):
+        last = i == audioPages - 1
+        granule = 2 * 960 * (i + 1) - (trimmed if last else 0)
+        pages.append(oggPage(0x04 if last else 0x00, granule, serial, i + 2, [OPUS_PACKET, OPUS_PACKET]))
+    return b"".join(pages)
+
+
+def pageHeaders(data: bytes) -> list[tuple[int, int, int, int, bool]]:
+    """
+    Read the header type, granule position, serial number, sequence number and whether the checksum is valid of each page.
+    """
+    headers: list[tuple[int, int, int, int, bool]] = []
+    offset = 0
+    while offset < len(data):
+        _, _, headerType, granule, serial, sequence, crc, segments = OGG_PAGE_HEADER.unpack_from(data, offset)
+        lacing = data[offset + OGG_PAGE_HEADER.size:offset + OGG_PAGE_HEADER.size + segments]
+        page = bytearray(data[offset:offset + OGG_PAGE_HEADER.size + segments + sum(lacing)])
+        struct.pack_into("<I", page, 22, 0)
+        headers.append((headerType, granule, serial, sequence, crc == referenceCrc(bytes(page))))
+        offset += len(page)
+    return headers
+
+
+class SplitSentencesTest(unittest.TestCase):
+
+    def testJoinsShortSentences(self):
+        self.assertEqual(splitSentences("Hello there. How are you? Fine."), ["Hello there. How are you? Fine."])
+
+    def testSplitsAtSentenceEnds(self):
+        self.assertEqual(splitSentences("Hello there. How are you? Fine.", 15), ["Hello there.", "How are you?", "Fine."])
+
+    def testSplitsChinesePunctuation(self):
+        self.assertEqual(splitSentences("你好。今天天氣很好！", 8), ["你好。", "今天天氣很好！"])
+
+    def testKeepsDecimals(self):
+        self.assertEqual(splitSentences("It costs 3.5 dollars. Thanks.", 21), ["It costs 3.5 dollars.", "Thanks."])
+
+    def testSplitsLines(self):
+        self.assertEqual(splitSentences("Line one\nLine two", 8), ["Line one", "Line two"])
+
+    def testSplitsLongSentenceAtSpaces(self):
+        text = " ".join(["word"] * 100)
+        chunks = splitSentences(text, 50)
+        self.assertTrue(all(len(chunk) <= 50 for chunk in chunks))
+        self.assertEqual(" ".join(chunks), text)
+
+    def testEmpty(self):
+        self.assertEqual(splitSentences(""), [])
+
+
+class JoinOggOpusTest(unittest.TestCase):
+
+    def testCrcMatchesReference(self):
+        page = bytearray(oggOpusStream(1, 1)[:OGG_PAGE_HEADER.size + 1 + 19])
+        struct.pack_into("<I", page, 22, 0)
+        self.assertEqual(oggCrc(bytes(page)), referenceCrc(bytes(page)))
+
+    def testSingleStreamUnchanged(self):
+        stream = oggOpusStream(7, 3, trimmed=300)
+        self.assertEqual(joinOggOpus([stream]), stream)
+
+    def testJoinsIntoOneLogicalStream(self):
+        joined = joinOggOpus([oggOpusStream(111, 3, trimmed=300), oggOpusStream(222, 2, trimmed=100)])
+
+        headers = pageHeaders(joined)
+        self.assertEqual(len(headers), 2 + 3 + 2)
+        self.assertEqual({serial for _, _, serial, _, _ in headers}, {111})
+        self.assertEqual([sequence for _, _, _, sequence, _ in headers], list(range(len(headers))))
+        self.assertEqual([headerType for headerType, _, _, _, _ in headers], [0x02] + [0x00] * 5 + [0x04])
+        # the trimmed end of the first stream is replaced by its full length, so the second continues after it
+        self.assertEqual([granule for _, granule, _, _, _ in headers], [0, 0, 1920, 3840, 5760, 5760 + 1920, 5760 + 3840 - 100])
+
+    def testJoinedPagesHaveValidCrc(self):
+        joined = joinOggOpus([oggOpusStream(111, 2), oggOpusStream(222, 2), oggOpusStream(333, 1)])
+        self.assertEqual(len(pageHeaders(joined)), 2 + 2 + 2 + 1)
+        self.assertTrue(all(valid for _, _, _, _, valid in pageHeaders(joined)))
+
+    def testKeepsAudioPackets(self):
+        joined = joinOggOpus([oggOpusStream(111, 2), oggOpusStream(222, 3)])
+        bodies = [body for _, _, _, _, body in readOggPages(joined)]
+        self.assertEqual(bodies[2:], [OPUS_PACKET * 2] * 5)
+
+    def testRejectsTruncatedStream(self):
+        with self.assertRaises(ValueError):
+            joinOggOpus([oggOpusStream(111, 2)[:-5]])
+
+
+if __name__ == "__main__":
+    unittest.main()